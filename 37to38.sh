@@ -20,29 +20,22 @@ fi
 # 从输入文件名中提取基本名称（去除.txt后缀）
 BASENAME=$(basename "$INPUT_FILE" .txt)
 
-# 关键修改：构建输出文件名为 XXX_hg38.txt
+# 构建输出文件名
 OUTPUT_FILE="${BASENAME}_hg38.txt"
 
-# 关键修改：指定要调用的R脚本
-R_SCRIPT="37to38.R"
-
-# 检查R脚本是否存在
-if [ ! -f "$R_SCRIPT" ]; then
-    echo "错误: R脚本 '$R_SCRIPT' 未在当前目录找到。"
-    exit 1
-fi
-
+# 坐标转换由 liftover.py 完成 (需要当前目录下的 UCSC chain 文件 hg19ToHg38.over.chain.gz)
+SCRIPT_DIR=$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)
 
 echo "==> 开始处理 (hg19 -> hg38)..."
 echo "    输入文件: $INPUT_FILE"
 echo "    输出文件: $OUTPUT_FILE"
 
-# 使用 Rscript 命令执行R脚本，并传递输入和输出文件名作为参数
-Rscript "$R_SCRIPT" "$INPUT_FILE" "$OUTPUT_FILE"
+# 使用 Python 执行坐标转换，输出 ${BASENAME}_hg38.txt 到当前目录
+python3 "$SCRIPT_DIR/liftover.py" --from hg19 --to hg38 --overwrite "$INPUT_FILE"
 
-# 检查R脚本是否成功执行
-if [ "$?" -eq 0 ]; then
+# 检查脚本是否成功执行
+if [ "$?" -eq 0 ] && [ -f "$OUTPUT_FILE" ]; then
     echo "==> 成功生成文件: $OUTPUT_FILE"
 else
-    echo "==> R脚本执行失败。"
+    echo "==> 坐标转换失败。"
 fi
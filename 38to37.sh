@@ -23,26 +23,19 @@ BASENAME=$(basename "$INPUT_FILE" .txt)
 # 构建输出文件名
 OUTPUT_FILE="${BASENAME}_hg37.txt"
 
-# 定义R脚本的名称
-R_SCRIPT="38to37.R"
-
-# 检查R脚本是否存在
-if [ ! -f "$R_SCRIPT" ]; then
-    echo "错误: R脚本 '$R_SCRIPT' 未在当前目录找到。"
-    exit 1
-fi
-
+# 坐标转换由 liftover.py 完成 (需要当前目录下的 UCSC chain 文件 hg38ToHg19.over.chain.gz)
+SCRIPT_DIR=$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)
 
 echo "==> 开始处理..."
 echo "    输入文件: $INPUT_FILE"
 echo "    输出文件: $OUTPUT_FILE"
 
-# 使用 Rscript 命令执行R脚本，并传递输入和输出文件名作为参数
-Rscript "$R_SCRIPT" "$INPUT_FILE" "$OUTPUT_FILE"
+# 使用 Python 执行坐标转换，输出 ${BASENAME}_hg37.txt 到当前目录
+python3 "$SCRIPT_DIR/liftover.py" --from hg38 --to hg19 --overwrite "$INPUT_FILE"
 
-# 检查R脚本是否成功执行
-if [ "$?" -eq 0 ]; then
+# 检查脚本是否成功执行
+if [ "$?" -eq 0 ] && [ -f "$OUTPUT_FILE" ]; then
     echo "==> 成功生成文件: $OUTPUT_FILE"
 else
-    echo "==> R脚本执行失败。"
+    echo "==> 坐标转换失败。"
 fi
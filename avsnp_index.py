@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+ANNOVAR avsnp150 (hg19_avsnp150.txt.gz / hg38_avsnp150.txt.gz) 的按染色体分片、可 mmap 的注释索引，
+用于补全摘要统计数据中缺失的 CHR/BP 或 SNP 列 (替代 README 第 5 节中需要 58-62G 内存的 R 代码)。
+
+1. build: 按块流式读取 avsnp150，按 README 中 R 代码的规则预处理
+   (V4 = A2, V5 = A1；去掉等位基因为 '-' 的行；起止位置不同时 BP 取中点并四舍五入到偶数)，
+   先把每条染色体的数据追加写入临时文件，再逐条染色体排序，生成目录 <avsnp150>.idx/:
+       CHR{c}.rsid.npy / rsid_bp.npy / rsid_key.npy   按 rsID 排序: rsID -> (BP, 等位基因键)
+       CHR{c}.pos.npy  / pos_rsid.npy / pos_key.npy    按 BP 排序:   BP -> (rsID, 等位基因键)
+       meta.json                                        染色体列表、每条染色体的SNP数和源文件签名
+   峰值内存只与最大的一条染色体有关 (约 2-4G)。
+2. fill-chrbp: 通过 SNP + A1 + A2 补全 CHR 和 BP (在各染色体分片的 rsID 数组上批量二分查找)。
+   fill-snp:   通过 CHR + BP + A1 + A2 补全 SNP (在对应染色体分片的 BP 数组上批量二分查找)。
+   摘要统计文件按块流式处理，索引以 mmap 方式打开，整体只需几 G 内存。
+   等位基因按无序对比较 ({A1, A2} 一致即可，与 sumstats_qc 的规则相同)；
+   找不到的行保留，补全的列为 NA；同一位点有多个匹配时取第一个。
+
+用法:
+    python avsnp_index.py build --avsnp hg19_avsnp150.txt.gz
+    python avsnp_index.py fill-chrbp --index hg19_avsnp150.txt.gz.idx --sumstats gwas_NoBPCHR.txt --out my_gwas_with_CHR_BP.txt
+    python avsnp_index.py fill-snp --index hg19_avsnp150.txt.gz.idx --sumstats gwas_NoSNP.txt --out Gwas_with_SNP.txt
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+from column_profiles import read_header
+from hm3_index import rsid_to_int
+from sumstats_io import OUTPUT_COMPRESSIONS, OUTPUT_FORMATS, SumstatsWriter, iter_sumstats_chunks
+
+INDEX_SUFFIX = '.idx'
+BUILD_CHUNK_SIZE = 5000000
+_KEY_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# 每个分片的数组: 名称 -> dtype
+_RSID_ARRAYS = {'rsid': np.int64, 'rsid_bp': np.int32, 'rsid_key': np.uint64}
+_POS_ARRAYS = {'pos': np.int32, 'pos_rsid': np.int64, 'pos_key': np.uint64}
+
+
+def normalize_chrom(values):
+    """染色体名去掉 'chr' 前缀并统一大小写，使 'chr1'/'1'、'chrX'/'X' 互相匹配。"""
+    s = pd.Series(np.asarray(values, dtype=object)).astype('string').str.strip()
+    s = s.str.replace(r'^chr', '', regex=True, case=False).str.upper()
+    return s.replace({'M': 'MT'}).fillna('').to_numpy(dtype=object)
+
+
+def allele_pair_hash(a1, a2):
+    """
+    等位基因无序对的 64 位键: {A, G} 与 {G, A} 得到相同的值，大小写不敏感。
+    与 sumstats_qc.allele_pair_keys 不同，这里对任意长度的等位基因都有效。
+    """
+    h1 = pd.util.hash_array(pd.Series(np.asarray(a1, dtype=object)).astype('string').str.upper()
+                            .fillna('').to_numpy(dtype=object))
+    h2 = pd.util.hash_array(pd.Series(np.asarray(a2, dtype=object)).astype('string').str.upper()
+                            .fillna('').to_numpy(dtype=object))
+    lo = np.minimum(h1, h2)
+    hi = np.maximum(h1, h2)
+    return (lo * _KEY_MULTIPLIER) ^ hi
+
+
+def _shard_name(chrom):
+    return 'CHR' + re.sub(r'[^0-9A-Za-z_.-]', '_', chrom)
+
+
+def _source_signature(path):
+    st = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+def _prepare_chunk(chunk):
+    """按 README 中 R 代码的规则预处理 avsnp150 的一个数据块。"""
+    chunk = chunk[(chunk['A1'] != '-') & (chunk['A2'] != '-')]
+    start = chunk['pos_start'].to_numpy(dtype=np.int64)
+    end = chunk['pos_end'].to_numpy(dtype=np.int64)
+    # R 的 round() 对 .5 取偶数，np.round 的规则相同
+    bp = np.where(start == end, start, np.round((start + end) / 2)).astype(np.int32)
+    rsid = rsid_to_int(chunk['SNP'].to_numpy())
+    keep = rsid >= 0
+    return (normalize_chrom(chunk['CHR'].to_numpy())[keep], bp[keep], rsid[keep],
+            allele_pair_hash(chunk['A1'].to_numpy()[keep], chunk['A2'].to_numpy()[keep]))
+
+
+def build_index(avsnp_path, out_dir=None, chunk_size=BUILD_CHUNK_SIZE):
+    """流式读取 avsnp150 并生成按染色体分片的索引目录，返回 AvsnpIndex。"""
+    out_dir = out_dir or avsnp_path + INDEX_SUFFIX
+    tmp_dir = os.path.join(out_dir, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    # 第一遍: 把每条染色体的 (BP, rsID, 等位基因键) 追加写入各自的临时二进制文件
+    handles = {}
+    total = 0
+    reader = pd.read_csv(
+        avsnp_path, sep='\t', header=None, usecols=[0, 1, 2, 3, 4, 5],
+        names=['CHR', 'pos_start', 'pos_end', 'A2', 'A1', 'SNP'],
+        dtype={'CHR': str, 'A2': str, 'A1': str, 'SNP': str}, chunksize=chunk_size
+    )
+    try:
+        for chunk in reader:
+            chroms, bp, rsid, key = _prepare_chunk(chunk)
+            total += len(chunk)
+            order = np.argsort(chroms, kind='stable')
+            chroms, bp, rsid, key = chroms[order], bp[order], rsid[order], key[order]
+            names, starts = np.unique(chroms, return_index=True)
+            bounds = list(starts) + [len(chroms)]
+            for i, chrom in enumerate(names):
+                lo, hi = bounds[i], bounds[i + 1]
+                if chrom not in handles:
+                    base = os.path.join(tmp_dir, _shard_name(chrom))
+                    handles[chrom] = [open(f"{base}.{name}.bin", 'wb') for name in ('bp', 'rsid', 'key')]
+                for handle, arr in zip(handles[chrom], (bp, rsid, key)):
+                    arr[lo:hi].tofile(handle)
+            print(f"  -> 已读取 {total} 行...")
+    finally:
+        for files in handles.values():
+            for handle in files:
+                handle.close()
+
+    # 第二遍: 逐条染色体排序并保存 (同一时间只有一条染色体在内存中)
+    counts = {}
+    for chrom in handles:
+        base = os.path.join(tmp_dir, _shard_name(chrom))
+        bp = np.fromfile(f"{base}.bp.bin", dtype=np.int32)
+        rsid = np.fromfile(f"{base}.rsid.bin", dtype=np.int64)
+        key = np.fromfile(f"{base}.key.bin", dtype=np.uint64)
+        shard = os.path.join(out_dir, _shard_name(chrom))
+
+        order = np.lexsort((bp, rsid))
+        for name, arr in zip(_RSID_ARRAYS, (rsid, bp, key)):
+            np.save(f"{shard}.{name}.npy", arr[order])
+        order = np.lexsort((rsid, bp))
+        for name, arr in zip(_POS_ARRAYS, (bp, rsid, key)):
+            np.save(f"{shard}.{name}.npy", arr[order])
+        counts[chrom] = int(len(bp))
+        del bp, rsid, key, order
+        print(f"  -> 染色体 {chrom}: {counts[chrom]} 个SNP")
+    shutil.rmtree(tmp_dir)
+
+    meta = dict(_source_signature(avsnp_path), chromosomes=list(counts), counts=counts)
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return load_index(out_dir)
+
+
+class AvsnpIndex:
+    """按染色体分片的索引；各分片的数组在首次使用时以只读 mmap 方式打开。"""
+
+    def __init__(self, index_dir, chromosomes):
+        self.index_dir = index_dir
+        self.chromosomes = list(chromosomes)
+        self._shards = {}
+
+    def shard(self, chrom):
+        if chrom not in self.chromosomes:
+            return None
+        if chrom not in self._shards:
+            base = os.path.join(self.index_dir, _shard_name(chrom))
+            self._shards[chrom] = {
+                name: np.load(f"{base}.{name}.npy", mmap_mode='r')
+                for name in list(_RSID_ARRAYS) + list(_POS_ARRAYS)
+            }
+        return self._shards[chrom]
+
+    @staticmethod
+    def _search(sorted_values, keys, query, query_key):
+        """
+        在排好序的 sorted_values 中批量查找 query，返回第一个值相等且等位基因键一致的下标 (找不到为 -1)。
+        同一个值可能对应多行 (多等位位点)，逐层检查第 k 个候选，直到所有查询都匹配或候选用完。
+        """
+        lo = np.searchsorted(sorted_values, query, side='left')
+        hi = np.searchsorted(sorted_values, query, side='right')
+        hit = np.full(len(query), -1, dtype=np.int64)
+        k = 0
+        while True:
+            candidate = lo + k
+            active = (candidate < hi) & (hit < 0)
+            if not active.any():
+                break
+            rows = np.flatnonzero(active)
+            match = np.asarray(keys[candidate[rows]]) == query_key[rows]
+            hit[rows[match]] = candidate[rows[match]]
+            k += 1
+        return hit
+
+    def lookup_position(self, snp_ids, a1, a2):
+        """SNP + A1 + A2 -> (CHR, BP)。返回染色体名数组 (找不到为 None) 与 BP 数组 (找不到为 -1)。"""
+        rsid = rsid_to_int(snp_ids)
+        key = allele_pair_hash(a1, a2)
+        chroms = np.full(len(rsid), None, dtype=object)
+        bp = np.full(len(rsid), -1, dtype=np.int64)
+        for chrom in self.chromosomes:
+            pending = np.flatnonzero((bp < 0) & (rsid >= 0))
+            if len(pending) == 0:
+                break
+            shard = self.shard(chrom)
+            hit = self._search(shard['rsid'], shard['rsid_key'], rsid[pending], key[pending])
+            found = hit >= 0
+            bp[pending[found]] = np.asarray(shard['rsid_bp'][hit[found]])
+            chroms[pending[found]] = chrom
+        return chroms, bp
+
+    def lookup_rsid(self, chroms, positions, a1, a2):
+        """CHR + BP + A1 + A2 -> rsID 整数 (找不到为 -1)。"""
+        chroms = normalize_chrom(chroms)
+        positions = pd.to_numeric(pd.Series(positions), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        key = allele_pair_hash(a1, a2)
+        rsid = np.full(len(positions), -1, dtype=np.int64)
+        for chrom in pd.unique(chroms):
+            shard = self.shard(chrom)
+            if shard is None:
+                continue
+            rows = np.flatnonzero(chroms == chrom)
+            hit = self._search(shard['pos'], shard['pos_key'], positions[rows], key[rows])
+            found = hit >= 0
+            rsid[rows[found]] = np.asarray(shard['pos_rsid'][hit[found]])
+        return rsid
+
+
+def load_index(index_dir):
+    """打开已生成的索引目录。"""
+    with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return AvsnpIndex(index_dir, meta['chromosomes'])
+
+
+def fill_chrbp_chunk(chunk, index):
+    """通过 SNP、A1、A2 补全 CHR 和 BP，列顺序与原 R 代码一致 (SNP, CHR, BP, 其余列)。"""
+    chroms, bp = index.lookup_position(chunk['SNP'].to_numpy(), chunk['A1'].to_numpy(), chunk['A2'].to_numpy())
+    rest = [c for c in chunk.columns if c not in ('SNP', 'CHR', 'BP')]
+    return pd.concat([
+        chunk[['SNP']].reset_index(drop=True),
+        pd.DataFrame({'CHR': chroms, 'BP': pd.array(np.where(bp >= 0, bp, None), dtype='Int64')}),
+        chunk[rest].reset_index(drop=True)
+    ], axis=1)
+
+
+def fill_snp_chunk(chunk, index):
+    """通过 CHR、BP、A1、A2 补全 SNP，列顺序与原 R 代码一致 (SNP, 其余列)。"""
+    rsid = index.lookup_rsid(chunk['CHR'].to_numpy(), chunk['BP'].to_numpy(),
+                             chunk['A1'].to_numpy(), chunk['A2'].to_numpy())
+    snp = np.where(rsid >= 0, np.char.add('rs', rsid.astype(str)), None)
+    rest = [c for c in chunk.columns if c != 'SNP']
+    return pd.concat([pd.DataFrame({'SNP': snp}), chunk[rest].reset_index(drop=True)], axis=1)
+
+
+def annotate_file(mode, index, sumstats, out, compress='none', threads=1, out_format='tsv', chunk_size=500000):
+    """流式补全一个摘要统计文件，返回 (总行数, 成功补全的行数)。"""
+    required = ['SNP', 'A1', 'A2'] if mode == 'fill-chrbp' else ['CHR', 'BP', 'A1', 'A2']
+    columns, sep = read_header(sumstats)
+    missing = [c for c in required if c not in columns]
+    if missing:
+        raise ValueError(f"输入文件缺少 {', '.join(missing)} 列")
+    dtype = {c: str for c in ('SNP', 'CHR', 'A1', 'A2') if c in columns}
+
+    fill = fill_chrbp_chunk if mode == 'fill-chrbp' else fill_snp_chunk
+    target = 'BP' if mode == 'fill-chrbp' else 'SNP'
+    total = filled = 0
+    writer = SumstatsWriter(out, compress=compress, threads=threads, out_format=out_format)
+    with open(out, 'wb') as out_file:
+        for chunk in iter_sumstats_chunks(sumstats, chunk_size, sep=sep or '\t', dtype=dtype):
+            result = fill(chunk, index)
+            total += len(result)
+            filled += int(result[target].notna().sum())
+            out_file.write(writer.encode(result, header=total == len(result), offset=out_file.tell()))
+        writer.finish(out_file)
+    writer.close()
+    return total, filled
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="avsnp150 注释索引：构建索引，并据此补全 CHR/BP 或 SNP 列。")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="由 hg19/hg38_avsnp150.txt.gz 生成按染色体分片的索引。")
+    build.add_argument('--avsnp', required=True, help="avsnp150 文件路径 (例如 hg19_avsnp150.txt.gz)。")
+    build.add_argument('--out', help="索引输出目录。默认为 <avsnp>.idx")
+
+    for name, help_text in (('fill-chrbp', "通过 SNP、A1、A2 补全 CHR 和 BP。"),
+                            ('fill-snp', "通过 CHR、BP、A1、A2 补全 SNP。")):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('--index', required=True, help="build 生成的索引目录。")
+        sub.add_argument('--sumstats', required=True, help="输入的摘要统计文件。")
+        sub.add_argument('--out', required=True, help="输出文件路径。")
+        sub.add_argument('--compress', choices=OUTPUT_COMPRESSIONS, default='none', help="输出压缩方式。默认为 'none'。")
+        sub.add_argument('--threads', type=int, default=1, help="BGZF 块压缩使用的线程数。默认为 1。")
+        sub.add_argument('--out-format', choices=OUTPUT_FORMATS, default='tsv', help="输出格式。默认为 'tsv'。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    if args.command == 'build':
+        if not os.path.exists(args.avsnp):
+            print(f"[!] 错误: 文件 '{args.avsnp}' 不存在。", file=sys.stderr)
+            sys.exit(1)
+        print(f"[*] 正在构建注释索引: {args.avsnp}")
+        index = build_index(args.avsnp, args.out)
+        print(f"✨ 构建完成！共 {len(index.chromosomes)} 条染色体，索引已保存至 {index.index_dir}")
+        return
+
+    try:
+        index = load_index(args.index)
+    except (OSError, ValueError) as e:
+        print(f"[!] 错误: 无法打开索引 '{args.index}': {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"[*] 开始处理文件: {args.sumstats}")
+    try:
+        total, filled = annotate_file(args.command, index, args.sumstats, args.out, args.compress,
+                                      args.threads, args.out_format)
+    except Exception as e:
+        print(f"[!] 处理文件时发生意外错误: {e}", file=sys.stderr)
+        sys.exit(1)
+    target = 'CHR、BP' if args.command == 'fill-chrbp' else 'SNP'
+    print(f"✅ 共 {total} 行，其中 {filled} 行成功补全 {target}。")
+    print(f"✨ 处理完成！结果已保存至 {args.out}")
+
+
+if __name__ == '__main__':
+    main()
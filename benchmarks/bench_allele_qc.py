@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+等位基因质控微基准测试：比较 finn_clean_plus 旧的逐行 apply 路径与 sumstats_qc 的向量化路径。
+
+用法:
+    python benchmarks/bench_allele_qc.py --rows 5000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sumstats_qc import match_reference_alleles, drop_strand_ambiguous  # noqa: E402
+
+
+def make_chunk(rows, ref_fraction, seed):
+    """生成一个合成的 GWAS 片段及对应的 HM3 风格参考表。"""
+    rng = np.random.default_rng(seed)
+    bases = np.array(['A', 'C', 'G', 'T'])
+    snp = np.char.add('rs', np.arange(1, rows + 1).astype(str)).astype(object)
+    a1 = bases[rng.integers(0, 4, rows)].astype(object)
+    a2 = bases[rng.integers(0, 4, rows)].astype(object)
+    # 混入少量 indel，覆盖字符串回退路径
+    indel_idx = rng.choice(rows, size=max(1, rows // 200), replace=False)
+    a1[indel_idx] = 'AT'
+    chunk = pd.DataFrame({'SNP': snp, 'A1': a1, 'A2': a2, 'P': rng.random(rows)})
+
+    ref_idx = np.sort(rng.choice(rows, size=int(rows * ref_fraction), replace=False))
+    ref = chunk.iloc[ref_idx][['SNP', 'A1', 'A2']].copy()
+    # 参考中一部分等位基因顺序翻转、一部分不一致
+    flip = rng.random(len(ref)) < 0.5
+    ref.loc[flip, ['A1', 'A2']] = ref.loc[flip, ['A2', 'A1']].values
+    bad = rng.random(len(ref)) < 0.05
+    ref.loc[bad, 'A1'] = 'G'
+    return chunk, ref.reset_index(drop=True)
+
+
+def legacy_filter(gwas_chunk, merge_alleles_df):
+    """finn_clean_plus 原来的逐行实现 (步骤 3 与 4)。"""
+    merged_chunk = pd.merge(gwas_chunk, merge_alleles_df, on='SNP', how='inner', suffixes=('', '_ref'))
+    allele_match_mask = merged_chunk.apply(
+        lambda r: {r['A1'], r['A2']} == {r['A1_ref'], r['A2_ref']},
+        axis=1
+    )
+    gwas_chunk = merged_chunk[allele_match_mask].copy()
+    gwas_chunk.drop(columns=['A1_ref', 'A2_ref'], inplace=True)
+
+    ambiguous_sets = [{'A', 'T'}, {'C', 'G'}]
+    allele_sets = gwas_chunk.apply(lambda r: {str(r['A1']).upper(), str(r['A2']).upper()}, axis=1)
+    non_ambiguous_mask = allele_sets.apply(lambda s: s not in ambiguous_sets)
+    return gwas_chunk[non_ambiguous_mask].copy()
+
+
+def vectorized_filter(gwas_chunk, merge_alleles_df):
+    return drop_strand_ambiguous(match_reference_alleles(gwas_chunk, merge_alleles_df))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="等位基因质控微基准测试 (逐行 apply vs 向量化)。")
+    parser.add_argument('--rows', type=int, default=5000000, help="合成片段的行数。默认为 5000000。")
+    parser.add_argument('--ref-fraction', type=float, default=0.25, help="参考表覆盖的SNP比例。默认为 0.25。")
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--skip-legacy', action='store_true', help="跳过 (很慢的) 旧实现，只测向量化路径。")
+    args = parser.parse_args()
+
+    print(f"[*] 生成 {args.rows} 行的合成片段...")
+    chunk, ref = make_chunk(args.rows, args.ref_fraction, args.seed)
+
+    new_result, new_time = timed(vectorized_filter, chunk, ref)
+    print(f"向量化实现: {new_time:8.2f} 秒, 保留 {len(new_result)} 行, {args.rows / new_time:,.0f} 行/秒")
+
+    if args.skip_legacy:
+        return
+
+    old_result, old_time = timed(legacy_filter, chunk, ref)
+    print(f"逐行 apply : {old_time:8.2f} 秒, 保留 {len(old_result)} 行, {args.rows / old_time:,.0f} 行/秒")
+    print(f"加速比: {old_time / new_time:.1f}x")
+
+    same = old_result.reset_index(drop=True).equals(new_result.reset_index(drop=True))
+    print(f"结果一致: {'是' if same else '否'}")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
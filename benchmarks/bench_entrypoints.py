@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+清洗入口的端到端基准测试：对 finn_clean.py、finn_clean_plus.py 和 format_sumstats.py 的处理函数
+在不同的片段大小下计时，记录吞吐量 (行/秒)、峰值内存 (RSS) 和耗时，写出可比较的 JSON 报告。
+
+输入由 benchmarks/make_sumstats.py 生成 (读取其 manifest.json)。每次运行在一个新的子进程中完成，
+峰值 RSS 互不影响；输出写在临时目录中，每次运行前清空 (避免检查点续传跳过已完成的片段)。
+--baseline 给出之前的报告时，打印相同 (入口, 文件, 片段大小) 的耗时对比。
+
+用法:
+    python benchmarks/make_sumstats.py --rows 1000000 --out-dir bench_data
+    python benchmarks/bench_entrypoints.py --data-dir bench_data --chunk-sizes 100000 500000 1000000 --out report.json
+    python benchmarks/bench_entrypoints.py --data-dir bench_data --out new.json --baseline report.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+ENTRY_POINTS = {
+    # 入口名: 适用的输入布局
+    'finn_clean': 'finngen',
+    'finn_clean_plus': 'finngen',
+    'format_sumstats': 'catalog',
+}
+# 与 finn_clean.py / finn_clean_plus.py 的 main() 中相同
+FINNGEN_RENAME = {
+    '#chrom': 'CHR', 'pos': 'BP', 'ref': 'A2', 'alt': 'A1', 'rsids': 'SNP',
+    'pval': 'P', 'beta': 'BETA', 'sebeta': 'SE', 'af_alt': 'FRQ'
+}
+FINNGEN_FINAL_COLUMNS = ['CHR', 'BP', 'A1', 'A2', 'SNP', 'P', 'BETA', 'SE', 'FRQ', 'N']
+
+
+def _finngen_metadata(path):
+    import pandas as pd
+    phenocode = os.path.basename(path).replace('finngen_R12_', '').replace('.gz', '')
+    return pd.DataFrame({'phenocode': [phenocode], 'num_cases': [20000], 'num_controls': [380000]}).set_index('phenocode')
+
+
+def _count_rows(path):
+    """统计输出文件的数据行数 (不含表头)。"""
+    with open(path, 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b'')) - 1
+
+
+def run_one(entry, input_path, chunk_size, snplist):
+    """在当前 (子) 进程中运行一次入口函数，返回结果字典。工作目录应为空的临时目录。"""
+    start = time.perf_counter()
+    if entry == 'finn_clean':
+        import finn_clean
+        status = finn_clean.process_file_in_chunks(
+            input_path, _finngen_metadata(input_path), FINNGEN_RENAME, FINNGEN_FINAL_COLUMNS, chunk_size=chunk_size)
+    elif entry == 'finn_clean_plus':
+        import finn_clean_plus
+        from hm3_index import load_or_compile
+        finn_clean_plus.CHUNK_SIZE = chunk_size
+        # 参考索引在计时前已编译 (见 main)，这里只是 mmap 打开
+        reference_index = load_or_compile(snplist) if snplist else None
+        status = finn_clean_plus.process_single_file(
+            input_path, _finngen_metadata(input_path), FINNGEN_RENAME, FINNGEN_FINAL_COLUMNS, reference_index)
+    else:
+        import format_sumstats
+        from column_profiles import resolve_mapping
+        info = resolve_mapping(input_path)
+        format_sumstats.format_file(input_path, 'out.txt', info['mapping'], sep=info['sep'],
+                                    chunk_size=chunk_size, verbose=False)
+        status = "成功处理"
+    seconds = time.perf_counter() - start
+
+    outputs = [name for name in os.listdir('.') if name.endswith('.txt')]
+    return {
+        'status': status,
+        'seconds': seconds,
+        'rows_out': _count_rows(outputs[0]) if outputs else 0,
+        # Linux 上 ru_maxrss 的单位为 KB
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_in_subprocess(entry, input_path, chunk_size, snplist):
+    workdir = tempfile.mkdtemp(prefix=f'bench_{entry}_')
+    try:
+        command = [sys.executable, os.path.abspath(__file__), '--run-one', entry, os.path.abspath(input_path),
+                   str(chunk_size), os.path.abspath(snplist) if snplist else '']
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if completed.returncode != 0:
+            return {'status': f"错误: 子进程退出码 {completed.returncode}: {completed.stderr.strip()[-500:]}", 'wall_seconds': wall}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result['wall_seconds'] = wall
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def environment_info():
+    import numpy as np
+    import pandas as pd
+    return {
+        'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+        'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def compare_with_baseline(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r['entry'], r['input'], r['chunk_size']): r for r in baseline.get('results', [])
+                if 'rows_per_sec' in r}
+    print(f"\n--- 与基线 {baseline_path} 对比 ---")
+    for r in results:
+        old = previous.get((r['entry'], r['input'], r['chunk_size']))
+        if old is None or 'rows_per_sec' not in r:
+            continue
+        ratio = r['rows_per_sec'] / old['rows_per_sec']
+        print(f"{r['entry']:<16} {r['input']:<28} {r['chunk_size']:>9}  "
+              f"{old['rows_per_sec']:>12,.0f} -> {r['rows_per_sec']:>12,.0f} 行/秒 ({ratio:.2f}x)")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="清洗入口的端到端基准测试 (吞吐量、峰值内存、耗时)。")
+    parser.add_argument('--data-dir', default='bench_data', help="make_sumstats.py 的输出目录。默认为 bench_data。")
+    parser.add_argument('--entry', nargs='+', choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS),
+                        help="要测试的入口。默认全部。")
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[100000, 500000, 1000000],
+                        help="测试的片段大小 (行)。默认为 100000 500000 1000000。")
+    parser.add_argument('--repeat', type=int, default=1, help="每个组合重复运行的次数。默认为 1。")
+    parser.add_argument('--out', default='bench_report.json', help="JSON 报告路径。默认为 bench_report.json。")
+    parser.add_argument('--baseline', help="之前的 JSON 报告，用于对比吞吐量。")
+    parser.add_argument('--run-one', nargs=4, metavar=('ENTRY', 'INPUT', 'CHUNK_SIZE', 'SNPLIST'),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.run_one:
+        entry, input_path, chunk_size, snplist = args.run_one
+        # 入口函数的进度信息输出到 stderr，stdout 的最后一行留给 JSON 结果
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        result = run_one(entry, input_path, int(chunk_size), snplist or None)
+        sys.stdout = stdout
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    manifest_path = os.path.join(args.data_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        print(f"❌ 错误: 找不到 {manifest_path}，请先运行 benchmarks/make_sumstats.py。", file=sys.stderr)
+        sys.exit(1)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    results = []
+    for entry in args.entry:
+        inputs = [(name, info) for name, info in manifest['files'].items() if info['layout'] == ENTRY_POINTS[entry]]
+        if not inputs:
+            print(f"⚠️ 警告: 没有 {ENTRY_POINTS[entry]} 布局的输入，跳过 {entry}。")
+            continue
+        for name, info in sorted(inputs, key=lambda item: item[1]['rows']):
+            input_path = os.path.join(args.data_dir, name)
+            snplist = None
+            if entry == 'finn_clean_plus' and info.get('snplist'):
+                from hm3_index import load_or_compile
+                snplist = os.path.join(args.data_dir, info['snplist'])
+                load_or_compile(snplist)
+            for chunk_size in args.chunk_sizes:
+                for repeat in range(args.repeat):
+                    result = run_in_subprocess(entry, input_path, chunk_size, snplist)
+                    record = {'entry': entry, 'input': name, 'rows': info['rows'], 'chunk_size': chunk_size,
+                              'repeat': repeat, **result}
+                    if str(result['status']).startswith('成功'):
+                        record['rows_per_sec'] = info['rows'] / result['seconds']
+                        print(f"✅ {entry:<16} {name:<28} 片段 {chunk_size:>9}: {result['seconds']:8.2f} 秒, "
+                              f"{record['rows_per_sec']:>12,.0f} 行/秒, 峰值 {result['peak_rss_mb']:8.1f} MB, "
+                              f"输出 {result['rows_out']:,} 行")
+                    else:
+                        print(f"❌ {entry:<16} {name:<28} 片段 {chunk_size:>9}: {result['status']}")
+                    results.append(record)
+
+    report = {'environment': environment_info(), 'data_dir': os.path.abspath(args.data_dir), 'results': results}
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✨ 报告已保存至 {args.out}")
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+合成摘要统计数据生成器，为 benchmarks/bench_entrypoints.py 提供可重复的测试输入。
+
+生成两种布局 (行数可配置，例如 1M-30M):
+  finngen : FinnGen R12 原始布局 (finngen_R12_{表型}.gz，BGZF 压缩，13 列)，供 finn_clean.py / finn_clean_plus.py 使用；
+  catalog : GWAS Catalog 协调格式 ({名称}.h.tsv，制表符分隔)，供 format_sumstats.py --auto 使用。
+数据按 CHR、BP 排序，混入一定比例的缺失/无效 P 值 (NA、空、0、负数、>1、非数字)、
+链模糊等位基因 (A/T、C/G)、插入缺失和缺少 rsID 的行；FinnGen 文件另附一个覆盖部分 SNP 的
+参考列表 {文件名}.snplist (w_hm3.snplist 格式，一部分等位基因顺序翻转、一部分不一致)，
+所有文件的行数等信息记录在 manifest.json 中。
+
+用法:
+    python benchmarks/make_sumstats.py --rows 1000000 5000000 --layout finngen catalog --out-dir bench_data
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bgzf import BGZF_EOF, BgzfCompressor  # noqa: E402
+
+MANIFEST_NAME = 'manifest.json'
+FINNGEN_COLUMNS = ['#chrom', 'pos', 'ref', 'alt', 'rsids', 'nearest_genes', 'pval', 'mlogp',
+                   'beta', 'sebeta', 'af_alt', 'af_alt_cases', 'af_alt_controls']
+CATALOG_COLUMNS = ['chromosome', 'base_pair_location', 'effect_allele', 'other_allele', 'beta',
+                   'standard_error', 'effect_allele_frequency', 'p_value', 'variant_id', 'rsid', 'n']
+# 无效 P 值的候选写法 (pandas 读取后为 NaN，或超出 (0, 1] 范围)
+BAD_P_VALUES = np.array(['NA', '', 'nan', '0', '-0.5', '1.5', 'abc'], dtype=object)
+# 各染色体的相对长度 (hg38, Mb)，23 为 X (FinnGen 的写法)
+CHROM_LENGTHS = np.array([248, 242, 198, 190, 181, 171, 159, 145, 138, 134, 135, 133, 114, 107, 102, 90,
+                          83, 80, 59, 64, 47, 51, 156], dtype=np.float64)
+BASES = np.array(['A', 'C', 'G', 'T'], dtype=object)
+BLOCK_ROWS = 1000000
+
+
+def _chrom_row_counts(rows):
+    counts = np.floor(rows * CHROM_LENGTHS / CHROM_LENGTHS.sum()).astype(np.int64)
+    counts[0] += rows - counts.sum()
+    return counts
+
+
+def _iter_blocks(rows, rng):
+    """按染色体顺序逐块产出 (CHR, BP, 全局行号) 数组，每块不超过 BLOCK_ROWS 行。"""
+    row_id = 0
+    for chrom, count in enumerate(_chrom_row_counts(rows), start=1):
+        length = int(CHROM_LENGTHS[chrom - 1] * 1e6)
+        step = max(1, length // max(count, 1))
+        pos = 10000
+        for start in range(0, count, BLOCK_ROWS):
+            n = min(BLOCK_ROWS, count - start)
+            bp = pos + np.cumsum(rng.integers(1, 2 * step, n))
+            pos = int(bp[-1])
+            yield np.full(n, chrom, dtype=np.int64), bp, np.arange(row_id, row_id + n)
+            row_id += n
+
+
+def _alleles(n, rng, ambiguous_fraction, indel_fraction):
+    """生成 (ref, alt)：非模糊的 SNP 为主，按比例混入 A/T、C/G 链模糊对和插入缺失。"""
+    first = rng.integers(0, 4, n)
+    # 非模糊的另一个碱基: 排除自身 (i) 和互补碱基 (3 - i)
+    offset = rng.integers(0, 2, n)
+    others = np.array([[1, 2], [0, 3], [0, 3], [1, 2]])
+    second = others[first, offset]
+    ambiguous = rng.random(n) < ambiguous_fraction
+    second[ambiguous] = 3 - first[ambiguous]
+    ref, alt = BASES[first], BASES[second]
+    indel = rng.random(n) < indel_fraction
+    alt[indel] = ref[indel] + BASES[rng.integers(0, 4, int(indel.sum()))]
+    return ref, alt
+
+
+def _p_values(n, rng, bad_p_fraction):
+    p = np.clip(rng.random(n) ** 3, 1e-300, 1.0)
+    text = np.char.mod('%.4g', p).astype(object)
+    bad = rng.random(n) < bad_p_fraction
+    text[bad] = BAD_P_VALUES[rng.integers(0, len(BAD_P_VALUES), int(bad.sum()))]
+    return p, text
+
+
+def _block_frame(layout, chrom, bp, row_id, rng, args, snplist_parts):
+    n = len(chrom)
+    ref, alt = _alleles(n, rng, args.ambiguous_fraction, args.indel_fraction)
+    p, p_text = _p_values(n, rng, args.bad_p_fraction)
+    rsid = np.char.add('rs', (row_id + 1).astype(str)).astype(object)
+    beta = np.round(rng.normal(0, 0.05, n), 5)
+    se = np.round(rng.uniform(0.005, 0.1, n), 5)
+    af = np.round(rng.uniform(0.001, 0.999, n), 5)
+
+    # 参考 SNP 列表: 抽取一部分非插入缺失的 SNP，其中一半等位基因顺序翻转，5% 不一致
+    pick = (rng.random(n) < args.ref_fraction) & (np.char.str_len(alt.astype(str)) == 1)
+    a1, a2 = alt[pick].copy(), ref[pick].copy()
+    flip = rng.random(len(a1)) < 0.5
+    a1[flip], a2[flip] = a2[flip], a1[flip]
+    mismatch = rng.random(len(a1)) < 0.05
+    a1[mismatch] = 'G'
+    snplist_parts.append(pd.DataFrame({'SNP': rsid[pick], 'A1': a1, 'A2': a2}))
+
+    if layout == 'finngen':
+        # 约 3% 的变异没有 rsID，1% 有多个 rsID (逗号分隔)
+        missing = rng.random(n) < 0.03
+        rsid[missing] = ''
+        multi = (rng.random(n) < 0.01) & ~missing
+        rsid[multi] = rsid[multi] + ',rs' + (row_id[multi] + 900000000).astype(str).astype(object)
+        mlogp = np.round(-np.log10(p), 4)
+        return pd.DataFrame({
+            '#chrom': chrom, 'pos': bp, 'ref': ref, 'alt': alt, 'rsids': rsid,
+            'nearest_genes': 'GENE' + (bp // 100000).astype(str).astype(object),
+            'pval': p_text, 'mlogp': mlogp, 'beta': beta, 'sebeta': se, 'af_alt': af,
+            'af_alt_cases': np.round(np.clip(af + rng.normal(0, 0.01, n), 0, 1), 5),
+            'af_alt_controls': af
+        }, columns=FINNGEN_COLUMNS)
+    return pd.DataFrame({
+        'chromosome': chrom, 'base_pair_location': bp, 'effect_allele': alt, 'other_allele': ref,
+        'beta': beta, 'standard_error': se, 'effect_allele_frequency': af, 'p_value': p_text,
+        'variant_id': chrom.astype(str).astype(object) + '_' + bp.astype(str).astype(object) + '_' + ref + '_' + alt,
+        'rsid': rsid, 'n': args.n
+    }, columns=CATALOG_COLUMNS)
+
+
+def generate_file(path, layout, rows, args, seed):
+    """写出一个合成文件，返回其中的参考 SNP 列表 (DataFrame)。"""
+    rng = np.random.default_rng(seed)
+    snplist_parts = []
+    compressor = BgzfCompressor(threads=args.threads) if layout == 'finngen' else None
+    tmp_path = path + '.tmp'
+    header = True
+    with open(tmp_path, 'wb') as out:
+        for chrom, bp, row_id in _iter_blocks(rows, rng):
+            frame = _block_frame(layout, chrom, bp, row_id, rng, args, snplist_parts)
+            data = frame.to_csv(sep='\t', index=False, header=header, na_rep='NA').encode()
+            header = False
+            out.write(compressor.compress(data)[0] if compressor else data)
+        if compressor:
+            out.write(BGZF_EOF)
+            compressor.close()
+    os.replace(tmp_path, path)
+    return pd.concat(snplist_parts, ignore_index=True)
+
+
+def file_name(layout, rows):
+    tag = f"SYN{rows // 1000000}M" if rows % 1000000 == 0 else f"SYN{rows}"
+    return f"finngen_R12_{tag}.gz" if layout == 'finngen' else f"{tag}.h.tsv"
+
+
+def snplist_name(name):
+    return name[:-len('.gz')] + '.snplist'
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="生成 FinnGen R12 / GWAS Catalog 布局的合成摘要统计数据。")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000], help="每个文件的行数 (可给出多个)。默认为 1000000。")
+    parser.add_argument('--layout', nargs='+', choices=['finngen', 'catalog'], default=['finngen', 'catalog'],
+                        help="生成的布局。默认两种都生成。")
+    parser.add_argument('--out-dir', default='bench_data', help="输出目录。默认为 bench_data。")
+    parser.add_argument('--bad-p-fraction', type=float, default=0.01, help="缺失/无效 P 值的比例。默认为 0.01。")
+    parser.add_argument('--ambiguous-fraction', type=float, default=0.15, help="链模糊等位基因 (A/T、C/G) 的比例。默认为 0.15。")
+    parser.add_argument('--indel-fraction', type=float, default=0.03, help="插入缺失的比例。默认为 0.03。")
+    parser.add_argument('--ref-fraction', type=float, default=0.1, help="写入参考 SNP 列表的 SNP 比例。默认为 0.1。")
+    parser.add_argument('--n', type=int, default=400000, help="GWAS Catalog 布局中 n 列的样本量。默认为 400000。")
+    parser.add_argument('--threads', type=int, default=4, help="BGZF 压缩线程数。默认为 4。")
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--overwrite', action='store_true', help="覆盖已存在的文件 (默认跳过)。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    os.makedirs(args.out_dir, exist_ok=True)
+    manifest_path = os.path.join(args.out_dir, MANIFEST_NAME)
+    manifest = {'files': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    for layout in args.layout:
+        for rows in args.rows:
+            name = file_name(layout, rows)
+            path = os.path.join(args.out_dir, name)
+            if os.path.exists(path) and name in manifest['files'] and not args.overwrite:
+                print(f"⏭️ 已存在，跳过: {path}")
+                continue
+            start = time.perf_counter()
+            snplist = generate_file(path, layout, rows, args, args.seed + rows)
+            entry = {
+                'layout': layout, 'rows': rows, 'bytes': os.path.getsize(path),
+                'bad_p_fraction': args.bad_p_fraction, 'ambiguous_fraction': args.ambiguous_fraction,
+                'indel_fraction': args.indel_fraction, 'seed': args.seed + rows
+            }
+            if layout == 'finngen':
+                entry['snplist'] = snplist_name(name)
+                snplist.to_csv(os.path.join(args.out_dir, entry['snplist']), sep='\t', index=False)
+            manifest['files'][name] = entry
+            print(f"✅ {path}: {rows:,} 行, {os.path.getsize(path) / 1024 ** 2:.1f} MB, 用时 {time.perf_counter() - start:.1f} 秒")
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+基于清单 (manifest) 的增量构建缓存，替代空的 {phenocode}.done 标记和"输出文件已存在即跳过"的判断。
+
+清单是一个 JSON 文件 (默认 build_manifest.json)，记录:
+  files   : 每个输入/参考文件的 大小、mtime (纳秒) 和 SHA-256。大小与 mtime 都未变时直接沿用记录的哈希，
+            只有变化过的文件才重新计算 (首次运行时需要对所有输入计算一次)；
+  outputs : 每个输出文件的构建签名 —— 输入与参考文件的哈希、对应的元数据行 (例如 num_cases/num_controls)
+            和影响结果的处理参数 (列名映射、过滤条件、输出格式等) 合在一起的摘要。
+输出只在签名改变 (或输出文件不存在) 时才重新生成；改动元数据表中某个表型的样本量、更换 HapMap3 列表
+或修改过滤参数后，只有受影响的输出会被重建。
+
+对于没有清单记录但已存在的输出 (升级前的结果)，status() 返回 'untracked'，由调用方决定是否直接沿用
+(例如 finn_clean.py 在存在 .done 标记时沿用，并记录当前签名)。
+清单只由主进程读写，保存时先写临时文件再改名。
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MANIFEST_NAME = 'build_manifest.json'
+_HASH_BLOCK = 1 << 22
+
+
+def file_sha256(path):
+    """流式计算文件的 SHA-256。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def jsonable(value):
+    """把 numpy 标量等转换为可 JSON 序列化的 Python 值 (用于元数据行)。"""
+    if isinstance(value, dict):
+        return {str(k): jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class BuildManifest:
+    """输出文件的构建签名清单。输出路径以相对于清单所在目录的形式保存，输入文件以绝对路径保存。"""
+
+    def __init__(self, path=DEFAULT_MANIFEST_NAME):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.files = {}
+        self.outputs = {}
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.files = data.get('files', {})
+                self.outputs = data.get('outputs', {})
+            except (OSError, ValueError):
+                # 清单损坏时视为没有任何记录，所有输出按 untracked/missing 处理
+                self.files, self.outputs = {}, {}
+
+    def _key(self, output):
+        return os.path.relpath(os.path.abspath(output), self.base_dir)
+
+    def fingerprint(self, path):
+        """返回文件的 {size, mtime_ns, sha256}；大小和 mtime 未变时沿用清单中的哈希。"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        known = self.files.get(path)
+        if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+            return known
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': file_sha256(path)}
+        self.files[path] = entry
+        self.dirty = True
+        return entry
+
+    def prefetch(self, paths, threads=4):
+        """并行计算一批文件的哈希 (只计算大小或 mtime 变化过的文件)。"""
+        paths = sorted({os.path.abspath(p) for p in paths if p})
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            list(executor.map(self.fingerprint, paths))
+
+    def signature(self, inputs, params=None):
+        """
+        inputs 为 {角色: 路径} (路径可为 None)，params 为可 JSON 序列化的参数。
+        返回 (摘要, 明细)；明细按角色记录输入哈希，不含路径，因此移动输入文件不会触发重建。
+        """
+        detail = {
+            'inputs': {role: (self.fingerprint(path)['sha256'] if path else None) for role, path in inputs.items()},
+            'params': jsonable(params or {}),
+        }
+        text = json.dumps(detail, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest(), detail
+
+    def status(self, output, digest):
+        """
+        返回输出相对于签名 digest 的状态:
+        'current' (已是最新) / 'stale' (签名已变) / 'missing' (输出不存在) / 'untracked' (输出存在但清单中没有记录)。
+        """
+        entry = self.outputs.get(self._key(output))
+        if not os.path.exists(output):
+            return 'missing'
+        if entry is None:
+            return 'untracked'
+        return 'current' if entry.get('signature') == digest else 'stale'
+
+    def begin(self, output, digest):
+        """开始 (重新) 生成输出：清除旧签名，只记录正在构建的签名，中断后的输出不会被当作最新结果。"""
+        self.outputs[self._key(output)] = {'pending': digest}
+        self.dirty = True
+
+    def resumable(self, output, digest):
+        """
+        输出旁的检查点能否续传：上一次中断的构建使用相同签名时可以；清单中没有记录时 (升级前中断的任务)
+        沿用原来的续传逻辑；签名已变时检查点对应旧的元数据/参数，调用方应删除检查点从头生成。
+        """
+        entry = self.outputs.get(self._key(output))
+        return entry is None or entry.get('pending') == digest
+
+    def record(self, output, digest, detail):
+        self.outputs[self._key(output)] = {'signature': digest, **detail}
+        self.dirty = True
+
+    def up_to_date(self, output, digest, detail, adopt=True):
+        """
+        输出是否无需重建。没有记录但已存在的输出在 adopt 为 True 时视为升级前的完整结果：
+        记录当前签名并沿用 (与原来"已存在即跳过"一致)，之后输入或参数的改动都能被检测到。
+        """
+        state = self.status(output, digest)
+        if state == 'untracked' and adopt:
+            self.record(output, digest, detail)
+            return True
+        return state == 'current'
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'outputs': self.outputs}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+断点续传支持：按行切块读取 gzip 输入 + 带校验和的检查点 (checkpoint) 文件。
+
+1. iter_gzip_chunks() 自行解压 gzip 输入并按行数切块 (不依赖 pandas 的读取器)，
+   因此能精确知道每个片段结束时对应的输入行数和解压后字节偏移。
+   解压过程中在每个 gzip 成员 (member) 的起点记录"访问点" (压缩偏移, 解压偏移)。
+   FinnGen 的 .gz 文件是 bgzip 格式 (由约 64KB 的独立成员串联而成)，几乎处处都有访问点；
+   续传时直接 seek 到最近的访问点开始解压，无需从头解压整个前缀。
+   普通单成员 gzip 只有起点一个访问点，续传时仍需从头解压，但跳过的部分不再做 CSV 解析。
+
+2. ChunkCheckpoint 在输出文件旁维护一个 JSON-lines 格式的检查点文件：
+   第一行记录输入文件的签名，之后每个已完成的片段一行，记录
+   输入行数/字节偏移、输出行数/字节偏移、该片段输出内容的 CRC32 以及 gzip 访问点。
+   每个片段的输出先写入并 fsync，再追加检查点记录，所以检查点中的记录总是指向已落盘的数据。
+   续传时校验最后一条记录对应的输出内容，把输出文件截断到最后一个完好的片段末尾，
+   从而丢弃崩溃时写了一半的残行。
+"""
+
+import json
+import os
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+# 读取压缩数据的块大小
+_READ_SIZE = 1 << 18
+
+GzipChunk = namedtuple('GzipChunk', ['header', 'data', 'rows_end', 'bytes_end', 'access_point'])
+
+
+def _nth_newline(data, n):
+    """返回 data 中第 n 个 (从1开始) 换行符的位置。"""
+    return int(np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)[n - 1])
+
+
+def _read_header(path):
+    """解压文件开头直到第一个换行符，返回表头行 (含换行符)。"""
+    d = zlib.decompressobj(wbits=31)
+    buf = b''
+    with open(path, 'rb') as raw:
+        while b'\n' not in buf:
+            block = raw.read(1 << 16)
+            if not block:
+                break
+            buf += d.decompress(block)
+    end = buf.find(b'\n')
+    return buf if end < 0 else buf[:end + 1]
+
+
+def _decompress_from(raw, access_point):
+    """
+    从给定访问点开始解压，逐块产出 (解压数据, 最近的访问点)。
+    每遇到一个新的 gzip 成员，就把它的起点作为新的访问点。
+    """
+    coffset, uoffset = access_point
+    raw.seek(coffset)
+    raw_pos = coffset
+    upos = uoffset
+    member_point = (coffset, uoffset)
+    d = zlib.decompressobj(wbits=31)
+
+    while True:
+        block = raw.read(_READ_SIZE)
+        if not block:
+            break
+        raw_pos += len(block)
+        while block:
+            out = d.decompress(block)
+            upos += len(out)
+            if out:
+                yield out, member_point
+            if d.eof:
+                # 当前成员结束，剩余字节 (或下一次读取的开头) 就是下一个成员的起点
+                block = d.unused_data
+                member_point = (raw_pos - len(block), upos)
+                d = zlib.decompressobj(wbits=31)
+            else:
+                block = b''
+
+
+def iter_gzip_chunks(path, chunk_rows, resume=None):
+    """
+    按 chunk_rows 行切分 gzip 文本文件，逐块产出 GzipChunk。
+    resume 为检查点记录 (dict) 时，从记录的输入位置继续，第一块之前的内容不会被产出。
+    """
+    header = _read_header(path)
+    if resume:
+        access_point = (resume['gz_offset'], resume['gz_uoffset'])
+        rows_done = resume['in_rows']
+        skip = resume['in_bytes'] - resume['gz_uoffset']
+    else:
+        access_point = (0, 0)
+        rows_done = 0
+        skip = len(header)
+
+    bytes_done = access_point[1] + skip
+    pieces = []
+    newlines = 0
+
+    with open(path, 'rb') as raw:
+        for data, point in _decompress_from(raw, access_point):
+            if skip:
+                cut = min(skip, len(data))
+                data = data[cut:]
+                skip -= cut
+                if not data:
+                    continue
+
+            count = data.count(b'\n')
+            while newlines + count >= chunk_rows:
+                split = _nth_newline(data, chunk_rows - newlines) + 1
+                pieces.append(data[:split])
+                chunk = b''.join(pieces)
+                rows_done += chunk_rows
+                bytes_done += len(chunk)
+                yield GzipChunk(header, chunk, rows_done, bytes_done, point)
+                data = data[split:]
+                count = data.count(b'\n')
+                pieces = []
+                newlines = 0
+            if data:
+                pieces.append(data)
+                newlines += count
+                last_point = point
+
+        if pieces:
+            chunk = b''.join(pieces)
+            if not chunk.endswith(b'\n'):
+                newlines += 1
+            rows_done += newlines
+            bytes_done += len(chunk)
+            yield GzipChunk(header, chunk, rows_done, bytes_done, last_point)
+
+
+class ChunkCheckpoint:
+    """管理单个输出文件的检查点 sidecar (JSON-lines)。"""
+
+    def __init__(self, checkpoint_path, output_path, source_path, chunk_rows):
+        self.checkpoint_path = checkpoint_path
+        self.output_path = output_path
+        self.chunk_rows = chunk_rows
+        st = os.stat(source_path)
+        self.signature = {
+            'source': os.path.basename(source_path), 'size': st.st_size,
+            'mtime': int(st.st_mtime), 'chunk_rows': chunk_rows
+        }
+        self.last = None
+
+    def _load_records(self):
+        """读取检查点记录；忽略崩溃时写了一半的最后一行。"""
+        records = []
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def _verify(self, record, previous_out_bytes):
+        """校验输出文件中该记录对应区间的 CRC32。"""
+        length = record['out_bytes'] - previous_out_bytes
+        with open(self.output_path, 'rb') as f:
+            f.seek(previous_out_bytes)
+            data = f.read(length)
+        return len(data) == length and zlib.crc32(data) == record['crc32']
+
+    def resume(self):
+        """
+        找到最后一个校验通过的片段，把输出文件截断到该片段末尾并返回其记录。
+        没有可用检查点 (或输入文件已变化) 时返回 None，调用方应从头开始。
+        """
+        self.last = None
+        if not (os.path.exists(self.checkpoint_path) and os.path.exists(self.output_path)):
+            return None
+        records = self._load_records()
+        if not records or records[0] != self.signature:
+            return None
+
+        chunks = records[1:]
+        out_size = os.path.getsize(self.output_path)
+        for i in range(len(chunks) - 1, -1, -1):
+            record = chunks[i]
+            previous_out_bytes = chunks[i - 1]['out_bytes'] if i > 0 else 0
+            if record['out_bytes'] <= out_size and self._verify(record, previous_out_bytes):
+                with open(self.output_path, 'r+b') as f:
+                    f.truncate(record['out_bytes'])
+                # 重写检查点，去掉校验失败的尾部记录
+                self._rewrite([self.signature] + chunks[:i + 1])
+                self.last = record
+                return record
+        return None
+
+    def _rewrite(self, records):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def start(self):
+        """打开输出文件：有可续传的记录时追加，否则新建并写入检查点签名。"""
+        if self.last is None:
+            self._rewrite([self.signature])
+            return open(self.output_path, 'wb')
+        return open(self.output_path, 'ab')
+
+    def commit(self, out_file, data, chunk, out_rows):
+        """写出一个片段的输出内容并落盘，随后追加检查点记录。"""
+        out_file.write(data)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+        record = {
+            'chunk': self.last['chunk'] + 1 if self.last else 0,
+            'in_rows': chunk.rows_end, 'in_bytes': chunk.bytes_end,
+            'out_rows': (self.last['out_rows'] if self.last else 0) + out_rows,
+            'out_bytes': out_file.tell(), 'crc32': zlib.crc32(data),
+            'gz_offset': chunk.access_point[0], 'gz_uoffset': chunk.access_point[1]
+        }
+        with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.last = record
+
+    def finish(self):
+        """文件处理完成后删除检查点。"""
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
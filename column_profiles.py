@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+根据文件表头自动识别列名映射 (原始列名 -> 标准列名 CHR, BP, SNP, A1, A2, P, BETA, SE, FRQ, N)。
+
+识别顺序:
+1. 用户别名表 (--aliases)：两列制表符分隔文件，表头为 alias 和 standard，例如
+       alias        standard
+       chr_name     CHR
+       p_bolt       P
+2. 内置数据源配置 (BUILTIN_PROFILES)：GWAS Catalog 协调格式、IEU OpenGWAS、FinnGen、UKB (BOLT-LMM)，
+   选用能匹配最多标准列的配置。
+3. 通用别名表 (DEFAULT_ALIASES)：参照 38to37new.R 中的 col_map (chr/pos/pval/eaf/...)，补全剩余的列。
+列名匹配不区分大小写。
+
+识别结果按"表头签名" (分隔符 + 全部列名的哈希) 缓存在 JSON 文件中，同一布局的文件只识别一次；
+缓存文件可以手动编辑，用来修正某种布局的映射。
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from sumstats_io import STANDARD_COLUMNS, ParquetChunkReader, is_parquet
+
+DEFAULT_CACHE_PATH = './column_map_cache.json'
+
+# 内置数据源配置：每个标准列按优先顺序列出候选原始列名
+BUILTIN_PROFILES = {
+    # GWAS Catalog 协调格式 (*.h.tsv.gz)，优先使用 hm_ 开头的协调后列
+    'gwas_catalog': {
+        'CHR': ['hm_chrom', 'chromosome'], 'BP': ['hm_pos', 'base_pair_location'],
+        'SNP': ['hm_rsid', 'rsid', 'variant_id'], 'A1': ['hm_effect_allele', 'effect_allele'],
+        'A2': ['hm_other_allele', 'other_allele'], 'P': ['p_value'], 'BETA': ['hm_beta', 'beta'],
+        'SE': ['standard_error'], 'FRQ': ['hm_effect_allele_frequency', 'effect_allele_frequency'], 'N': ['n']
+    },
+    # IEU OpenGWAS 导出的关联结果 (ieugwasr::associations)
+    'ieu': {
+        'CHR': ['chr'], 'BP': ['position'], 'SNP': ['rsid'], 'A1': ['ea'], 'A2': ['nea'],
+        'P': ['p'], 'BETA': ['beta'], 'SE': ['se'], 'FRQ': ['eaf'], 'N': ['n']
+    },
+    # FinnGen 原始摘要统计 (样本量需另行提供，见 finn_clean.py)
+    'finngen': {
+        'CHR': ['#chrom'], 'BP': ['pos'], 'SNP': ['rsids'], 'A1': ['alt'], 'A2': ['ref'],
+        'P': ['pval'], 'BETA': ['beta'], 'SE': ['sebeta'], 'FRQ': ['af_alt']
+    },
+    # UK Biobank BOLT-LMM 输出 (ALLELE1 为效应等位基因)
+    'ukb_bolt': {
+        'CHR': ['CHR'], 'BP': ['BP'], 'SNP': ['SNP'], 'A1': ['ALLELE1'], 'A2': ['ALLELE0'],
+        'P': ['P_BOLT_LMM', 'P_BOLT_LMM_INF'], 'BETA': ['BETA'], 'SE': ['SE'], 'FRQ': ['A1FREQ']
+    },
+}
+
+# 通用别名表 {原始列名(小写): 标准列名}，与 38to37new.R 的 col_map 写法一致
+DEFAULT_ALIASES = {
+    'chr': 'CHR', 'chrom': 'CHR', 'chromosome': 'CHR', '#chrom': 'CHR', 'chr_name': 'CHR',
+    'pos': 'BP', 'bp': 'BP', 'position': 'BP', 'base_pair_location': 'BP',
+    'snp': 'SNP', 'rsid': 'SNP', 'rsids': 'SNP', 'snpid': 'SNP', 'markername': 'SNP', 'variant_id': 'SNP',
+    'effect_allele': 'A1', 'a1': 'A1', 'ea': 'A1', 'allele1': 'A1', 'alt': 'A1', 'tested_allele': 'A1',
+    'other_allele': 'A2', 'a2': 'A2', 'nea': 'A2', 'allele0': 'A2', 'allele2': 'A2', 'ref': 'A2',
+    'non_effect_allele': 'A2',
+    'pval': 'P', 'p': 'P', 'p_value': 'P', 'pvalue': 'P', 'p-value': 'P',
+    'beta': 'BETA', 'b': 'BETA', 'effect': 'BETA', 'es': 'BETA',
+    'se': 'SE', 'sebeta': 'SE', 'standard_error': 'SE', 'stderr': 'SE',
+    'eaf': 'FRQ', 'frq': 'FRQ', 'freq': 'FRQ', 'af_alt': 'FRQ', 'a1freq': 'FRQ', 'effect_allele_frequency': 'FRQ',
+    'samplesize': 'N', 'n': 'N', 'n_total': 'N', 'totalsamplesize': 'N'
+}
+
+
+def load_user_aliases(path):
+    """读取用户别名表 (alias, standard 两列的制表符分隔文件)，返回 {别名(小写): 标准列名}。"""
+    table = pd.read_csv(path, sep='\t', dtype=str)
+    missing = {'alias', 'standard'} - set(table.columns)
+    if missing:
+        raise ValueError(f"别名表 {path} 缺少列: {', '.join(sorted(missing))}")
+    aliases = {}
+    for alias, standard in zip(table['alias'], table['standard']):
+        standard = str(standard).strip().upper()
+        if standard not in STANDARD_COLUMNS:
+            raise ValueError(f"别名表 {path} 中的 '{alias}' 指向未知的标准列 '{standard}'")
+        aliases[str(alias).strip().lower()] = standard
+    return aliases
+
+
+def _open_text(path):
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def read_header(path):
+    """
+    读取文件表头，返回 (列名列表, 分隔符)。Parquet 文件的分隔符为 None；
+    文本文件按表头行猜测分隔符: 制表符 > 逗号 > 任意空白。
+    """
+    if is_parquet(path):
+        return list(ParquetChunkReader(path).columns_available), None
+    with _open_text(path) as f:
+        line = f.readline().rstrip('\r\n')
+    if '\t' in line:
+        sep = '\t'
+    elif ',' in line:
+        sep = ','
+    else:
+        sep = r'\s+'
+    columns = line.split() if sep == r'\s+' else line.split(sep)
+    return [c.strip() for c in columns], sep
+
+
+def header_signature(columns, sep, user_aliases=None):
+    """
+    表头签名：相同分隔符和列名 (含顺序) 的文件共享同一个映射。
+    给出用户别名表时签名中包含别名表的内容，修改 --aliases 后会重新识别，而不是沿用之前缓存的映射。
+    """
+    key = [sep, list(columns)]
+    if user_aliases:
+        key.append(sorted(user_aliases.items()))
+    payload = json.dumps(key, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def _match_profile(profile, lookup):
+    """返回某个内置配置在当前表头上能匹配到的 {标准列: 原始列}。"""
+    matched = {}
+    for standard, candidates in profile.items():
+        for candidate in candidates:
+            if candidate.lower() in lookup:
+                matched[standard] = lookup[candidate.lower()]
+                break
+    return matched
+
+
+def detect_mapping(columns, user_aliases=None):
+    """
+    根据列名识别映射，返回 (mapping, profile)。
+    mapping 为 {标准列: 原始列}，只包含识别到的列；profile 为采用的内置配置名 (没有则为 'aliases')。
+    """
+    lookup = {}
+    for name in columns:
+        lookup.setdefault(name.lower(), name)
+
+    mapping = {}
+    for alias, standard in (user_aliases or {}).items():
+        if alias in lookup and standard not in mapping:
+            mapping[standard] = lookup[alias]
+
+    profile_name = 'aliases'
+    best = {}
+    for name, profile in BUILTIN_PROFILES.items():
+        matched = _match_profile(profile, lookup)
+        if len(matched) > len(best):
+            profile_name, best = name, matched
+    # 只有匹配到大部分标准列时才认为是该数据源，否则只用通用别名
+    if len(best) < 6:
+        profile_name, best = 'aliases', {}
+
+    used = set(mapping.values())
+    for standard, raw in best.items():
+        if standard not in mapping and raw not in used:
+            mapping[standard] = raw
+            used.add(raw)
+    for name in columns:
+        standard = DEFAULT_ALIASES.get(name.lower())
+        if standard and standard not in mapping and name not in used:
+            mapping[standard] = name
+            used.add(name)
+    return {k: mapping[k] for k in STANDARD_COLUMNS if k in mapping}, profile_name
+
+
+class MappingCache:
+    """按表头签名缓存识别结果的 JSON 文件。"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                print(f"  -> 警告: 映射缓存 {path} 无法读取，将重新识别。")
+                self.entries = {}
+        self.dirty = False
+
+    def get(self, signature):
+        return self.entries.get(signature)
+
+    def put(self, signature, entry):
+        self.entries[signature] = entry
+        self.dirty = True
+
+    def save(self):
+        if not (self.path and self.dirty):
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def resolve_mapping(path, cache=None, user_aliases=None):
+    """
+    识别一个文件的列名映射，返回 dict(columns, sep, profile, mapping, cached)。
+    cache 中已有同一表头签名 (及同一别名表) 时直接使用缓存 (可能是用户手动修正过的映射)。
+    """
+    columns, sep = read_header(path)
+    signature = header_signature(columns, sep, user_aliases)
+    entry = cache.get(signature) if cache is not None else None
+    if entry is not None:
+        return dict(entry, cached=True)
+
+    mapping, profile = detect_mapping(columns, user_aliases)
+    entry = {'columns': columns, 'sep': sep, 'profile': profile, 'mapping': mapping}
+    # 只缓存完整的映射 (N 可由 --N 固定值提供)，识别不全的布局在补充别名后会重新识别
+    if cache is not None and all(k in mapping for k in STANDARD_COLUMNS if k != 'N'):
+        cache.put(signature, entry)
+    return dict(entry, cached=False)
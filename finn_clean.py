@@ -1,11 +1,30 @@
+import io
 import os
 import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 from tqdm import tqdm
 
-def process_file_in_chunks(gz_file_path, metadata_df, column_rename_map, final_columns, chunk_size=500000):
+from checkpoint import ChunkCheckpoint, iter_gzip_chunks
+from sumstats_io import OUTPUT_COMPRESSIONS, OUTPUT_FORMATS, SumstatsWriter, output_path
+from metrics import MetricsRecorder, run_profiled
+from build_cache import DEFAULT_MANIFEST_NAME, BuildManifest
+from sumstats_schema import chunk_size_for_budget, compact_chunk, parse_dtypes, parse_memory, select_columns
+
+# 进程池中每个工作进程共享的只读数据 (元数据表、列名映射等)，由 _init_worker 在进程启动时填充一次
+_WORKER_STATE = {}
+
+def process_file_in_chunks(gz_file_path, metadata_df, column_rename_map, final_columns, chunk_size=500000,
+                           compress='none', threads=1, out_format='tsv', metrics=None, max_mem=None):
+    # metrics 为 MetricsRecorder 时按片段记录各阶段耗时 (见 metrics.py)
+    # max_mem 为本进程的内存预算 (字节)，给出时按文件开头的样本估算片段大小，代替 chunk_size
+    file_metrics = None
+    error = None
     try:
         filename = os.path.basename(gz_file_path)
+        if max_mem:
+            chunk_size = chunk_size_for_budget(max_mem, gz_file_path)
         phenocode = filename.replace('finngen_R12_', '').replace('.gz', '')
 
         try:
@@ -16,79 +35,110 @@ def process_file_in_chunks(gz_file_path, metadata_df, column_rename_map, final_c
         except KeyError:
             return f"警告: 在 Excel 文件中找不到 Phenocode '{phenocode}'，跳过文件 {filename}"
 
-        output_filename = f"{phenocode}.txt"
-        processed_rows = 0
-        write_mode = 'w'
-        write_header = True
-
-        if os.path.exists(output_filename):
-            try:
-                with open(output_filename, 'r', encoding='utf-8') as f:
-                    lines_written = sum(1 for _ in f)
-                if lines_written > 1:
-                    processed_rows = lines_written - 1
-                    write_mode = 'a'
-                    write_header = False
-                    print(f"\n  -> 检测到部分完成的文件 {output_filename}, 从第 {processed_rows + 1} 行继续...")
-                else:
-                    processed_rows = 0
-            except Exception:
-                processed_rows = 0
-
-        if processed_rows == 0:
-             print(f"\n  -> 开始处理 {filename}, 输出至 {output_filename}, 每片 {chunk_size} 行...")
-       
-        total_rows_iterated = 0
-
-        with pd.read_csv(
-            gz_file_path,
-            compression='gzip',
-            sep='\t',
-            dtype={'#chrom': str, 'rsids': str, 'pval': str},
-            chunksize=chunk_size
-        ) as reader:
-            for chunk_df in reader:
-                current_chunk_size = len(chunk_df)
-
-                if total_rows_iterated + current_chunk_size <= processed_rows:
-                    total_rows_iterated += current_chunk_size
-                    continue
-
-                rows_to_drop = processed_rows - total_rows_iterated
-                if rows_to_drop > 0:
-                    chunk_df = chunk_df.iloc[rows_to_drop:].copy()
-                
-                total_rows_iterated += current_chunk_size
-                processed_rows = 0
+        output_filename = output_path(f"{phenocode}.txt", compress, out_format)
+        # 检查点记录每个已完成片段的输入/输出偏移和校验和 (见 checkpoint.py)
+        checkpoint = ChunkCheckpoint(f"{phenocode}.ckpt", output_filename, gz_file_path, chunk_size)
+        # Parquet 的元数据写在文件末尾，中断的文件无法续写，只能重新生成
+        resume_from = checkpoint.resume() if out_format == 'tsv' else None
 
-                if chunk_df.empty:
-                    continue
+        if resume_from:
+            print(f"\n  -> 检测到部分完成的文件 {output_filename} (已校验 {resume_from['out_rows']} 行), 从输入第 {resume_from['in_rows'] + 1} 行继续...")
+        else:
+            print(f"\n  -> 开始处理 {filename}, 输出至 {output_filename}, 每片 {chunk_size} 行...")
 
-                chunk_df['N'] = n_value
-                chunk_df.rename(columns=column_rename_map, inplace=True)
-                
-                existing_columns_to_keep = [col for col in final_columns if col in chunk_df.columns]
-                chunk_filtered = chunk_df[existing_columns_to_keep]
-                
-                chunk_filtered.to_csv(
-                    output_filename, 
-                    sep='\t', 
-                    index=False, 
-                    na_rep='NA', 
-                    mode=write_mode, 
-                    header=write_header
-                )
+        write_header = resume_from is None
+        writer = SumstatsWriter(output_filename, compress=compress, threads=threads,
+                                resumed=resume_from is not None, out_format=out_format)
+        file_metrics = (metrics or MetricsRecorder()).file(filename)
+
+        with checkpoint.start() as out_file:
+            for chunk in file_metrics.chunks(iter_gzip_chunks(gz_file_path, chunk_size, resume=resume_from)):
+                with file_metrics.stage('parse'):
+                    # 只解析需要的列，并在解析后立即转换为紧凑类型 (见 sumstats_schema.py)
+                    chunk_df = pd.read_csv(
+                        io.BytesIO(chunk.header + chunk.data),
+                        sep='\t',
+                        usecols=lambda col: col in column_rename_map,
+                        dtype=parse_dtypes(column_rename_map)
+                    )
+                file_metrics.chunk_rows(rows_in=len(chunk_df))
+
+                with file_metrics.stage('rename'):
+                    chunk_df.rename(columns=column_rename_map, inplace=True)
+                    chunk_df['N'] = n_value
+                    chunk_filtered = compact_chunk(select_columns(chunk_df, final_columns))
                 
-                write_mode = 'a'
+                with file_metrics.stage('write'):
+                    data = writer.encode(chunk_filtered, header=write_header, offset=out_file.tell())
+                    checkpoint.commit(out_file, data, chunk, len(chunk_filtered))
                 write_header = False
+                file_metrics.chunk_rows(rows_out=len(chunk_filtered))
+
+            with file_metrics.stage('write'):
+                writer.finish(out_file)
 
+        writer.close()
+        checkpoint.finish()
         return f"成功处理: {filename}"
 
     except Exception as e:
+        error = e
         return f"错误: 处理文件 {gz_file_path} 时失败: {e}"
+    finally:
+        if file_metrics is not None:
+            file_metrics.close(error)
+
+def _init_worker(metadata_df, column_rename_map, final_columns, chunk_size, compress, threads, out_format,
+                 metrics, max_mem, profile_dir):
+    """进程池初始化函数：每个工作进程只接收一次元数据，而不是每个文件重新解析 Excel。"""
+    _WORKER_STATE.update(
+        metadata_df=metadata_df,
+        column_rename_map=column_rename_map,
+        final_columns=final_columns,
+        chunk_size=chunk_size,
+        compress=compress,
+        threads=threads,
+        out_format=out_format,
+        metrics=metrics,
+        max_mem=max_mem
+    )
+    _WORKER_STATE['profile_dir'] = profile_dir
+
+def _process_in_worker(gz_file_path):
+    """工作进程入口：使用共享状态处理单个文件，返回 (文件路径, 状态信息)。"""
+    state = dict(_WORKER_STATE)
+    profile_dir = state.pop('profile_dir')
+    try:
+        return gz_file_path, run_profiled(profile_dir, os.path.basename(gz_file_path), process_file_in_chunks,
+                                          gz_file_path, **state)
+    finally:
+        # 每个文件结束后关闭指标文件，下一个文件写入时重新打开
+        state['metrics'].close()
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="清洗 FinnGen R12 摘要统计数据 (支持断点续传与多进程批处理)。")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="并行处理文件的进程数。默认为 1 (顺序处理)。")
+    parser.add_argument('--compress', choices=OUTPUT_COMPRESSIONS, default='none',
+                        help="输出压缩方式。'bgzf' 输出 {phenocode}.txt.gz 并生成 tabix 索引。默认为 'none'。")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="每个文件用于 BGZF 块压缩的线程数。默认为 1。")
+    parser.add_argument('--out-format', choices=OUTPUT_FORMATS, default='tsv',
+                        help="输出格式。'parquet' 输出 {phenocode}.parquet (按染色体分行组，需要 pyarrow)。默认为 'tsv'。")
+    parser.add_argument('--metrics', help="把每个文件/片段各阶段的耗时、行数和峰值内存以 JSON-lines 追加写入该文件。")
+    parser.add_argument('--profile', metavar='DIR', help="用 cProfile 运行每个文件，统计结果保存为 DIR/{文件名}.prof。")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_NAME,
+                        help=f"构建清单 (记录输入哈希、元数据行和参数，只重建发生变化的表型)。默认为 {DEFAULT_MANIFEST_NAME}。")
+    parser.add_argument('--force', action='store_true', help="忽略构建清单，重新处理所有文件。")
+    parser.add_argument('--max-mem', type=parse_memory,
+                        help="所有工作进程合计的内存预算 (例如 4G、800M)。给出时按每个文件的样本估算片段大小，代替固定的 500000 行。")
+    return parser.parse_args()
 
 def main():
+    args = parse_arguments()
     print("--- 脚本启动 (支持断点续传) ---")
+    if args.max_mem:
+        print(f"内存预算 {args.max_mem / 1024 ** 2:.0f} MB (所有进程合计)，每个文件的片段大小按其开头的样本估算。")
     
     excel_file_path = 'finnGen_R12.xlsx'
     print(f"正在加载元数据: {excel_file_path}...")
@@ -114,28 +164,89 @@ def main():
 
     results = []
     completed_files = []
-    print("\n--- 开始检查并处理文件，请稍候 ---")
-    
-    for gz_file_path in tqdm(gz_files, desc="总体进度", unit="个文件"):
-        phenocode = os.path.basename(gz_file_path).replace('finngen_R12_', '').replace('.gz', '')
-        done_file = f"{phenocode}.done"
+    pending_files = []
+    signatures = {}
+    chunk_size = 500000
 
-        if os.path.exists(done_file):
+    # 构建清单记录每个输出对应的输入哈希、元数据行和处理参数 (见 build_cache.py)，
+    # 只有这些内容发生变化的表型才会重新处理；原来的 {phenocode}.done 标记在首次运行时被沿用并删除。
+    manifest = BuildManifest(args.manifest)
+    print("正在检查输入文件 (只对新增或改动过的文件计算哈希)...")
+    manifest.prefetch(gz_files, threads=max(4, args.workers))
+    params = {'columns': column_rename_map, 'final_columns': final_columns,
+              'compress': args.compress, 'out_format': args.out_format}
+    adopted = 0
+
+    for gz_file_path in gz_files:
+        phenocode = os.path.basename(gz_file_path).replace('finngen_R12_', '').replace('.gz', '')
+        output_filename = output_path(f"{phenocode}.txt", args.compress, args.out_format)
+        row = metadata_df.loc[phenocode, ['num_cases', 'num_controls']].to_dict() if phenocode in metadata_df.index else None
+        digest, detail = manifest.signature({'input': gz_file_path}, {**params, 'metadata': row})
+        done_marker = f"{phenocode}.done"
+        if not args.force and manifest.up_to_date(output_filename, digest, detail, adopt=os.path.exists(done_marker)):
             completed_files.append(gz_file_path)
+            if os.path.exists(done_marker):
+                os.remove(done_marker)
+                adopted += 1
             continue
-        
-        status = process_file_in_chunks(
-            gz_file_path,
-            metadata_df=metadata_df,
-            column_rename_map=column_rename_map,
-            final_columns=final_columns,
-            chunk_size=500000
-        )
-        results.append(status)
+        if not manifest.resumable(output_filename, digest) or args.force:
+            # 检查点对应旧的元数据/参数，不能续传
+            if os.path.exists(f"{phenocode}.ckpt"):
+                os.remove(f"{phenocode}.ckpt")
+        manifest.begin(output_filename, digest)
+        signatures[gz_file_path] = (output_filename, digest, detail)
+        pending_files.append(gz_file_path)
+    manifest.save()
+    if adopted:
+        print(f"已把 {adopted} 个 .done 标记转换为构建清单记录。")
 
+    def record_status(gz_file_path, status):
+        results.append(status)
         if status.startswith("成功"):
-            with open(done_file, 'w') as f:
-                pass
+            manifest.record(*signatures[gz_file_path])
+            manifest.save()
+
+    workers = max(1, min(args.workers, len(pending_files))) if pending_files else 1
+    metrics = MetricsRecorder(args.metrics, 'finn_clean')
+    max_mem = args.max_mem // workers if args.max_mem else None
+    print(f"\n--- 开始检查并处理文件 (进程数: {workers})，请稍候 ---")
+
+    try:
+        if workers == 1:
+            for gz_file_path in tqdm(pending_files, desc="总体进度", unit="个文件"):
+                status = run_profiled(
+                    args.profile, os.path.basename(gz_file_path), process_file_in_chunks,
+                    gz_file_path,
+                    metadata_df=metadata_df,
+                    column_rename_map=column_rename_map,
+                    final_columns=final_columns,
+                    chunk_size=chunk_size,
+                    compress=args.compress,
+                    threads=args.threads,
+                    out_format=args.out_format,
+                    metrics=metrics,
+                    max_mem=max_mem
+                )
+                record_status(gz_file_path, status)
+        else:
+            # 元数据只在主进程解析一次，通过 initializer 传给每个工作进程；
+            # 构建清单仍由主进程在收到成功结果后统一写入。
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(metadata_df, column_rename_map, final_columns, chunk_size, args.compress, args.threads,
+                          args.out_format, metrics, max_mem, args.profile)
+            ) as executor:
+                futures = {executor.submit(_process_in_worker, path): path for path in pending_files}
+                for future in tqdm(as_completed(futures), total=len(futures), desc="总体进度", unit="个文件"):
+                    try:
+                        gz_file_path, status = future.result()
+                    except Exception as e:
+                        gz_file_path = futures[future]
+                        status = f"错误: 处理文件 {gz_file_path} 时失败: {e}"
+                    record_status(gz_file_path, status)
+    finally:
+        metrics.close()
 
     success_count = sum(1 for r in results if r.startswith("成功"))
     warning_count = sum(1 for r in results if r.startswith("警告"))
@@ -1,24 +1,53 @@
 # -*- coding: utf-8 -*-
 # 这是一个顺序处理 + 片段化处理的版本。
-# 它会一个接一个地处理文件，并且对每个文件内部进行分块读取，以节省内存。
+# 它会一个接一个地处理文件，并且对每个文件内部进行分块读取、逐块写出，以节省内存。
 
+import io
 import os
 import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 from tqdm import tqdm
 import numpy as np
 
+from sumstats_qc import drop_strand_ambiguous
+from hm3_index import load_or_compile, match_reference_index
+from checkpoint import ChunkCheckpoint, iter_gzip_chunks
+from sumstats_io import OUTPUT_COMPRESSIONS, OUTPUT_FORMATS, SumstatsWriter, output_path
+from metrics import MetricsRecorder, run_profiled
+from build_cache import DEFAULT_MANIFEST_NAME, BuildManifest
+from sumstats_schema import (chunk_size_for_budget, compact_chunk, parse_dtypes, parse_memory, select_columns,
+                             valid_pvalue_mask)
+
 # --- 1. 请在这里配置您的路径和参数 ---
-# (可选) 等位基因参考文件路径，如果不需要则设为 None
+# (可选) 等位基因参考文件路径，如果不需要则设为 None。
+# 首次运行时会自动编译为 <路径>.idx 二进制索引 (也可预先运行 hm3_index.py)，之后直接 mmap 打开。
 MERGE_ALLELES_FILE_PATH = './w_hm3.snplist'
 # 设置每个片段的大小（行数）。可根据您的内存大小调整。
 CHUNK_SIZE = 500000 
 
-# --- 工作者函数：处理单个文件的所有逻辑 (已修改为片段化处理) ---
-def process_single_file(gz_file_path, metadata_df, column_rename_map, final_columns, merge_alleles_df):
-    """这个函数现在使用片段化处理来高效处理单个大文件。"""
+# 进程池中每个工作进程共享的只读数据 (元数据表、等位基因参考索引等)，由 _init_worker 在进程启动时填充一次。
+# 参考索引被传递时只携带路径，各工作进程自行 mmap 打开，通过页缓存共享同一份数据。
+_WORKER_STATE = {}
+
+# --- 工作者函数：处理单个文件的所有逻辑 (片段化读取 + 流式写出) ---
+def process_single_file(gz_file_path, metadata_df, column_rename_map, final_columns, reference_index,
+                        compress='none', threads=1, out_format='tsv', metrics=None, chunk_size=None, max_mem=None):
+    """
+    这个函数使用片段化处理来高效处理单个大文件，峰值内存只与片段大小有关。
+    metrics 为 MetricsRecorder 时按片段记录各阶段耗时与过滤前后的行数 (见 metrics.py)。
+    chunk_size 默认为 CHUNK_SIZE；max_mem 为本进程的内存预算 (字节)，给出时按文件开头的样本估算片段大小。
+    """
+    file_metrics = None
+    error = None
     try:
         filename = os.path.basename(gz_file_path)
+        if max_mem:
+            chunk_size = chunk_size_for_budget(max_mem, gz_file_path)
+            print(f"\n  -> {filename}: 按内存预算每片 {chunk_size} 行")
+        else:
+            chunk_size = chunk_size or CHUNK_SIZE
         
         # --- 步骤 A: 准备工作 ---
         phenocode = filename.replace('finngen_R12_', '').replace('.gz', '')
@@ -28,82 +57,158 @@ def process_single_file(gz_file_path, metadata_df, column_rename_map, final_colu
         except KeyError:
             return f"警告: 在 Excel 文件中找不到 Phenocode '{phenocode}'，跳过文件 {filename}"
 
-        processed_chunks = []
+        # --- 步骤 B: 检查断点续传进度 ---
+        # 每个片段过滤后立即追加写入 {phenocode}.txt，并在 {phenocode}.ckpt 中记录输入/输出偏移和校验和
+        # (见 checkpoint.py)，中断后会把输出截断到最后一个完好的片段，再从对应的输入行继续。
+        output_filename = output_path(f"{phenocode}.txt", compress, out_format)
+        checkpoint = ChunkCheckpoint(f"{phenocode}.ckpt", output_filename, gz_file_path, chunk_size)
+        # Parquet 的元数据写在文件末尾，中断的文件无法续写，只能重新生成
+        resume_from = checkpoint.resume() if out_format == 'tsv' else None
         initial_rows = 0
+        rows_after_all_filters = 0
 
-        # --- 步骤 B: 创建迭代器并分块处理 ---
-        reader = pd.read_csv(
-            gz_file_path, compression='gzip', sep='\t',
-            dtype={'#chrom': str, 'rsids': str, 'pval': str},
-            chunksize=CHUNK_SIZE
-        )
+        if resume_from:
+            initial_rows = resume_from['in_rows']
+            rows_after_all_filters = resume_from['out_rows']
+            print(f"\n  -> 检测到部分完成的文件 {output_filename}, 从输入第 {initial_rows + 1} 行继续...")
+        write_header = rows_after_all_filters == 0
+        writer = SumstatsWriter(output_filename, compress=compress, threads=threads,
+                                resumed=resume_from is not None, out_format=out_format)
+        file_metrics = (metrics or MetricsRecorder()).file(filename)
 
-        for gwas_chunk in reader:
-            initial_rows += len(gwas_chunk)
-            
-            # --- 对每个块应用所有过滤逻辑 ---
-
-            # 1. 列重命名与类型转换
-            gwas_chunk.rename(columns=column_rename_map, inplace=True)
-            gwas_chunk['P'] = pd.to_numeric(gwas_chunk['P'], errors='coerce')
-            gwas_chunk.dropna(subset=['P'], inplace=True)
-
-            # 2. P值有效性过滤
-            p_filter_mask = (gwas_chunk['P'] > 0) & (gwas_chunk['P'] <= 1)
-            gwas_chunk = gwas_chunk[p_filter_mask].copy()
-
-            # 3. (可选) 等位基因合并与校验
-            if merge_alleles_df is not None:
-                merged_chunk = pd.merge(gwas_chunk, merge_alleles_df, on='SNP', how='inner', suffixes=('', '_ref'))
-                if not merged_chunk.empty:
-                    allele_match_mask = merged_chunk.apply(
-                        lambda r: {r['A1'], r['A2']} == {r['A1_ref'], r['A2_ref']},
-                        axis=1
+        # --- 步骤 C: 分块读取并处理，每块处理完立即写出 ---
+        with checkpoint.start() as out_file:
+            for chunk in file_metrics.chunks(iter_gzip_chunks(gz_file_path, chunk_size, resume=resume_from)):
+                with file_metrics.stage('parse'):
+                    # 只解析需要的列 (见 sumstats_schema.py)，重命名后立即转换为紧凑类型
+                    gwas_chunk = pd.read_csv(
+                        io.BytesIO(chunk.header + chunk.data), sep='\t',
+                        usecols=lambda col: col in column_rename_map,
+                        dtype=parse_dtypes(column_rename_map)
                     )
-                    gwas_chunk = merged_chunk[allele_match_mask].copy()
-                    gwas_chunk.drop(columns=['A1_ref', 'A2_ref'], inplace=True)
-                else:
-                    gwas_chunk = pd.DataFrame(columns=gwas_chunk.columns) #
-            
-            # 4. 链模糊SNP过滤
-            if not gwas_chunk.empty:
-                ambiguous_sets = [{'A', 'T'}, {'C', 'G'}]
-                allele_sets = gwas_chunk.apply(lambda r: {str(r['A1']).upper(), str(r['A2']).upper()}, axis=1)
-                non_ambiguous_mask = allele_sets.apply(lambda s: s not in ambiguous_sets)
-                gwas_chunk = gwas_chunk[non_ambiguous_mask].copy()
-
-            # 如果块经过滤后仍有数据，则添加到列表中
-            if not gwas_chunk.empty:
-                processed_chunks.append(gwas_chunk)
-
-        # --- 步骤 C: 合并所有处理过的片段 ---
-        if not processed_chunks:
-            return f"警告: 经过滤后，文件 {filename} 无剩余数据，已跳过。"
-        
-        gwas_df = pd.concat(processed_chunks, ignore_index=True)
-        rows_after_all_filters = len(gwas_df)
+                initial_rows += len(gwas_chunk)
+                file_metrics.chunk_rows(rows_in=len(gwas_chunk))
+                
+                # --- 对每个块应用所有过滤逻辑 ---
+
+                # 1. 列重命名与类型转换
+                with file_metrics.stage('rename'):
+                    gwas_chunk.rename(columns=column_rename_map, inplace=True)
+                    gwas_chunk = compact_chunk(gwas_chunk)
+
+                # 2. P值有效性过滤 (无法解析的P值已在 compact_chunk 中变为缺失值，也在这里移除；
+                #    下溢为 0 的极小P值 (如 1e-400) 由 LP 列保留)
+                rows_before = len(gwas_chunk)
+                with file_metrics.stage('p_filter'):
+                    p_filter_mask = valid_pvalue_mask(gwas_chunk['P'].to_numpy(), gwas_chunk['LP'].to_numpy())
+                    gwas_chunk = gwas_chunk[p_filter_mask].copy()
+                file_metrics.rows('p_filter', rows_before, len(gwas_chunk))
+
+                # 3. (可选) 等位基因合并与校验 (在预编译的整数 rsID 索引上二分查找，见 hm3_index.py)
+                if reference_index is not None:
+                    rows_before = len(gwas_chunk)
+                    with file_metrics.stage('merge'):
+                        gwas_chunk = match_reference_index(gwas_chunk, reference_index)
+                    file_metrics.rows('merge', rows_before, len(gwas_chunk))
+                
+                # 4. 链模糊SNP过滤
+                rows_before = len(gwas_chunk)
+                with file_metrics.stage('ambiguity'):
+                    gwas_chunk = drop_strand_ambiguous(gwas_chunk)
+                file_metrics.rows('ambiguity', rows_before, len(gwas_chunk))
+
+                # 5. 添加N列、筛选最终列并立即追加写出 (即使本块为空也记录检查点)
+                with file_metrics.stage('write'):
+                    data = b''
+                    if not gwas_chunk.empty:
+                        gwas_chunk = gwas_chunk.assign(N=n_value)
+                        data = writer.encode(select_columns(gwas_chunk, final_columns), header=write_header,
+                                             offset=out_file.tell())
+                        rows_after_all_filters += len(gwas_chunk)
+                        write_header = False
+                    checkpoint.commit(out_file, data, chunk, len(gwas_chunk))
+                file_metrics.chunk_rows(rows_out=len(gwas_chunk))
 
-        # --- 步骤 D: 添加N列并筛选最终列 ---
-        gwas_df['N'] = n_value
-        existing_columns_to_keep = [col for col in final_columns if col in gwas_df.columns]
-        gwas_df_filtered = gwas_df[existing_columns_to_keep]
+            with file_metrics.stage('write'):
+                writer.finish(out_file)
 
-        # --- 步骤 E: 保存文件 ---
-        output_filename = f"{phenocode}.txt"
-        gwas_df_filtered.to_csv(output_filename, sep='\t', index=False, na_rep='NA')
+        # --- 步骤 D: 收尾 ---
+        checkpoint.finish()
+
+        if rows_after_all_filters == 0:
+            writer.close()
+            for path in (output_filename, output_filename + '.tbi'):
+                if os.path.exists(path):
+                    os.remove(path)
+            return f"警告: 经过滤后，文件 {filename} 无剩余数据，已跳过。"
         
+        writer.close()
         return f"成功处理: {filename} ({rows_after_all_filters}/{initial_rows} 个SNP保留)"
     except Exception as e:
+        error = e
         return f"错误: 处理文件 {gz_file_path} 时失败: {e}"
+    finally:
+        if file_metrics is not None:
+            file_metrics.close(error)
+
+# --- 进程池辅助函数 ---
+def _init_worker(metadata_df, column_rename_map, final_columns, reference_index, compress, threads, out_format,
+                 metrics, max_mem, profile_dir):
+    """进程池初始化函数：元数据和参考文件只在主进程解析一次，每个工作进程只接收一份。"""
+    _WORKER_STATE.update(
+        metadata_df=metadata_df,
+        column_rename_map=column_rename_map,
+        final_columns=final_columns,
+        reference_index=reference_index,
+        compress=compress,
+        threads=threads,
+        out_format=out_format,
+        metrics=metrics,
+        max_mem=max_mem
+    )
+    _WORKER_STATE['profile_dir'] = profile_dir
+
+def _process_in_worker(gz_file_path):
+    """工作进程入口：使用共享状态处理单个文件。"""
+    state = dict(_WORKER_STATE)
+    profile_dir = state.pop('profile_dir')
+    try:
+        return run_profiled(profile_dir, os.path.basename(gz_file_path), process_single_file, gz_file_path, **state)
+    finally:
+        # 每个文件结束后关闭指标文件，下一个文件写入时重新打开
+        state['metrics'].close()
 
-# --- 主函数：负责管理和调度 (此函数无需修改) ---
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="增强清洗 FinnGen R12 摘要统计数据 (P值/等位基因/链模糊过滤)。")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="并行处理文件的进程数。默认为 1 (顺序处理)。")
+    parser.add_argument('--compress', choices=OUTPUT_COMPRESSIONS, default='none',
+                        help="输出压缩方式。'bgzf' 输出 {phenocode}.txt.gz 并生成 tabix 索引。默认为 'none'。")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="每个文件用于 BGZF 块压缩的线程数。默认为 1。")
+    parser.add_argument('--out-format', choices=OUTPUT_FORMATS, default='tsv',
+                        help="输出格式。'parquet' 输出 {phenocode}.parquet (按染色体分行组，需要 pyarrow)。默认为 'tsv'。")
+    parser.add_argument('--metrics', help="把每个文件/片段各阶段的耗时、过滤前后行数和峰值内存以 JSON-lines 追加写入该文件。")
+    parser.add_argument('--profile', metavar='DIR', help="用 cProfile 运行每个文件，统计结果保存为 DIR/{文件名}.prof。")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_NAME,
+                        help=f"构建清单 (记录输入与参考文件哈希、元数据行和参数，只重建发生变化的表型)。默认为 {DEFAULT_MANIFEST_NAME}。")
+    parser.add_argument('--force', action='store_true', help="忽略构建清单，重新处理所有文件。")
+    parser.add_argument('--max-mem', type=parse_memory,
+                        help="所有工作进程合计的内存预算 (例如 4G、800M)。给出时按每个文件的样本估算片段大小，代替 CHUNK_SIZE。")
+    return parser.parse_args()
+
+# --- 主函数：负责管理和调度 ---
 def main():
     """主函数，负责管理所有任务"""
+    args = parse_arguments()
     print("--- 脚本启动 (顺序处理 + 片段化读取模式) ---")
-    print(f"每个文件将被分成 {CHUNK_SIZE} 行的片段进行处理。")
+    if args.max_mem:
+        print(f"内存预算 {args.max_mem / 1024 ** 2:.0f} MB (所有进程合计)，每个文件的片段大小按其开头的样本估算。")
+    else:
+        print(f"每个文件将被分成 {CHUNK_SIZE} 行的片段进行处理。")
     
     excel_file_path = 'finnGen_R12.xlsx'
-    merge_alleles_df = None
+    reference_index = None
     
     print(f"正在加载元数据: {excel_file_path}...")
     try:
@@ -116,8 +221,8 @@ def main():
     if MERGE_ALLELES_FILE_PATH:
         print(f"正在加载等位基因参考文件: {MERGE_ALLELES_FILE_PATH}...")
         try:
-            merge_alleles_df = pd.read_csv(MERGE_ALLELES_FILE_PATH, sep=r'\s+', usecols=['SNP', 'A1', 'A2'], engine='python')
-            print(f"✅ 成功加载 {len(merge_alleles_df)} 个参考SNP。")
+            reference_index = load_or_compile(MERGE_ALLELES_FILE_PATH)
+            print(f"✅ 成功加载 {len(reference_index)} 个参考SNP。")
         except Exception as e:
             print(f"❌ 严重错误: 无法加载等位基因参考文件。错误信息: {e}")
             return
@@ -135,23 +240,88 @@ def main():
     
     print(f"共找到 {len(gz_files)} 个文件待处理。")
 
-    print("\n--- 开始顺序处理，请稍候 ---")
+    # 构建清单记录每个输出对应的输入与参考文件哈希、元数据行和处理参数 (见 build_cache.py)，
+    # 元数据、HapMap3 列表或参数改变时只重新处理受影响的表型；已完成的表型直接跳过。
+    manifest = BuildManifest(args.manifest)
+    print("正在检查输入文件 (只对新增或改动过的文件计算哈希)...")
+    manifest.prefetch(gz_files + [MERGE_ALLELES_FILE_PATH], threads=max(4, args.workers))
+    params = {'columns': column_rename_map, 'final_columns': final_columns, 'p_range': '(0, 1]',
+              'drop_ambiguous': True, 'compress': args.compress, 'out_format': args.out_format}
+    pending_files = []
+    signatures = {}
+    for gz_file in gz_files:
+        phenocode = os.path.basename(gz_file).replace('finngen_R12_', '').replace('.gz', '')
+        output_filename = output_path(f"{phenocode}.txt", args.compress, args.out_format)
+        row = metadata_df.loc[phenocode, ['num_cases', 'num_controls']].to_dict() if phenocode in metadata_df.index else None
+        digest, detail = manifest.signature({'input': gz_file, 'reference': MERGE_ALLELES_FILE_PATH},
+                                            {**params, 'metadata': row})
+        checkpoint_path = f"{phenocode}.ckpt"
+        # 升级前生成的输出没有清单记录：原来的脚本不写完成标记、每次都重新生成，无法区分完整的结果与
+        # 中断时留下的半成品，因此不沿用 (与 finn_clean.py 只沿用有 .done 标记的输出相同)，首次运行时重新生成
+        if not args.force and manifest.up_to_date(output_filename, digest, detail, adopt=False):
+            continue
+        if (args.force or not manifest.resumable(output_filename, digest)) and os.path.exists(checkpoint_path):
+            # 检查点对应旧的元数据/参考文件/参数，不能续传
+            os.remove(checkpoint_path)
+        manifest.begin(output_filename, digest)
+        signatures[gz_file] = (output_filename, digest, detail)
+        pending_files.append(gz_file)
+    manifest.save()
+    skipped_count = len(gz_files) - len(pending_files)
     results = []
-    for gz_file in tqdm(gz_files, desc="处理文件"):
-        result = process_single_file(
-            gz_file,
-            metadata_df=metadata_df,
-            column_rename_map=column_rename_map,
-            final_columns=final_columns,
-            merge_alleles_df=merge_alleles_df
-        )
+
+    def record_status(gz_file, result):
         results.append(result)
+        if result.startswith("成功"):
+            manifest.record(*signatures[gz_file])
+            manifest.save()
+
+    workers = max(1, min(args.workers, len(pending_files))) if pending_files else 1
+    metrics = MetricsRecorder(args.metrics, 'finn_clean_plus')
+    max_mem = args.max_mem // workers if args.max_mem else None
+    try:
+        if workers == 1:
+            print("\n--- 开始顺序处理，请稍候 ---")
+            for gz_file in tqdm(pending_files, desc="处理文件"):
+                result = run_profiled(
+                    args.profile, os.path.basename(gz_file), process_single_file,
+                    gz_file,
+                    metadata_df=metadata_df,
+                    column_rename_map=column_rename_map,
+                    final_columns=final_columns,
+                    reference_index=reference_index,
+                    compress=args.compress,
+                    threads=args.threads,
+                    out_format=args.out_format,
+                    metrics=metrics,
+                    max_mem=max_mem
+                )
+                record_status(gz_file, result)
+        else:
+            print(f"\n--- 开始并行处理 (进程数: {workers})，请稍候 ---")
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(metadata_df, column_rename_map, final_columns, reference_index, args.compress, args.threads,
+                          args.out_format, metrics, max_mem, args.profile)
+            ) as executor:
+                futures = {executor.submit(_process_in_worker, gz_file): gz_file for gz_file in pending_files}
+                for future in tqdm(as_completed(futures), total=len(futures), desc="处理文件"):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = f"错误: 处理文件 {futures[future]} 时失败: {e}"
+                    record_status(futures[future], result)
+    finally:
+        metrics.close()
 
     print("\n--- 所有任务处理完毕 ---")
     successes = [r for r in results if r.startswith("成功")]
     warnings = [r for r in results if r.startswith("警告")]
     errors = [r for r in results if r.startswith("错误")]
 
+    if skipped_count:
+        print(f"⏭️ 已是最新 (跳过): {skipped_count} 个文件")
     print(f"✅ 成功: {len(successes)} 个文件")
     if warnings:
         print(f"⚠️ 警告 (已跳过): {len(warnings)} 个文件")
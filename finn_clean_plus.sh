@@ -1 +1 @@
-python3 finn_clean_plus.py
\ No newline at end of file
+python3 finn_clean_plus.py "$@"
\ No newline at end of file
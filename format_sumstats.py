@@ -12,12 +12,28 @@
 5.  智能处理样本量 'N' 列（可来自文件或固定值）。
 6.  优化读取速度，可为 .tsv 或 .csv 文件指定快速的 'c' 引擎。
 7.  输出严格只包含10个标准化的列。
+8.  可选 --compress bgzf：多线程输出 BGZF 压缩文件，并为排好序的数据生成 tabix 索引。
+9.  可选 --out-format parquet：输出带类型的列式文件 (按染色体分行组)；输入也可以直接是 Parquet 文件。
+10. 可选 --auto：根据表头自动识别列名 (GWAS Catalog/IEU/FinnGen/UKB 内置配置 + 别名表)，
+    --input-dir 批量模式对整个目录并行格式化，同一表头布局的映射只识别一次并缓存。
+11. 每块只解析需要的列，并立即转换为紧凑类型 (见 sumstats_schema.py)；
+    可选 --max-mem：按内存预算估算每块的行数，代替固定的 500000 行。
 """
 
 # 导入必要的库
 import argparse  # 用于解析命令行参数
+import glob      # 用于批量模式下查找文件
+import os        # 用于处理文件路径
 import sys       # 用于与系统交互，例如退出脚本
+from concurrent.futures import ProcessPoolExecutor, as_completed  # 批量模式的多进程并行
 import pandas as pd  # 用于数据处理的核心库
+from tqdm import tqdm  # 批量模式的进度条
+
+from sumstats_io import (OUTPUT_COMPRESSIONS, OUTPUT_FORMATS, STANDARD_COLUMNS,  # 标准格式输入/输出
+                         ParquetChunkReader, SumstatsWriter, is_parquet, output_path)
+from column_profiles import DEFAULT_CACHE_PATH, MappingCache, load_user_aliases, resolve_mapping  # 列名自动识别
+from metrics import MetricsRecorder, run_profiled  # --metrics / --profile 分阶段计时
+from sumstats_schema import chunk_size_for_budget, compact_chunk, parse_dtypes, parse_memory  # 紧凑内存类型与内存预算
 
 def preview_data(filepath: str):
     """
@@ -29,12 +45,20 @@ def preview_data(filepath: str):
         # 使用灵活但较慢的python引擎读取，因为预览时灵活性比速度更重要。
         # sep=r'\s+' 可以匹配任何空白字符（空格、制表符等）。
         # nrows=3 只读取文件的前3行数据，效率很高。
-        df_preview = pd.read_csv(filepath, sep=r'\s+', engine='python', nrows=3)
+        # Parquet 文件不需要猜测分隔符，直接读取第一个数据块的前3行
+        if is_parquet(filepath):
+            df_preview = ParquetChunkReader(filepath, chunk_size=3).get_chunk(3)
+        else:
+            df_preview = pd.read_csv(filepath, sep=r'\s+', engine='python', nrows=3)
         
         print("\n--- 数据预览 ---")
         # 使用 to_string() 可以确保即使列很多，也能完整显示不被截断。
         print(df_preview.to_string())
         print("------------------\n")
+
+        # 同时给出自动识别的列名映射，方便确认是否可以直接使用 --auto
+        info = resolve_mapping(filepath)
+        print(f"[*] 自动识别 (配置 {info['profile']}): {describe_mapping(info['mapping'], None)}")
         
     except Exception as e:
         # 捕获预览过程中可能出现的任何错误，例如文件不存在。
@@ -53,15 +77,36 @@ def parse_arguments() -> argparse.Namespace:
     )
     
     # --- 定义核心参数 ---
-    parser.add_argument('--sumstats', required=True, help="输入的摘要统计数据文件路径。")
+    parser.add_argument('--sumstats', help="输入的摘要统计数据文件路径 (批量模式下使用 --input-dir)。")
     # action='store_true' 表示这是一个开关参数，如果提供了--preview，则其值为True，否则为False
     parser.add_argument('--preview', action='store_true', help="预览文件前3行并退出。")
     parser.add_argument('--out', help="输出的 .txt 文件名。")
     # 增加 --sep 参数，让用户可以明确指定分隔符，以获得最佳性能
-    parser.add_argument('--sep', default=r'\s+', help="文件分隔符。推荐用法: 为制表符文件指定 '\\t'，为逗号文件指定 ','。默认为 '\\s+' (任意空白，较慢)。")
+    parser.add_argument('--sep', help="文件分隔符。推荐用法: 为制表符文件指定 '\\t'，为逗号文件指定 ','。默认为 '\\s+' (任意空白，较慢)；--auto 模式下默认根据表头猜测。")
 
     # --- 定义一个参数组，用于存放所有列名映射参数 ---
-    mapping_group = parser.add_argument_group('列名映射参数 (在非预览模式下为必需)')
+    # 输出压缩: bgzf 为分块 gzip 格式，可被 zcat/pandas 直接读取，也支持 tabix 区间查询
+    parser.add_argument('--compress', choices=OUTPUT_COMPRESSIONS, default='none', help="输出压缩方式。'bgzf' 输出 BGZF 压缩文件 (建议 --out 以 .gz 结尾) 并尝试生成 tabix 索引。默认为 'none'。")
+    parser.add_argument('--threads', type=int, default=1, help="BGZF 块压缩使用的线程数。默认为 1。")
+    # 输出格式: parquet 为带类型的列式存储 (需要 pyarrow)，每个行组只包含一个染色体
+    parser.add_argument('--out-format', choices=OUTPUT_FORMATS, default='tsv', help="输出格式。'parquet' 输出列式文件 (建议 --out 以 .parquet 结尾)，此时忽略 --compress。默认为 'tsv'。")
+    # 分阶段计时: 每块的读取/重命名/写出耗时、行数和峰值内存以 JSON-lines 追加写入 (见 metrics.py)
+    parser.add_argument('--metrics', help="把每个文件/数据块各阶段的耗时、行数和峰值内存以 JSON-lines 追加写入该文件。")
+    parser.add_argument('--profile', metavar='DIR', help="用 cProfile 运行每个文件，统计结果保存为 DIR/{文件名}.prof。")
+    # 内存预算: 按文件开头的样本估算每行占用的内存，换算为每块的行数 (批量模式下为所有进程合计)
+    parser.add_argument('--max-mem', type=parse_memory, help="内存预算，例如 4G、800M (批量模式下为所有进程合计)。给出时代替固定的每块 500000 行。")
+
+    # --- 自动识别列名与批量模式 ---
+    auto_group = parser.add_argument_group('自动识别与批量模式')
+    auto_group.add_argument('--auto', action='store_true', help="根据表头自动识别列名映射 (下面显式给出的列名优先)。")
+    auto_group.add_argument('--aliases', help="用户别名表 (制表符分隔，表头为 alias 和 standard)，优先于内置配置。")
+    auto_group.add_argument('--mapping-cache', default=DEFAULT_CACHE_PATH, help=f"按表头签名缓存识别结果的 JSON 文件。默认为 {DEFAULT_CACHE_PATH}")
+    auto_group.add_argument('--input-dir', help="批量模式: 自动识别并格式化该目录下的所有文件 (隐含 --auto)。")
+    auto_group.add_argument('--pattern', default='*', help="批量模式下匹配输入文件的通配符，例如 '*.h.tsv.gz'。默认为 '*'。")
+    auto_group.add_argument('--out-dir', default='.', help="批量模式的输出目录。默认为当前目录。")
+    auto_group.add_argument('--workers', type=int, default=1, help="批量模式下并行处理文件的进程数。默认为 1。")
+
+    mapping_group = parser.add_argument_group('列名映射参数 (在非预览、非自动模式下为必需)')
     mapping_group.add_argument('--CHR', help="文件中代表'染色体'的原始列名。")
     mapping_group.add_argument('--BP', help="文件中代表'物理位置'的原始列名。")
     mapping_group.add_argument('--SNP', help="文件中代表'SNP标识符'的原始列名。")
@@ -75,119 +120,361 @@ def parse_arguments() -> argparse.Namespace:
 
     return parser.parse_args()
 
-def main():
+def format_file(sumstats, out, field_columns, n_value=None, sep=r'\s+', compress='none', threads=1,
+                out_format='tsv', chunk_size=500000, verbose=True, metrics=None, max_mem=None):
     """
-    脚本的主逻辑函数，采用稳健的 'while True' 循环进行分块处理。
+    分块格式化单个文件，采用稳健的 'while True' 循环进行分块处理。
+    field_columns 为 {标准列名: 原始列名}；n_value 不为 None 时作为固定样本量写入 N 列。
+    metrics 为 MetricsRecorder 时按块记录读取/重命名/写出的耗时 (见 metrics.py)。
+    max_mem 为本进程的内存预算 (字节)，给出时代替 chunk_size。
+    成功时返回写出的行数；列缺失时抛出 ValueError。
     """
-    # 首先，解析命令行传入的所有参数
-    args = parse_arguments()
-
-    # 如果用户只想预览文件，则调用预览函数并立即退出脚本
-    if args.preview:
-        preview_data(args.sumstats)
-        sys.exit(0)
-
-    # --- 参数验证 ---
-    # 在非预览模式下，这些参数都是必需的
-    required_args = ['out', 'CHR', 'BP', 'SNP', 'A1', 'A2', 'P', 'BETA', 'SE', 'FRQ', 'N']
-    # 循环检查每个必需参数是否已提供
-    for arg in required_args:
-        if getattr(args, arg) is None:
-            print(f"[!] 错误: 在非预览模式下, 参数 --{arg} 是必需的。", file=sys.stderr)
-            sys.exit(1)
-
-    print(f"[*] 开始处理文件: {args.sumstats}")
+    log = print if verbose else (lambda *a, **k: None)
 
-    # --- 智能处理N列 ---
-    # 判断用户为--N提供的值是否为纯数字
-    is_n_a_fixed_value = args.N.isdigit()
-    
     # --- 构建列名映射字典 ---
     # 这个字典的格式是 {原始列名: 标准列名}
-    column_mapping = {
-        args.CHR: 'CHR', args.BP: 'BP', args.SNP: 'SNP', args.A1: 'A1', args.A2: 'A2',
-        args.P: 'P', args.BETA: 'BETA', args.SE: 'SE', args.FRQ: 'FRQ'
-    }
-    # 如果N不是一个固定值，那么它就是一个列名，需要加入到映射中
-    if not is_n_a_fixed_value:
-        column_mapping[args.N] = 'N'
-    
+    column_mapping = {raw: standard for standard, raw in field_columns.items()}
     # 获取所有需要从原始文件中保留的列名
     original_columns_to_keep = list(column_mapping.keys())
-    
+
     # --- 预防 DtypeWarning ---
-    # 主动设置CHR和SNP列的数据类型为字符串(str)，因为它们最容易出现混合类型
-    # 这是处理这类警告的最佳实践
-    dtype_spec = {args.CHR: str, args.SNP: str}
+    # 主动设置列的数据类型: CHR 与等位基因直接读为 category，SNP 与 P 读为字符串 (最容易出现混合类型)，
+    # 之后每块由 compact_chunk 转换为紧凑类型 (见 sumstats_schema.py)
+    dtype_spec = parse_dtypes(column_mapping)
 
     # --- 分块处理设置 ---
-    chunk_size = 500000  # 每次处理50万行，可以根据内存大小调整此值
     is_first_chunk = True # 标记是否为第一个数据块，用于决定是否写入文件头
-    # 处理转义字符，例如用户输入 '\\t' 应该被理解为制表符 '\t'
-    sep = args.sep.encode().decode('unicode_escape')
     # 如果分隔符不是复杂的空白符，就使用速度更快的'c'引擎
     engine = 'c' if sep != r'\s+' else 'python'
+    # 给出内存预算时，按文件开头的样本估算每块的行数
+    if max_mem:
+        chunk_size = chunk_size_for_budget(max_mem, sumstats, sep=sep)
 
-    print(f"[*] 启动分块处理模式 (每块 {chunk_size} 行, 分隔符: '{sep}', 引擎: '{engine}')...")
+    log(f"[*] 启动分块处理模式 (每块 {chunk_size} 行, 分隔符: '{sep}', 引擎: '{engine}')...")
 
-    try:
-        # 创建一个文件读取的迭代器，准备分块读取
+    # 输出编码器: 负责把每个数据块转换为文本或 BGZF 压缩字节 (先写入临时文件，成功后再替换 out)
+    tmp_path = out + '.tmp'
+    writer = SumstatsWriter(tmp_path, compress=compress, threads=threads, out_format=out_format)
+
+    # 创建一个文件读取的迭代器，准备分块读取
+    if is_parquet(sumstats):
+        # Parquet 输入: 忽略 --sep，只读取需要的列 (缺少的列留给下面的检查报错)
+        reader = ParquetChunkReader(sumstats, chunk_size=chunk_size)
+        reader.columns = [col for col in original_columns_to_keep if col in reader.columns_available]
+    else:
         reader = pd.read_csv(
-            args.sumstats,
+            sumstats,
             sep=sep,
             engine=engine,
             iterator=True,
+            usecols=lambda col: col in column_mapping, # 只解析需要的列 (缺少的列留给下面的检查报错)
             dtype=dtype_spec # 应用我们之前定义的dtype规范
         )
-        
-        loop_count = 0
-        # --- 使用稳健的 while True 循环结构来处理数据块 ---
+
+    loop_count = 0
+    rows_written = 0
+    file_metrics = (metrics or MetricsRecorder()).file(os.path.basename(sumstats))
+
+    def read_chunks():
+        # 逐块读取，直到 get_chunk 发出 StopIteration (每块的读取时间由 file_metrics.chunks 计入 parse 阶段)
         while True:
             try:
-                loop_count += 1
-                # 从迭代器中获取一个数据块
-                chunk = reader.get_chunk(chunk_size)
-                print(f"[*] 正在处理第 {loop_count} 块...")
+                yield reader.get_chunk(chunk_size)
+            except StopIteration:
+                return
+
+    try:
+        # 先写入临时文件 ('w' 覆盖旧的临时文件)，所有数据块依次追加写入；
+        # 全部成功后才替换输出文件，失败时不会留下看似完整的空文件或截断的文件
+        with open(tmp_path, 'wb') as out_file:
+            # --- 使用稳健的 while True 循环结构来处理数据块 ---
+            chunk_iter = file_metrics.chunks(read_chunks(), stage='parse')
+            while True:
+                try:
+                    loop_count += 1
+                    # 从迭代器中获取一个数据块
+                    chunk = next(chunk_iter)
+                    log(f"[*] 正在处理第 {loop_count} 块...")
+                except StopIteration:
+                    # 当`get_chunk`读取到文件末尾时，会发出StopIteration信号。
+                    # 这是文件处理完成的正常标志，我们捕获它并跳出while循环。
+                    log("[*] 所有数据块处理完毕。")
+                    break
 
                 # --- 对每个数据块执行相同的处理逻辑 ---
-                
+
                 # 只在处理第一个块时检查列名是否存在，避免重复检查
                 if is_first_chunk:
                     missing_cols = [col for col in original_columns_to_keep if col not in chunk.columns]
                     if missing_cols:
-                        print(f"[!] 错误: 输入文件中缺少以下指定的列: {', '.join(missing_cols)}", file=sys.stderr)
-                        sys.exit(1)
-
-                # 1. 选择需要的列
-                df_subset = chunk[original_columns_to_keep]
-                # 2. 重命名列
-                df_renamed = df_subset.rename(columns=column_mapping)
-                # 3. 如果N是固定值，则添加N列
-                if is_n_a_fixed_value:
-                    df_renamed['N'] = pd.to_numeric(args.N)
-                
-                # 4. 保证输出列的顺序是标准的
-                final_columns_order = ['CHR', 'BP', 'SNP', 'A1', 'A2', 'P', 'BETA', 'SE', 'FRQ', 'N']
-                df_final = df_renamed[final_columns_order]
+                        raise ValueError(f"输入文件中缺少以下指定的列: {', '.join(missing_cols)}")
+
+                file_metrics.chunk_rows(rows_in=len(chunk))
+                with file_metrics.stage('rename'):
+                    # 1. 选择需要的列
+                    df_subset = chunk[original_columns_to_keep]
+                    # 2. 重命名列
+                    df_renamed = df_subset.rename(columns=column_mapping)
+                    # 3. 如果N是固定值，则添加N列
+                    if n_value is not None:
+                        df_renamed['N'] = pd.to_numeric(n_value)
+
+                    # 4. 保证输出列的顺序是标准的，并转换为紧凑类型
+                    df_final = compact_chunk(df_renamed[STANDARD_COLUMNS])
 
                 # --- 将处理好的块写入文件 ---
-                if is_first_chunk:
-                    # 第一个块：使用 'w' (write) 模式覆盖旧文件，并写入文件头 (header=True)
-                    df_final.to_csv(args.out, sep='\t', index=False, mode='w', header=True, na_rep='NA')
-                    is_first_chunk = False # 取消标记，后续的块不再是第一个
-                else:
-                    # 后续的块：使用 'a' (append) 模式追加写入，并且不写文件头 (header=False)
-                    df_final.to_csv(args.out, sep='\t', index=False, mode='a', header=False, na_rep='NA')
-            
-            except StopIteration:
-                # 当`get_chunk`读取到文件末尾时，会发出StopIteration信号。
-                # 这是文件处理完成的正常标志，我们捕获它并跳出while循环。
-                print("[*] 所有数据块处理完毕。")
-                break
-        
+                # 只有第一个块写入文件头 (header=True)，后续的块直接追加数据
+                with file_metrics.stage('write'):
+                    out_file.write(writer.encode(df_final, header=is_first_chunk, offset=out_file.tell()))
+                rows_written += len(df_final)
+                file_metrics.chunk_rows(rows_out=len(df_final))
+                is_first_chunk = False # 取消标记，后续的块不再是第一个
+
+            # BGZF 输出需要追加结束块；随后关闭文件并 (对排好序的数据) 生成 tabix 索引
+            with file_metrics.stage('write'):
+                writer.finish(out_file)
+
+        with file_metrics.stage('write'):
+            indexed = writer.close()
+    except BaseException as e:
+        for path in (tmp_path, tmp_path + '.tbi'):
+            if os.path.exists(path):
+                os.remove(path)
+        # 中途失败的文件也写出汇总记录 (status 为 error)，已写出的片段记录才能对应到文件
+        file_metrics.close(error=e)
+        raise
+    os.replace(tmp_path, out)
+    if os.path.exists(tmp_path + '.tbi'):
+        os.replace(tmp_path + '.tbi', out + '.tbi')
+    elif os.path.exists(out + '.tbi'):
+        # 旧输出的索引已与新文件不符
+        os.remove(out + '.tbi')
+    file_metrics.close()
+    if indexed:
+        log(f"[*] tabix 索引已生成: {out}.tbi")
+    elif compress == 'bgzf' and out_format == 'tsv':
+        log("[*] 数据未按 CHR、BP 排序，未生成 tabix 索引。")
+    return rows_written
+
+def split_n_argument(n_arg):
+    """--N 可以是列名或固定数值：返回 (N 列名, 固定样本量)，其中之一为 None。"""
+    if n_arg is None:
+        return None, None
+    # 判断用户为--N提供的值是否为纯数字
+    if n_arg.isdigit():
+        return None, n_arg
+    return n_arg, None
+
+def resolve_file_mapping(sumstats, args, cache, user_aliases):
+    """
+    合并自动识别的映射与命令行中显式指定的列名 (显式指定优先)。
+    返回 (field_columns, n_value, sep, info)；缺少必需的列时抛出 ValueError。
+    """
+    info = resolve_mapping(sumstats, cache=cache, user_aliases=user_aliases)
+    field_columns = dict(info['mapping'])
+    for field in STANDARD_COLUMNS[:-1]:
+        if getattr(args, field) is not None:
+            field_columns[field] = getattr(args, field)
+
+    n_column, n_value = split_n_argument(args.N)
+    if n_column is not None:
+        field_columns['N'] = n_column
+    elif n_value is not None:
+        field_columns.pop('N', None)
+
+    missing = [f for f in STANDARD_COLUMNS if f not in field_columns and not (f == 'N' and n_value is not None)]
+    if missing:
+        raise ValueError(f"无法自动识别以下标准列: {', '.join(missing)} (可用 --{missing[0]} 等参数或 --aliases 别名表指定)")
+    # 用户显式给出的 --sep 优先于猜测的分隔符
+    sep = args.sep.encode().decode('unicode_escape') if args.sep else (info['sep'] or r'\s+')
+    return field_columns, n_value, sep, info
+
+def describe_mapping(field_columns, n_value):
+    parts = [f"{std}<-{field_columns[std]}" for std in STANDARD_COLUMNS if std in field_columns]
+    if n_value is not None:
+        parts.append(f"N={n_value}")
+    return ', '.join(parts)
+
+def batch_output_name(sumstats, out_dir, compress, out_format):
+    """批量模式的输出文件名: 去掉 .gz/.tsv/.txt/.csv/.parquet/.h 等后缀后加 .txt。"""
+    base = os.path.basename(sumstats)
+    while True:
+        stem, ext = os.path.splitext(base)
+        if ext.lower() not in ('.gz', '.bgz', '.tsv', '.txt', '.csv', '.parquet', '.pq', '.h'):
+            break
+        base = stem
+    return os.path.join(out_dir, output_path(f"{base}.txt", compress, out_format))
+
+def plan_batch_outputs(files, out_dir, compress, out_format):
+    """
+    为批量模式的每个输入确定输出文件，返回 ([(输入, 输出), ...], [跳过信息, ...])。
+    --out-dir 与 --input-dir 相同时 (默认 --out-dir 为当前目录)，输出可能落在输入目录中:
+    - 本身就是某个输入的输出文件的文件 (通常是之前运行的结果) 不作为输入；
+    - 输出与输入是同一文件的任务 (例如 X.txt -> X.txt) 被跳过，否则写出时会先截断输入；
+    - 多个输入得到同一输出名 (例如 a.tsv.gz 与 a.txt) 时只处理第一个，其余跳过。
+    """
+    outputs = [(f, batch_output_name(f, out_dir, compress, out_format)) for f in files]
+    # {输出文件: 以它为输出的其它输入}
+    targets = {}
+    for sumstats, out in outputs:
+        real_in, real_out = os.path.realpath(sumstats), os.path.realpath(out)
+        if real_in != real_out:
+            targets.setdefault(real_out, []).append(sumstats)
+    planned, skipped, claimed = [], [], {}
+    for sumstats, out in outputs:
+        real_in, real_out = os.path.realpath(sumstats), os.path.realpath(out)
+        if real_in in targets:
+            print(f"  -> 忽略 {os.path.basename(sumstats)}: 它是 {os.path.basename(targets[real_in][0])} 的输出文件 (可能来自之前的运行)。")
+        elif real_in == real_out:
+            skipped.append(f"警告: {os.path.basename(sumstats)}: 输出文件 {out} 就是输入文件本身，"
+                           f"请使用不同的 --out-dir，已跳过。")
+        elif real_out in claimed:
+            skipped.append(f"警告: {os.path.basename(sumstats)}: 输出文件 {out} 与 "
+                           f"{os.path.basename(claimed[real_out])} 的输出重名，已跳过。")
+        else:
+            claimed[real_out] = sumstats
+            planned.append((sumstats, out))
+    return planned, skipped
+
+def _format_in_worker(sumstats, out, field_columns, n_value, sep, compress, threads, out_format,
+                      metrics=None, profile_dir=None, max_mem=None):
+    """批量模式的工作进程入口，返回 (文件路径, 状态信息)。max_mem 为每个进程的内存预算。"""
+    try:
+        rows = run_profiled(profile_dir, os.path.basename(sumstats), format_file,
+                            sumstats, out, field_columns, n_value=n_value, sep=sep, compress=compress,
+                            threads=threads, out_format=out_format, verbose=False, metrics=metrics,
+                            max_mem=max_mem)
+        return sumstats, f"成功处理: {os.path.basename(sumstats)} -> {out} ({rows} 行)"
+    except Exception as e:
+        return sumstats, f"错误: 处理文件 {sumstats} 时失败: {e}"
+    finally:
+        # 每个任务结束后关闭指标文件 (工作进程中每个任务都会收到一个新的记录器)
+        if metrics is not None:
+            metrics.close()
+
+def run_batch(args, cache, user_aliases):
+    """
+    批量模式: 对 --input-dir 中匹配 --pattern 的所有文件自动识别列名并并行格式化。
+    映射在主进程中识别 (同一表头布局只识别一次并写入缓存)，工作进程只负责读写数据。
+    """
+    files = sorted(glob.glob(os.path.join(args.input_dir, args.pattern)))
+    files = [f for f in files if os.path.isfile(f) and not f.endswith(('.tbi', '.json', '.tmp'))]
+    if not files:
+        print(f"⚠️ 警告: 在 {args.input_dir} 中未找到匹配 '{args.pattern}' 的文件。")
+        return
+    os.makedirs(args.out_dir, exist_ok=True)
+    planned, results = plan_batch_outputs(files, args.out_dir, args.compress, args.out_format)
+    print(f"共找到 {len(planned) + len(results)} 个文件待处理。")
+
+    jobs = []
+    metrics = MetricsRecorder(args.metrics, 'format_sumstats')
+    for sumstats, out in planned:
+        try:
+            field_columns, n_value, sep, info = resolve_file_mapping(sumstats, args, cache, user_aliases)
+        except Exception as e:
+            results.append(f"警告: {os.path.basename(sumstats)}: {e}，已跳过。")
+            continue
+        source = '缓存' if info['cached'] else info['profile']
+        print(f"  -> {os.path.basename(sumstats)} [{source}]: {describe_mapping(field_columns, n_value)}")
+        jobs.append((sumstats, out, field_columns, n_value, sep, args.compress, args.threads, args.out_format,
+                     metrics, args.profile))
+    cache.save()
+
+    workers = max(1, min(args.workers, len(jobs))) if jobs else 1
+    # --max-mem 是所有进程合计的预算
+    max_mem = args.max_mem // workers if args.max_mem else None
+    print(f"\n--- 开始批量格式化 (进程数: {workers})，请稍候 ---")
+    try:
+        if workers == 1:
+            for job in tqdm(jobs, desc="总体进度", unit="个文件"):
+                results.append(_format_in_worker(*job, max_mem=max_mem)[1])
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_format_in_worker, *job, max_mem=max_mem): job[0] for job in jobs}
+                for future in tqdm(as_completed(futures), total=len(futures), desc="总体进度", unit="个文件"):
+                    try:
+                        results.append(future.result()[1])
+                    except Exception as e:
+                        results.append(f"错误: 处理文件 {futures[future]} 时失败: {e}")
+    finally:
+        metrics.close()
+
+    print("\n--- 所有任务处理完毕 ---")
+    print(f"✅ 成功: {sum(1 for r in results if r.startswith('成功'))} 个文件")
+    for label, prefix in (("⚠️ 警告 (跳过)", "警告"), ("❌ 错误", "错误")):
+        selected = [r for r in results if r.startswith(prefix)]
+        if selected:
+            print(f"{label}: {len(selected)} 个文件")
+            for r in selected:
+                print(f"   - {r}")
+
+def main():
+    """
+    脚本的主逻辑函数: 预览、单文件格式化 (手动或 --auto 识别列名) 或批量模式。
+    """
+    # 首先，解析命令行传入的所有参数
+    args = parse_arguments()
+
+    # 如果用户只想预览文件，则调用预览函数并立即退出脚本
+    if args.preview:
+        if args.sumstats is None:
+            print("[!] 错误: 预览模式需要 --sumstats 参数。", file=sys.stderr)
+            sys.exit(1)
+        preview_data(args.sumstats)
+        sys.exit(0)
+
+    # 自动识别列名时使用的用户别名表与映射缓存
+    try:
+        user_aliases = load_user_aliases(args.aliases) if args.aliases else None
+    except Exception as e:
+        print(f"[!] 错误: 无法读取别名表 '{args.aliases}': {e}", file=sys.stderr)
+        sys.exit(1)
+    cache = MappingCache(args.mapping_cache)
+
+    # --- 批量模式 ---
+    if args.input_dir:
+        run_batch(args, cache, user_aliases)
+        return
+
+    # --- 参数验证 ---
+    if args.sumstats is None or args.out is None:
+        print("[!] 错误: 在非预览模式下, 参数 --sumstats 和 --out 是必需的 (或使用 --input-dir 批量模式)。", file=sys.stderr)
+        sys.exit(1)
+
+    if args.auto:
+        # 自动识别列名，命令行中显式给出的列名优先
+        try:
+            field_columns, n_value, sep, info = resolve_file_mapping(args.sumstats, args, cache, user_aliases)
+        except Exception as e:
+            print(f"[!] 错误: {e}", file=sys.stderr)
+            sys.exit(1)
+        cache.save()
+        source = '缓存' if info['cached'] else f"配置 {info['profile']}"
+        print(f"[*] 自动识别列名 ({source}): {describe_mapping(field_columns, n_value)}")
+    else:
+        # 在非预览模式下，这些参数都是必需的
+        required_args = ['CHR', 'BP', 'SNP', 'A1', 'A2', 'P', 'BETA', 'SE', 'FRQ', 'N']
+        # 循环检查每个必需参数是否已提供
+        for arg in required_args:
+            if getattr(args, arg) is None:
+                print(f"[!] 错误: 在非预览模式下, 参数 --{arg} 是必需的 (或使用 --auto 自动识别)。", file=sys.stderr)
+                sys.exit(1)
+        # --- 智能处理N列 ---
+        n_column, n_value = split_n_argument(args.N)
+        field_columns = {field: getattr(args, field) for field in required_args[:-1]}
+        if n_column is not None:
+            field_columns['N'] = n_column
+        # 处理转义字符，例如用户输入 '\\t' 应该被理解为制表符 '\t'
+        sep = args.sep.encode().decode('unicode_escape') if args.sep else r'\s+'
+
+    print(f"[*] 开始处理文件: {args.sumstats}")
+    try:
+        with MetricsRecorder(args.metrics, 'format_sumstats') as metrics:
+            run_profiled(args.profile, os.path.basename(args.sumstats), format_file,
+                         args.sumstats, args.out, field_columns, n_value=n_value, sep=sep, compress=args.compress,
+                         threads=args.threads, out_format=args.out_format, metrics=metrics, max_mem=args.max_mem)
         # 修正了之前的拼写错误 (eout -> out)
         print(f"✨ 处理完成！结果已保存至 {args.out}")
-
     except Exception as e:
         # 捕获其他所有在处理过程中可能发生的意外错误
         print(f"[!] 处理文件时发生意外错误: {e}", file=sys.stderr)
@@ -197,4 +484,4 @@ def main():
 # 只有当这个文件被直接执行时，`if`内的代码才会运行。
 # 如果它被其他脚本作为模块导入，则不会运行。
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+HapMap3 参考SNP列表 (w_hm3.snplist) 的预编译二进制索引。
+
+一次性把文本格式的 snplist 编译成一个目录 (默认 <snplist>.idx/)，其中包含:
+    rsid.npy   排好序的 rsID 整数 (int64, 去掉 'rs' 前缀)
+    a1.npy     对应的 A1 等位基因编码 (int8, A/C/G/T = 1..4，见 sumstats_qc.allele_codes)
+    a2.npy     对应的 A2 等位基因编码 (int8)
+    order.npy  每个SNP在原 snplist 中的行号 (int32)，用于按参考文件的原始顺序输出 (见 ldsc_munge.py)
+    meta.json  源文件路径、大小、修改时间和SNP数量，用于判断索引是否过期
+
+之后各脚本以 mmap 方式打开这些 .npy 文件 (几乎瞬间完成)，并用 searchsorted 在整数上查找，
+不再对字符串列做 pd.merge。多个工作进程打开同一索引时通过操作系统页缓存共享同一份数据。
+
+用法:
+    python hm3_index.py --snplist ./w_hm3.snplist
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from sumstats_qc import allele_codes, allele_pair_keys
+from sumstats_schema import RSID_COLUMN, SNP_OTHER_COLUMN
+
+INDEX_SUFFIX = '.idx'
+_ARRAY_NAMES = ('rsid', 'a1', 'a2', 'order')
+
+
+def rsid_to_int(snp_ids):
+    """将 'rs123' 形式的SNP标识符向量化转换为 int64；无法解析的 (非rs、多个rsID等) 返回 -1。"""
+    s = pd.Series(np.asarray(snp_ids, dtype=object)).astype('string')
+    is_rs = s.str.startswith('rs', na=False)
+    numbers = pd.to_numeric(s.str.slice(2).where(is_rs), errors='coerce')
+    return numbers.fillna(-1).to_numpy(dtype=np.int64)
+
+
+class Hm3Index:
+    """rsID 排序数组 + 等位基因编码。被 pickle 时只传递路径，子进程重新以 mmap 打开。"""
+
+    def __init__(self, rsid, a1, a2, order, path=None):
+        self.rsid = rsid
+        self.a1 = a1
+        self.a2 = a2
+        self.order = order
+        self.path = path
+
+    def __len__(self):
+        return len(self.rsid)
+
+    def __reduce__(self):
+        if self.path is not None:
+            return (load_index, (self.path,))
+        return (Hm3Index, (np.asarray(self.rsid), np.asarray(self.a1), np.asarray(self.a2), np.asarray(self.order)))
+
+    def lookup(self, snp_ids):
+        """返回每个SNP在索引中的位置，不存在的为 -1。"""
+        return self.lookup_ids(rsid_to_int(snp_ids))
+
+    def lookup_ids(self, query):
+        """按 rsID 整数 (int64，-1 表示无法解析) 查找位置，不存在的为 -1。"""
+        pos = np.searchsorted(self.rsid, query)
+        pos = np.minimum(pos, len(self.rsid) - 1)
+        found = (query >= 0) & (len(self.rsid) > 0)
+        found &= np.asarray(self.rsid[pos]) == query
+        return np.where(found, pos, -1)
+
+    def pair_keys(self, positions):
+        """返回给定位置上参考等位基因对的规范键。"""
+        a1 = np.asarray(self.a1[positions])
+        a2 = np.asarray(self.a2[positions])
+        lo = np.minimum(a1, a2)
+        hi = np.maximum(a1, a2)
+        return np.where(lo > 0, lo * 5 + hi, -1).astype(np.int8)
+
+
+def _source_signature(snplist_path):
+    st = os.stat(snplist_path)
+    return {'source': os.path.abspath(snplist_path), 'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+def _build_arrays(snplist_path):
+    """解析 snplist 文本，返回按 rsID 排序、去重后的 (rsid, a1, a2, order) 数组。"""
+    ref = pd.read_csv(snplist_path, sep=r'\s+', usecols=['SNP', 'A1', 'A2'], dtype=str)
+
+    rsid = rsid_to_int(ref['SNP'])
+    valid = rsid >= 0
+    skipped = int((~valid).sum())
+    if skipped:
+        print(f"  -> 注意: {skipped} 个SNP不是 rsID 格式，未写入索引。")
+
+    rsid = rsid[valid]
+    a1 = allele_codes(ref['A1'].to_numpy()[valid])
+    a2 = allele_codes(ref['A2'].to_numpy()[valid])
+    rows = np.flatnonzero(valid).astype(np.int32)
+
+    # 按 rsID 排序并去重 (保留第一次出现的记录)
+    order = np.argsort(rsid, kind='stable')
+    rsid, a1, a2, rows = rsid[order], a1[order], a2[order], rows[order]
+    keep = np.ones(len(rsid), dtype=bool)
+    keep[1:] = rsid[1:] != rsid[:-1]
+    return rsid[keep], a1[keep], a2[keep], rows[keep]
+
+
+def compile_index(snplist_path, out_dir=None):
+    """读取 snplist 文本并编译为二进制索引目录，返回 Hm3Index。"""
+    out_dir = out_dir or snplist_path + INDEX_SUFFIX
+    arrays = _build_arrays(snplist_path)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in zip(_ARRAY_NAMES, arrays):
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+    meta = dict(_source_signature(snplist_path), n_snps=int(len(arrays[0])))
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    return Hm3Index(*arrays, path=out_dir)
+
+
+def load_index(index_dir):
+    """以只读 mmap 方式打开已编译的索引目录。"""
+    arrays = [np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r') for name in _ARRAY_NAMES]
+    return Hm3Index(*arrays, path=index_dir)
+
+
+def is_index_fresh(snplist_path, index_dir):
+    """索引存在 (包含全部数组) 且记录的源文件大小/修改时间与当前 snplist 一致时返回 True。"""
+    meta_path = os.path.join(index_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    # 旧版本编译的索引缺少后来增加的数组 (如 order.npy)，视为过期并重新编译
+    if not all(os.path.exists(os.path.join(index_dir, f"{name}.npy")) for name in _ARRAY_NAMES):
+        return False
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    current = _source_signature(snplist_path)
+    return meta.get('size') == current['size'] and meta.get('mtime') == current['mtime']
+
+
+def load_or_compile(snplist_path, index_dir=None):
+    """优先打开新鲜的已编译索引；否则先编译一次再打开。"""
+    index_dir = index_dir or snplist_path + INDEX_SUFFIX
+    if not is_index_fresh(snplist_path, index_dir):
+        print(f"  -> 未找到可用的预编译索引，正在编译: {index_dir} ...")
+        try:
+            compile_index(snplist_path, index_dir)
+        except OSError as e:
+            # 参考文件所在目录不可写时退回到进程内索引 (不保存到磁盘)
+            print(f"  -> 警告: 无法保存索引 ({e})，本次在内存中使用。")
+            return Hm3Index(*_build_arrays(snplist_path))
+    return load_index(index_dir)
+
+
+def match_reference_index(gwas_chunk, index):
+    """
+    使用预编译索引过滤片段：只保留 rsID 在参考中、且 {A1, A2} 与参考一致的行。
+    对单碱基位点与 sumstats_qc.match_reference_alleles 的结果一致 (保持输入行的顺序)；
+    HapMap3 只含 SNV，参考中非单碱基的位点不参与匹配。
+    """
+    if gwas_chunk.empty:
+        return gwas_chunk
+    if RSID_COLUMN in gwas_chunk.columns:
+        # 紧凑片段 (见 sumstats_schema.py)：rsID 已是整数，只有少量其它形式的 ID 需要按字符串解析
+        query = gwas_chunk[RSID_COLUMN].to_numpy().astype(np.int64)
+        query[query == 0] = -1
+        other = gwas_chunk[SNP_OTHER_COLUMN].notna().to_numpy()
+        if other.any():
+            query[other] = rsid_to_int(gwas_chunk[SNP_OTHER_COLUMN].to_numpy()[other])
+        positions = index.lookup_ids(query)
+    else:
+        positions = index.lookup(gwas_chunk['SNP'].to_numpy())
+    found = positions >= 0
+    keys = allele_pair_keys(gwas_chunk['A1'], gwas_chunk['A2'])
+    ref_keys = np.full(len(positions), -2, dtype=np.int8)
+    ref_keys[found] = index.pair_keys(positions[found])
+    return gwas_chunk[found & (keys == ref_keys) & (keys >= 0)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将 w_hm3.snplist 编译为可 mmap 的二进制索引。")
+    parser.add_argument('--snplist', default='./w_hm3.snplist', help="HapMap3 SNP 列表路径。默认为 ./w_hm3.snplist")
+    parser.add_argument('--out', help="索引输出目录。默认为 <snplist>.idx")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.snplist):
+        print(f"[!] 错误: 参考文件 '{args.snplist}' 不存在。", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"[*] 正在编译参考索引: {args.snplist}")
+    index = compile_index(args.snplist, args.out)
+    print(f"✨ 编译完成！共 {len(index)} 个SNP，索引已保存至 {index.path}")
+
+
+if __name__ == '__main__':
+    main()
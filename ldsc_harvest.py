@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+并行汇总 LDSC 的 h2 / rg 日志 (替代 ldsc脚本/STEP9.R 和 STEP10.R)。
+
+1. 递归查找结果目录中的 *.log，用多进程并行解析:
+   h2 日志取 Total Observed scale h2、Lambda GC、Mean Chi^2、Intercept、Ratio；
+   rg 日志取末尾 "Summary of Genetic Correlation Results" 表格的每一行
+   (--rg t1,t2,...,tK 批量运行时一个日志有 K-1 行)，按表头列名解析，不依赖固定的列位置。
+   日志类型由其调用参数 (--rg / --h2) 决定；ldsc 对失败的配对输出全为 NA 的行，记为 no_result。
+   不是 LDSC h2/rg 输出的日志 (例如 GNU parallel 的 joblog、--l2 日志) 会被忽略。
+2. 解析结果按 (路径, 文件大小, 修改时间) 缓存在 JSON 文件中 (默认 ldsc_harvest_cache.json)，
+   重复运行时只解析新增或改动过的日志。
+3. 所有结果合并为一张表 (CSV 或 Parquet，由输出文件后缀决定)，每个 rg 结果或 h2 日志一行；
+   同一配对 (p1, p2) 出现在多个日志中时 (例如 ldsc_rg_batch.py 重试失败配对的 _retryK 日志)
+   只保留修改时间最新的日志中的结果；
+   对成功解析的 rg 结果按 Benjamini-Hochberg 方法计算 p_adj (与 STEP10.R 的 p.adjust(method = "fdr") 相同)，
+   --significant 可另外导出 p_adj < 阈值 的结果。
+
+用法:
+    python ldsc_harvest.py ./rg ./h2 --out ldsc_all.csv --workers 8
+    python ldsc_harvest.py ./rg --out ldsc_all.parquet --significant ldsc_all_fdr_filter.csv
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from sumstats_io import PARQUET_SUFFIXES
+
+DEFAULT_CACHE_PATH = './ldsc_harvest_cache.json'
+# 解析规则改变时递增，旧缓存中的结果会被重新解析
+PARSER_VERSION = 2
+# 输出表的列 (h2 日志的 Intercept 写入 h2_int，Total Observed scale h2 写入 h2_obs)
+RESULT_COLUMNS = ['source_file', 'kind', 'trait1', 'trait2', 'p1', 'p2', 'rg', 'se', 'z', 'p',
+                  'h2_obs', 'h2_obs_se', 'h2_int', 'h2_int_se', 'gcov_int', 'gcov_int_se',
+                  'ratio', 'ratio_se', 'lambda_gc', 'mean_chi2', 'parse_status']
+_TEXT_COLUMNS = ('source_file', 'kind', 'trait1', 'trait2', 'p1', 'p2', 'parse_status')
+
+_LDSC_MARKER = 'LD Score Regression (LDSC)'
+_NUMBER = r'([-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|NA|nan|inf))'
+_H2_PATTERNS = {
+    'h2': re.compile(r'Total Observed scale h2:\s+' + _NUMBER + r'\s+\(' + _NUMBER + r'\)'),
+    'intercept': re.compile(r'Intercept:\s+' + _NUMBER + r'\s+\(' + _NUMBER + r'\)'),
+    'ratio': re.compile(r'Ratio:\s+' + _NUMBER + r'(?:\s+\(' + _NUMBER + r'\))?'),
+    'lambda_gc': re.compile(r'Lambda GC:\s+' + _NUMBER),
+    'mean_chi2': re.compile(r'Mean Chi\^2:\s+' + _NUMBER),
+}
+_H2_FILE = re.compile(r'--h2\s+(\S+)')
+# ldsc 日志开头 "Call:" 部分的参数行，例如 "--rg a.sumstats.gz,b.sumstats.gz \"
+_CALL_RG = re.compile(r'^--rg\s', re.MULTILINE)
+_CALL_H2 = re.compile(r'^--h2\s', re.MULTILINE)
+_CALL_END = 'Beginning analysis'
+_RG_SUMMARY = 'Summary of Genetic Correlation Results'
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def trait_name(path):
+    """由 sumstats 路径得到性状名: ./format_ldsc/COPD.sumstats.gz -> COPD"""
+    if not isinstance(path, str):
+        return None
+    base = os.path.basename(path)
+    for ext in ('.gz', '.sumstats'):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base
+
+
+def _empty_row(path, kind, status):
+    row = dict.fromkeys(RESULT_COLUMNS)
+    row.update(source_file=path, kind=kind, parse_status=status)
+    return row
+
+
+def _parse_rg_summary(path, lines, start):
+    """解析 rg 汇总表：表头行之后直到空行的每一行为一个结果。"""
+    rows = []
+    header_index = next((i for i in range(start, len(lines)) if lines[i].split()[:2] == ['p1', 'p2']), None)
+    if header_index is None:
+        return [_empty_row(path, 'rg', 'header_not_found')]
+    header = lines[header_index].split()
+    for line in lines[header_index + 1:]:
+        fields = line.split()
+        if not fields:
+            break
+        if len(fields) != len(header):
+            rows.append(_empty_row(path, 'rg', 'parse_error'))
+            continue
+        row = _empty_row(path, 'rg', 'success')
+        for name, value in zip(header, fields):
+            if name in ('p1', 'p2'):
+                row[name] = value
+            elif name in row:
+                row[name] = _to_float(value)
+        row['trait1'] = trait_name(row['p1'])
+        row['trait2'] = trait_name(row['p2'])
+        # ldsc 对失败的配对输出全为 NA 的一行
+        if np.isnan(row['rg']):
+            row['parse_status'] = 'no_result'
+        rows.append(row)
+    return rows or [_empty_row(path, 'rg', 'parse_error')]
+
+
+def _parse_h2(path, content):
+    row = _empty_row(path, 'h2', 'success')
+    match = _H2_FILE.search(content)
+    if match:
+        row['p1'] = match.group(1)
+        row['trait1'] = trait_name(match.group(1))
+    for key, pattern in _H2_PATTERNS.items():
+        match = pattern.search(content)
+        if match is None:
+            continue
+        if key == 'h2':
+            row['h2_obs'], row['h2_obs_se'] = _to_float(match.group(1)), _to_float(match.group(2))
+        elif key == 'intercept':
+            row['h2_int'], row['h2_int_se'] = _to_float(match.group(1)), _to_float(match.group(2))
+        elif key == 'ratio':
+            row['ratio'], row['ratio_se'] = _to_float(match.group(1)), _to_float(match.group(2))
+        else:
+            row[key] = _to_float(match.group(1))
+    return [row]
+
+
+def parse_log(path):
+    """
+    解析单个日志文件，返回结果行 (dict) 的列表；不是 LDSC 日志时返回空列表。
+    读取失败或 LDSC 未输出结果 (例如运行中断) 时返回一行，parse_status 说明原因。
+    """
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+    except OSError:
+        return [_empty_row(path, None, 'read_error')]
+    if _LDSC_MARKER not in content[:5000]:
+        return []
+    # 按调用参数区分 rg 与 h2 日志：rg 日志中也有各性状的 h2 结果，中断时不能被当作 h2 日志
+    call_end = content.find(_CALL_END)
+    call = content[:call_end] if call_end >= 0 else content
+    if _CALL_RG.search(call):
+        summary = content.find(_RG_SUMMARY)
+        if summary < 0:
+            return [_empty_row(path, 'rg', 'no_result')]
+        return _parse_rg_summary(path, content[summary:].splitlines(), 1)
+    if _CALL_H2.search(call):
+        if 'Total Observed scale h2' not in content:
+            return [_empty_row(path, 'h2', 'no_result')]
+        return _parse_h2(path, content)
+    return []
+
+
+def _parse_batch(paths):
+    """工作进程入口：解析一批日志，返回 [(路径, 结果行列表), ...]。"""
+    return [(path, parse_log(path)) for path in paths]
+
+
+def find_logs(roots):
+    """递归查找所有 .log 文件 (与 STEP10.R 的 dir_ls(recurse = TRUE, glob = "**/*.log") 相同)。"""
+    logs = []
+    for root in roots:
+        if os.path.isfile(root):
+            logs.append(root)
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            logs.extend(os.path.join(dirpath, name) for name in filenames if name.endswith('.log'))
+    return sorted(set(logs))
+
+
+class HarvestCache:
+    """按 (路径, 大小, 修改时间) 缓存解析结果的 JSON 文件；每行结果按 RESULT_COLUMNS 的顺序存为列表。"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    payload = json.load(f)
+                if payload.get('columns') == RESULT_COLUMNS and payload.get('version') == PARSER_VERSION:
+                    self.entries = payload.get('entries', {})
+            except (OSError, ValueError, AttributeError):
+                print(f"  -> 警告: 缓存 {path} 无法读取，将重新解析所有日志。")
+                self.entries = {}
+        self.dirty = False
+
+    @staticmethod
+    def _signature(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry is None or entry['sig'] != self._signature(path):
+            return None
+        return [dict(zip(RESULT_COLUMNS, values)) for values in entry['rows']]
+
+    def put(self, path, rows):
+        self.entries[path] = {
+            'sig': self._signature(path),
+            'rows': [[None if isinstance(row[c], float) and np.isnan(row[c]) else row[c] for c in RESULT_COLUMNS]
+                     for row in rows]
+        }
+        self.dirty = True
+
+    def prune(self, paths):
+        """删除已不存在的日志的缓存记录。"""
+        keep = set(paths)
+        for path in [p for p in self.entries if p not in keep]:
+            del self.entries[path]
+            self.dirty = True
+
+    def save(self):
+        if not (self.path and self.dirty):
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': PARSER_VERSION, 'columns': RESULT_COLUMNS, 'entries': self.entries}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def benjamini_hochberg(p):
+    """Benjamini-Hochberg 校正，与 R 的 p.adjust(p, method = "fdr") 相同 (NaN 保持为 NaN)。"""
+    p = np.asarray(p, dtype=np.float64)
+    adjusted = np.full(len(p), np.nan)
+    valid = np.flatnonzero(~np.isnan(p))
+    if len(valid) == 0:
+        return adjusted
+    order = valid[np.argsort(p[valid])[::-1]]
+    n = len(valid)
+    ranks = np.arange(n, 0, -1)
+    adjusted[order] = np.minimum(1, np.minimum.accumulate(p[order] * n / ranks))
+    return adjusted
+
+
+def drop_duplicate_pairs(table):
+    """
+    同一 rg 配对 (p1, p2) 出现在多个日志中时只保留修改时间最新的日志中的一行
+    (断点续传时失败的配对会重试到新的日志中，旧日志中该配对为 NA)。其余行保持原顺序。
+    """
+    is_pair = (table['kind'] == 'rg') & table['p1'].notna() & table['p2'].notna()
+    if not is_pair.any():
+        return table
+    mtimes = {}
+    for path in table.loc[is_pair, 'source_file'].unique():
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            mtimes[path] = 0
+    order = table.loc[is_pair, 'source_file'].map(mtimes).sort_values(kind='stable')
+    newest = table.loc[order.index].drop_duplicates(subset=['p1', 'p2'], keep='last').index
+    keep = ~is_pair
+    keep[newest] = True
+    return table[keep].reset_index(drop=True)
+
+
+def harvest(roots, cache=None, workers=1, batch_size=200):
+    """解析 roots 下的所有日志 (只解析缓存中没有或已改动的)，返回合并后的 DataFrame。"""
+    logs = find_logs(roots)
+    rows_by_path = {}
+    pending = []
+    for path in logs:
+        rows = cache.get(path) if cache is not None else None
+        if rows is None:
+            pending.append(path)
+        else:
+            rows_by_path[path] = rows
+    print(f"共找到 {len(logs)} 个日志文件，其中 {len(logs) - len(pending)} 个使用缓存，{len(pending)} 个需要解析。")
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    workers = max(1, min(workers, len(batches))) if batches else 1
+    if workers == 1:
+        results = (_parse_batch(batch) for batch in batches)
+        for batch_result in tqdm(results, total=len(batches), desc="解析日志", unit="批"):
+            rows_by_path.update(batch_result)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for batch_result in tqdm(executor.map(_parse_batch, batches), total=len(batches), desc="解析日志", unit="批"):
+                rows_by_path.update(batch_result)
+
+    if cache is not None:
+        for path in pending:
+            cache.put(path, rows_by_path[path])
+        cache.prune(logs)
+        cache.save()
+
+    table = pd.DataFrame([row for path in logs for row in rows_by_path[path]], columns=RESULT_COLUMNS)
+    for column in RESULT_COLUMNS:
+        if column not in _TEXT_COLUMNS:
+            table[column] = pd.to_numeric(table[column], errors='coerce')
+    table = drop_duplicate_pairs(table)
+    is_rg = (table['kind'] == 'rg') & (table['parse_status'] == 'success')
+    table['p_adj'] = np.nan
+    table.loc[is_rg, 'p_adj'] = benjamini_hochberg(table.loc[is_rg, 'p'].to_numpy())
+    return table
+
+
+def write_table(table, path):
+    """按后缀写出 CSV 或 Parquet。"""
+    if path.lower().endswith(PARQUET_SUFFIXES):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="并行汇总 LDSC h2/rg 日志为一张表 (CSV/Parquet)。")
+    parser.add_argument('roots', nargs='+', help="结果目录 (递归查找 *.log) 或日志文件。")
+    parser.add_argument('--out', default='ldsc_all.csv', help="输出文件 (.csv 或 .parquet)。默认为 ldsc_all.csv")
+    parser.add_argument('--significant', help="另外导出 p_adj < --fdr 的 rg 结果 (按 p_adj 升序)。")
+    parser.add_argument('--fdr', type=float, default=0.05, help="显著性阈值。默认为 0.05。")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH,
+                        help=f"解析结果缓存文件。默认为 {DEFAULT_CACHE_PATH}；设为 none 则不使用缓存。")
+    parser.add_argument('--workers', type=int, default=1, help="并行解析的进程数。默认为 1。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    missing = [root for root in args.roots if not os.path.exists(root)]
+    if missing:
+        print(f"[!] 错误: 目录不存在 -> {', '.join(missing)}", file=sys.stderr)
+        sys.exit(1)
+
+    cache = None if args.cache.lower() == 'none' else HarvestCache(args.cache)
+    table = harvest(args.roots, cache, args.workers)
+    if table.empty:
+        print("⚠️ 警告: 没有找到任何 LDSC 日志文件。")
+        return
+
+    try:
+        write_table(table, args.out)
+    except ImportError as e:
+        print(f"[!] 错误: 写出 Parquet 需要 pyarrow ({e})。", file=sys.stderr)
+        sys.exit(1)
+    ok = table['parse_status'] == 'success'
+    print(f"✅ 共 {len(table)} 行结果 (rg {int((ok & (table['kind'] == 'rg')).sum())}, "
+          f"h2 {int((ok & (table['kind'] == 'h2')).sum())})，已保存至 {args.out}")
+    failed = table[~ok]
+    if not failed.empty:
+        print(f"⚠️ {len(failed)} 个日志未能解析出结果:")
+        for status, count in failed['parse_status'].value_counts().items():
+            print(f"   - {status}: {count}")
+
+    if args.significant:
+        significant = table[table['p_adj'] < args.fdr].sort_values('p_adj')
+        write_table(significant, args.significant)
+        print(f"✨ {len(significant)} 个 FDR 显著结果 (p_adj < {args.fdr}) 已保存至 {args.significant}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+原生 Python 版 ldsc munge：把标准格式 (CHR, BP, SNP, A1, A2, P, BETA, SE, FRQ, N) 的摘要统计数据
+直接转换为 ldsc 的 .sumstats.gz (SNP, A1, A2, Z, N)，替代 format_ldsc.sh / STEP4.sh 中
+逐个文件启动外部 munge_sumstats.py 的方式。
+
+处理步骤与 munge_sumstats.py --N-col N --merge-alleles w_hm3.snplist 相同:
+1. 按块读取，删除 SNP/A1/A2/P/BETA/N/FRQ 中有空值的行，只保留参考列表中的 SNP；
+   MAF <= 0.01 (或 FRQ 不在 [0, 1]) 的行、P 不在 (0, 1] 的行、非单碱基或链模糊的等位基因被移除。
+2. 按 SNP 去重 (保留第一次出现的行)；移除 N < N 的 90% 分位数 / 1.5 的行。
+3. Z = sqrt(chi2.isf(P, 1)) (即 Φ^-1(1 - P/2))，BETA < 0 时取负号；BETA 的中位数偏离 0 超过 0.1 时报错。
+   P 下溢为 0 的行 (如 1e-400，见 sumstats_schema.parse_pvalues) 由 -log10 P 计算 Z，不会被 P 过滤删除
+   (munge_sumstats.py 会把这些行当作 P = 0 删除)。
+   z_source='beta_se' 时改为 Z = BETA / SE。
+4. 与参考等位基因比对 (允许 A1/A2 互换和正负链翻转)，按参考列表的原始顺序输出所有参考SNP，
+   不匹配或缺失的SNP除 SNP 列外均为空；Z、N 保留 3 位小数，解压后的内容与 munge_sumstats.py 的输出一致。
+参考列表使用 hm3_index.py 预编译的 mmap 索引，每个进程只打开一次。
+
+用法:
+    python ldsc_munge.py --data-dir ./data --out-dir ./format --merge-alleles ./w_hm3.snplist --workers 8
+    python ldsc_munge.py --sumstats COPD.txt --out ./format/COPD --merge-alleles ./w_hm3.snplist
+"""
+
+import argparse
+import glob
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from build_cache import DEFAULT_MANIFEST_NAME, BuildManifest
+from column_profiles import read_header
+from hm3_index import load_or_compile
+from sumstats_io import iter_sumstats_chunks
+from sumstats_qc import allele_codes, allele_pair_keys, strand_ambiguous_mask
+from sumstats_schema import LP_COLUMN, pvalue_arrays, valid_pvalue_mask
+
+try:
+    from scipy.special import ndtri as _scipy_ndtri
+except ImportError:  # 清洗环境 (environment.yml) 中没有 scipy，使用下面的 numpy 实现
+    _scipy_ndtri = None
+
+MUNGE_SUFFIX = '.sumstats.gz'
+DEFAULT_MAF_MIN = 0.01
+MEDIAN_TOLERANCE = 0.1
+Z_SOURCES = ('p', 'beta_se')
+OUTPUT_COLUMNS = ['SNP', 'A1', 'A2', 'Z', 'N']
+
+# 进程池中每个工作进程共享的参考索引和参数，由 _init_worker 在进程启动时填充一次
+_WORKER_STATE = {}
+
+# Acklam 正态分布分位数近似的系数 (相对误差 < 1.2e-9，再经一步 Halley 迭代达到双精度)
+_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+      1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+      6.680131188771972e+01, -1.328068155288572e+01)
+_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+      -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+_P_LOW = 0.02425
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+
+
+def _ndtri(p):
+    """标准正态分布的分位数函数 Φ^-1(p)，p 取值 (0, 0.5]。"""
+    if _scipy_ndtri is not None:
+        return _scipy_ndtri(p)
+    p = np.asarray(p, dtype=np.float64)
+    x = np.empty_like(p)
+    low = p < _P_LOW
+    q = np.sqrt(-2 * np.log(p[low]))
+    x[low] = ((((((_C[0] * q + _C[1]) * q + _C[2]) * q + _C[3]) * q + _C[4]) * q + _C[5])
+              / ((((_D[0] * q + _D[1]) * q + _D[2]) * q + _D[3]) * q + 1))
+    q = p[~low] - 0.5
+    r = q * q
+    x[~low] = ((((((_A[0] * r + _A[1]) * r + _A[2]) * r + _A[3]) * r + _A[4]) * r + _A[5]) * q
+               / (((((_B[0] * r + _B[1]) * r + _B[2]) * r + _B[3]) * r + _B[4]) * r + 1))
+    # Halley 迭代一步 (极小的 p 上 exp(x^2/2) 会溢出，此时近似值已足够精确)
+    refine = p > 1e-300
+    xr = x[refine]
+    e = 0.5 * _erfc(-xr / np.sqrt(2)).astype(np.float64) - p[refine]
+    u = e * np.sqrt(2 * np.pi) * np.exp(xr * xr / 2)
+    x[refine] = xr - u / (1 + xr * u / 2)
+    return x
+
+
+def p_to_z(p):
+    """双侧 P 值转换为 |Z|：与 munge_sumstats.py 的 sqrt(chi2.isf(P, 1)) 相同。"""
+    # 取绝对值而不是取负：P = 1 时得到 0.0 而不是 -0.0 (否则输出为 '-0.000')
+    return np.abs(_ndtri(np.asarray(p, dtype=np.float64) / 2))
+
+
+def lp_to_z(lp):
+    """
+    由 -log10 P 计算 |Z|，用于 P 下溢的行 (|Z| > 37)：对 log(P/2) = log Φ(-z) 的渐近展开
+    -z²/2 - log z - log √(2π) + log(1 - 1/z² + 3/z⁴ - 15/z⁶) 做牛顿迭代，误差远小于输出的 3 位小数。
+    """
+    target = -np.asarray(lp, dtype=np.float64) * np.log(10) - np.log(2)
+    z = np.sqrt(-2 * target)
+    for _ in range(6):
+        z2 = z * z
+        f = -z2 / 2 - np.log(z) - 0.5 * np.log(2 * np.pi) + np.log1p(-1 / z2 + 3 / z2 ** 2 - 15 / z2 ** 3) - target
+        z = z + f / (z + 1 / z)
+    return z
+
+
+def _complement_keys(positions, index):
+    """参考等位基因对取互补链 (A<->T, C<->G) 后的规范键。"""
+    a1 = 5 - np.asarray(index.a1[positions])
+    a2 = 5 - np.asarray(index.a2[positions])
+    lo = np.minimum(a1, a2)
+    hi = np.maximum(a1, a2)
+    return np.where(lo < 5, lo * 5 + hi, -1).astype(np.int8)
+
+
+def munge_chunk(chunk, index=None, maf_min=DEFAULT_MAF_MIN, z_source='p'):
+    """
+    对一个标准格式的数据块执行步骤 1 的过滤，返回 SNP, A1, A2, P, BETA, (SE,) N 列，
+    有参考索引时另加参考位置 _ref 和等位基因是否与参考一致 _match (不一致的行保留到去重之后)。
+    P 下溢的行另有 LP 列 (-log10 P，其余行为 NaN)。
+    """
+    needed = ['SNP', 'A1', 'A2', 'P', 'BETA', 'N'] + (['SE'] if z_source == 'beta_se' else [])
+    needed += [c for c in ('FRQ',) if c in chunk.columns]
+    missing = [c for c in needed if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"缺少 {', '.join(missing)} 列")
+    chunk = chunk[needed + [c for c in (LP_COLUMN,) if c in chunk.columns]].dropna(subset=needed)
+
+    if index is not None:
+        positions = index.lookup(chunk['SNP'].to_numpy())
+        chunk = chunk[positions >= 0].assign(_ref=positions[positions >= 0])
+
+    keep = np.ones(len(chunk), dtype=bool)
+    if 'FRQ' in chunk.columns:
+        frq = pd.to_numeric(chunk['FRQ'], errors='coerce').to_numpy(dtype=np.float64)
+        keep &= (frq >= 0) & (frq <= 1) & (np.minimum(frq, 1 - frq) > maf_min)
+    p, lp = pvalue_arrays(chunk)
+    keep &= valid_pvalue_mask(p, lp)
+    a1 = chunk['A1'].astype(str).str.upper().to_numpy(dtype=object)
+    a2 = chunk['A2'].astype(str).str.upper().to_numpy(dtype=object)
+    # 只保留非链模糊的单碱基等位基因对 (munge_sumstats.py 中的 VALID_SNPS)
+    keys = allele_pair_keys(a1, a2)
+    keep &= (keys >= 0) & (allele_codes(a1) != allele_codes(a2)) & ~strand_ambiguous_mask(a1, a2)
+
+    chunk = chunk.assign(A1=a1, A2=a2, P=p, **{LP_COLUMN: lp})[keep].drop(columns=[c for c in ('FRQ',) if c in chunk.columns])
+    if index is not None and len(chunk):
+        positions = chunk['_ref'].to_numpy()
+        keys = allele_pair_keys(chunk['A1'].to_numpy(), chunk['A2'].to_numpy())
+        chunk = chunk.assign(_match=(keys == index.pair_keys(positions)) | (keys == _complement_keys(positions, index)))
+    return chunk
+
+
+def finalize_munge(frames, index=None, n_min=None, z_source='p', ignore_median=False):
+    """对所有过滤后的数据块执行步骤 2-4，返回 SNP, A1, A2, Z, N 列的数据框 (按输出顺序)。"""
+    dat = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=OUTPUT_COLUMNS)
+    if dat.empty:
+        raise ValueError("过滤后没有剩余的SNP")
+    dat = dat.drop_duplicates(subset='SNP')
+    n = pd.to_numeric(dat['N'], errors='coerce')
+    n_min = n_min if n_min is not None else n.quantile(0.9) / 1.5
+    dat = dat[n >= n_min]
+
+    beta = pd.to_numeric(dat['BETA'], errors='coerce').to_numpy(dtype=np.float64)
+    median = float(np.median(beta))
+    if abs(median) > MEDIAN_TOLERANCE and not ignore_median:
+        raise ValueError(f"BETA 的中位数为 {median:.3g} (应接近 0)，该列可能不是效应值")
+    if z_source == 'beta_se':
+        z = beta / pd.to_numeric(dat['SE'], errors='coerce').to_numpy(dtype=np.float64)
+    else:
+        # P 下溢的行 (LP 有值) 由 -log10 P 计算
+        lp = dat[LP_COLUMN].to_numpy(dtype=np.float64) if LP_COLUMN in dat.columns else np.full(len(dat), np.nan)
+        tiny = ~np.isnan(lp)
+        z = np.empty(len(dat))
+        z[~tiny] = p_to_z(dat['P'].to_numpy(dtype=np.float64)[~tiny])
+        z[tiny] = lp_to_z(lp[tiny])
+        z = z * np.where(beta < 0, -1.0, 1.0)
+    dat = dat.assign(Z=z)
+
+    if index is None:
+        return dat[OUTPUT_COLUMNS].reset_index(drop=True)
+
+    # 按参考列表的原始顺序输出全部参考SNP，不匹配的位置留空
+    size = len(index)
+    rank = np.empty(size, dtype=np.int64)
+    perm = np.argsort(np.asarray(index.order), kind='stable')
+    rank[perm] = np.arange(size)
+    matched = dat[dat['_match'].to_numpy(dtype=bool)]
+    rows = rank[matched['_ref'].to_numpy(dtype=np.int64)]
+    a1 = np.full(size, np.nan, dtype=object)
+    a2 = np.full(size, np.nan, dtype=object)
+    z = np.full(size, np.nan)
+    n = np.full(size, np.nan)
+    a1[rows] = matched['A1'].to_numpy()
+    a2[rows] = matched['A2'].to_numpy()
+    z[rows] = matched['Z'].to_numpy(dtype=np.float64)
+    n[rows] = pd.to_numeric(matched['N']).to_numpy(dtype=np.float64)
+    snp = np.char.add('rs', np.asarray(index.rsid)[perm].astype(str))
+    return pd.DataFrame({'SNP': snp, 'A1': a1, 'A2': a2, 'Z': z, 'N': n})
+
+
+def write_sumstats(dat, path):
+    """写出 ldsc 格式的 .sumstats.gz (与 munge_sumstats.py 相同: 制表符分隔，浮点数保留 3 位小数)。"""
+    dat.to_csv(path, sep='\t', index=False, float_format='%.3f', na_rep='', compression='gzip')
+
+
+class MungeStage:
+    """流水线 (pipeline.py) 的终止阶段：逐块过滤，最后整体计算 Z 并写出 .sumstats.gz。"""
+    name = 'munge'
+    output_suffix = MUNGE_SUFFIX
+
+    def __init__(self, options):
+        # 参考索引被传递给工作进程时只携带路径，各进程自行 mmap 打开
+        self.index = load_or_compile(options['merge_alleles']) if options.get('merge_alleles') else None
+        self.build_inputs = {'merge_alleles': options.get('merge_alleles')}
+        self.maf_min = options.get('maf_min', DEFAULT_MAF_MIN)
+        self.n_min = options.get('n_min')
+        self.z_source = options.get('z_source', 'p')
+        self.ignore_median = options.get('ignore_median', False)
+        if self.z_source not in Z_SOURCES:
+            raise ValueError(f"z_source 必须是 {', '.join(Z_SOURCES)} 之一")
+
+    def bind(self, context):
+        return self.apply
+
+    def apply(self, chunk):
+        return munge_chunk(chunk, self.index, self.maf_min, self.z_source)
+
+    def write_output(self, chunks, path):
+        """消费全部数据块并写出结果，返回 Z 不为空的SNP数。"""
+        dat = finalize_munge(list(chunks), self.index, self.n_min, self.z_source, self.ignore_median)
+        write_sumstats(dat, path)
+        return int(dat['Z'].notna().sum())
+
+
+def munge_file(sumstats, out_prefix, stage, n_value=None, chunk_size=500000):
+    """
+    转换单个标准格式文件为 <out_prefix>.sumstats.gz (先写临时文件，完成后再改名)。
+    返回状态信息字符串 (以 成功/错误 开头)。
+    """
+    output_filename = out_prefix + MUNGE_SUFFIX
+    tmp_path = output_filename + '.tmp'
+    try:
+        _, sep = read_header(sumstats)
+        chunks = iter_sumstats_chunks(sumstats, chunk_size, sep=sep or '\t', dtype={'SNP': str, 'A1': str, 'A2': str, 'P': str})
+        if n_value is not None:
+            chunks = (chunk.assign(N=n_value) for chunk in chunks)
+        rows = stage.write_output((stage.apply(chunk) for chunk in chunks), tmp_path)
+        os.replace(tmp_path, output_filename)
+        return f"成功处理: {os.path.basename(sumstats)} -> {output_filename} ({rows} 个SNP)"
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return f"错误: 处理文件 {sumstats} 时失败: {e}"
+
+
+def _init_worker(stage, n_value, chunk_size):
+    """进程池初始化函数：参考索引只传递路径，各工作进程自行 mmap 打开。"""
+    _WORKER_STATE.update(stage=stage, n_value=n_value, chunk_size=chunk_size)
+
+
+def _process_in_worker(job):
+    """工作进程入口：使用共享状态转换单个文件。"""
+    sumstats, out_prefix = job
+    return munge_file(sumstats, out_prefix, **_WORKER_STATE)
+
+
+def output_prefix(sumstats, out_dir):
+    """输出前缀与 format_ldsc.sh 一致: ./data/COPD.txt(.gz) -> <out_dir>/COPD"""
+    base = os.path.basename(sumstats)
+    for ext in ('.gz', '.txt', '.parquet'):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return os.path.join(out_dir, base)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="将标准格式的GWAS数据转换为 ldsc 的 .sumstats.gz 文件。")
+    parser.add_argument('--sumstats', help="单个输入文件。")
+    parser.add_argument('--out', help="单个文件的输出前缀 (生成 <out>.sumstats.gz)。")
+    parser.add_argument('--data-dir', default='./data', help="批量模式的输入目录。默认为 ./data")
+    parser.add_argument('--pattern', default='*.txt*', help="批量模式匹配的文件名。默认为 '*.txt*'")
+    parser.add_argument('--out-dir', default='./format', help="批量模式的输出目录。默认为 ./format")
+    parser.add_argument('--merge-alleles', default='./w_hm3.snplist',
+                        help="HapMap3 SNP 列表 (首次使用时自动编译为 <路径>.idx)。设为 none 则不比对。默认为 ./w_hm3.snplist")
+    parser.add_argument('--N', type=float, help="固定样本量 (默认使用文件中的 N 列)。")
+    parser.add_argument('--maf-min', type=float, default=DEFAULT_MAF_MIN, help=f"最小等位基因频率。默认为 {DEFAULT_MAF_MIN}。")
+    parser.add_argument('--n-min', type=float, help="最小样本量。默认为 N 的 90%% 分位数 / 1.5。")
+    parser.add_argument('--z-source', choices=Z_SOURCES, default='p',
+                        help="Z 的计算方式: 'p' 为由 P 值和 BETA 符号计算 (与 munge_sumstats.py 相同)，'beta_se' 为 BETA/SE。默认为 'p'。")
+    parser.add_argument('--ignore-median', action='store_true', help="不检查 BETA 的中位数。")
+    parser.add_argument('--workers', type=int, default=1, help="并行处理文件的进程数。默认为 1。")
+    parser.add_argument('--chunk-size', type=int, default=500000, help="每块读取的行数。默认为 500000。")
+    parser.add_argument('--overwrite', action='store_true', help="忽略构建清单，重新处理所有输入 (默认只处理新增或有变化的输入)。")
+    parser.add_argument('--manifest', help=f"构建清单路径。默认为输出目录下的 {DEFAULT_MANIFEST_NAME}。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.sumstats:
+        if not args.out:
+            print("[!] 错误: 单文件模式需要 --out 参数。", file=sys.stderr)
+            sys.exit(1)
+        jobs = [(args.sumstats, args.out)]
+    else:
+        files = sorted(f for f in glob.glob(os.path.join(args.data_dir, args.pattern))
+                       if os.path.isfile(f) and not f.endswith('.tbi'))
+        jobs = [(f, output_prefix(f, args.out_dir)) for f in files]
+    if not jobs:
+        print(f"⚠️ 警告: 在 {args.data_dir} 中未找到匹配 '{args.pattern}' 的文件。")
+        return
+
+    merge_alleles = None if args.merge_alleles.lower() == 'none' else args.merge_alleles
+    if merge_alleles:
+        print(f"正在加载等位基因参考文件: {merge_alleles}...")
+    try:
+        stage = MungeStage({'merge_alleles': merge_alleles, 'maf_min': args.maf_min, 'n_min': args.n_min,
+                            'z_source': args.z_source, 'ignore_median': args.ignore_median})
+    except Exception as e:
+        print(f"❌ 严重错误: 无法加载等位基因参考文件。错误信息: {e}")
+        sys.exit(1)
+
+    # 构建清单记录输入与参考文件的哈希和 munge 参数 (见 build_cache.py)：只处理新增、内容改变或参数改变的输入，
+    # 没有清单记录的已有结果 (升级前生成) 沿用
+    manifest = BuildManifest(args.manifest or os.path.join(os.path.dirname(jobs[0][1]) or '.', DEFAULT_MANIFEST_NAME))
+    manifest.prefetch([job[0] for job in jobs] + [merge_alleles], threads=max(4, args.workers))
+    params = {'N': args.N, 'maf_min': args.maf_min, 'n_min': args.n_min, 'z_source': args.z_source,
+              'ignore_median': args.ignore_median}
+    signatures = {}
+    pending = []
+    for sumstats, prefix in jobs:
+        digest, detail = manifest.signature({'input': sumstats, 'reference': merge_alleles}, params)
+        if args.overwrite or not manifest.up_to_date(prefix + MUNGE_SUFFIX, digest, detail):
+            signatures[sumstats] = (prefix + MUNGE_SUFFIX, digest, detail)
+            pending.append((sumstats, prefix))
+    manifest.save()
+    for _, prefix in pending:
+        os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+    print(f"共找到 {len(jobs)} 个文件，其中 {len(jobs) - len(pending)} 个已是最新 (跳过)。")
+
+    results = []
+
+    def record_status(sumstats, status):
+        results.append(status)
+        if status.startswith('成功'):
+            manifest.record(*signatures[sumstats])
+            manifest.save()
+
+    workers = max(1, min(args.workers, len(pending))) if pending else 1
+    if workers == 1:
+        for sumstats, prefix in tqdm(pending, desc="总体进度", unit="个文件"):
+            record_status(sumstats, munge_file(sumstats, prefix, stage, args.N, args.chunk_size))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(stage, args.N, args.chunk_size)
+        ) as executor:
+            futures = {executor.submit(_process_in_worker, job): job[0] for job in pending}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="总体进度", unit="个文件"):
+                try:
+                    status = future.result()
+                except Exception as e:
+                    status = f"错误: 处理文件 {futures[future]} 时失败: {e}"
+                record_status(futures[future], status)
+
+    print("\n--- 所有任务处理完毕 ---")
+    print(f"✅ 成功: {sum(1 for r in results if r.startswith('成功'))} 个文件")
+    errors = [r for r in results if r.startswith('错误')]
+    if errors:
+        print(f"❌ 错误 (处理失败): {len(errors)} 个文件")
+        for e in errors:
+            print(f"   - {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+批量计算所有性状两两之间的遗传相关 (替代 ldsc脚本/STEP6.sh 中每个配对启动一次 ldsc.py --rg)。
+
+STEP6.sh 对 N 个性状的 N*N 个有序配对逐一运行 ldsc.py，每次都要重新读取 eur_w_ld_chr/ 下的
+LD 参考分数和两个 .sumstats.gz，500 个性状即 25 万次冷启动。本脚本:
+
+1. 每个工作进程只导入一次 ldsc (--ldsc-dir)，LD 参考分数/权重只读取一次；
+2. 每个工作进程把读入的 .sumstats.gz 放入按内存大小限制的 LRU 缓存 (--cache-gb)；
+3. 把配对按 (性状1, 一组性状2) 合并为 ldsc 的批量模式 --rg t1,t2,...,tK，
+   并按 "性状2 分组 -> 性状1" 的顺序排队，使同一时间各进程处理同一组性状2，缓存命中率最高；
+4. 计算仍由 ldsc 自己的 sumstats.estimate_rg 完成，日志格式与 ldsc.py 相同
+   (每批一个日志，汇总表有 K 行，可由 ldsc_harvest.py 汇总)，结果与逐对运行一致；
+5. 读取并追加 STEP6.sh 使用的 GNU parallel 任务日志 (--joblog)，已成功的配对会被跳过，
+   与之前 STEP6.sh 的运行结果之间可以互相断点续传。
+
+用法:
+    python ldsc_rg_batch.py --ldsc-dir /path/to/ldsc --ref-ld /path/to/eur_w_ld_chr/ \
+        --input-dir ./format_ldsc --out-dir ./rg --workers 8
+"""
+
+import argparse
+import glob
+import importlib.util
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+SUMSTATS_SUFFIX = '.sumstats.gz'
+JOBLOG_NAME = 'parallel_rg_all_pairs_jobs.log'
+JOBLOG_HEADER = 'Seq\tHost\tStarttime\tJobRuntime\tSend\tReceive\tExitval\tSignal\tCommand\n'
+# 与 STEP6.sh 中 parallel 调用的函数名一致，使两边的任务日志可以互相识别
+JOB_COMMAND = 'run_ldsc_rg_ordered'
+
+# 工作进程的全局状态 (由 _init_worker 初始化)
+_WORKER_STATE = {}
+
+
+def trait_name(path):
+    base = os.path.basename(path)
+    return base[:-len(SUMSTATS_SUFFIX)] if base.endswith(SUMSTATS_SUFFIX) else base
+
+
+# --- 任务日志 (GNU parallel --joblog 格式) ---
+
+def read_joblog(path):
+    """返回任务日志中已成功 (Exitval 为 0) 的 (性状1, 性状2) 集合。"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9 or fields[0] == 'Seq':
+                continue
+            command = fields[8].split()
+            if fields[6] == '0' and len(command) >= 3:
+                done.add((trait_name(command[-2].strip("'\"")), trait_name(command[-1].strip("'\""))))
+    return done
+
+
+def append_joblog(handle, seq, start, runtime, exitval, file1, file2):
+    handle.write(f"{seq}\t:\t{start:.3f}\t{runtime:9.3f}\t0\t0\t{exitval}\t0\t{JOB_COMMAND} {file1} {file2}\n")
+
+
+# --- 调度 ---
+
+def plan_batches(files, done, batch_size):
+    """
+    把尚未完成的有序配对 (包括自身配对，与 STEP6.sh 相同) 分为批次。
+    性状2 按顺序每 batch_size 个分为一组；批次按 (组, 性状1) 排序，
+    使并行的工作进程在同一时间使用同一组性状2，其缓存可以被后续批次复用。
+    返回 [(批次编号, 性状1 文件, [性状2 文件, ...], [Seq, ...]), ...]，
+    Seq 与 STEP6.sh 中 parallel 的任务编号 (i * N + j + 1) 相同。
+    """
+    n = len(files)
+    names = [trait_name(f) for f in files]
+    batches = []
+    for group, block_start in enumerate(range(0, n, batch_size)):
+        block = range(block_start, min(block_start + batch_size, n))
+        for i in range(n):
+            partners = [j for j in block if (names[i], names[j]) not in done]
+            if partners:
+                batches.append((group, files[i], [files[j] for j in partners], [i * n + j + 1 for j in partners]))
+    return batches
+
+
+# --- 工作进程 ---
+
+class FileLogger:
+    """与 ldsc.py 的 Logger 接口相同，但只写入日志文件 (多个进程同时输出到终端没有意义)。"""
+
+    def __init__(self, path):
+        self.log_fh = open(path, 'w')
+
+    def log(self, msg):
+        print(msg, file=self.log_fh)
+
+    def close(self):
+        self.log_fh.close()
+
+
+class SumstatsCache:
+    """按 DataFrame 占用内存限制大小的 LRU 缓存。"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+
+    def get(self, key, loader):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        value = loader()
+        size = int(value.memory_usage(index=True, deep=True).sum())
+        self.entries[key] = (value, size)
+        self.total += size
+        # 至少保留刚读入的一项
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.total -= evicted
+        return value
+
+
+def _load_ldsc(ldsc_dir):
+    """
+    导入 ldsc 的 ldscore 包和 ldsc.py (只执行模块级定义，不执行其 __main__ 部分)。
+    本脚本运行在 Python 3 下，ldsc 也必须能在 Python 3 下导入 (上游 bulik/ldsc 是 Python 2.7 代码)。
+    """
+    if ldsc_dir not in sys.path:
+        sys.path.insert(0, ldsc_dir)
+    spec = importlib.util.spec_from_file_location('ldsc_cli', os.path.join(ldsc_dir, 'ldsc.py'))
+    cli = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cli)
+    return cli
+
+
+def check_ldsc(ldsc_dir):
+    """在主进程中试导入 ldsc，确认其可在当前 Python 下使用，并提供本脚本替换的函数。返回错误信息或 None。"""
+    try:
+        cli = _load_ldsc(ldsc_dir)
+    except (SyntaxError, ImportError) as e:
+        return (f"无法在 Python {sys.version_info.major}.{sys.version_info.minor} 下导入 {ldsc_dir} 中的 ldsc "
+                f"({type(e).__name__}: {e})。上游 bulik/ldsc 是 Python 2.7 代码，"
+                f"请使用移植到 Python 3 的 ldsc 版本。")
+    missing = [name for name, obj, attr in (
+        ('sumstats.estimate_rg', getattr(cli, 'sumstats', None), 'estimate_rg'),
+        ('sumstats._read_chr_split_files', getattr(cli, 'sumstats', None), '_read_chr_split_files'),
+        ('parse.sumstats', getattr(cli, 'ps', None), 'sumstats'),
+    ) if not hasattr(obj, attr)]
+    if missing:
+        return f"{ldsc_dir} 中的 ldsc 缺少本脚本需要的函数: {', '.join(missing)}。请确认使用的是 ldsc 的 ldscore 包。"
+    return None
+
+
+def unique_prefix(prefix):
+    """
+    返回日志不存在的输出前缀。断点续传时同一批次编号只重试失败的配对，
+    不能覆盖之前的日志 (其中成功配对的结果已记入任务日志，不会再重新计算)。
+    """
+    candidate, attempt = prefix, 1
+    while os.path.exists(candidate + '.log'):
+        attempt += 1
+        candidate = f"{prefix}_retry{attempt}"
+    return candidate
+
+
+def _init_worker(ldsc_dir, cache_bytes):
+    cli = _load_ldsc(ldsc_dir)
+    sumstats = cli.sumstats
+    parse = cli.ps
+    cache = SumstatsCache(cache_bytes)
+    reference = {}
+
+    read_sumstats = parse.sumstats
+    read_chr_split_files = sumstats._read_chr_split_files
+
+    def cached_sumstats(fh, alleles=False, dropna=True):
+        # 统一缓存 dropna=False 的结果，两种调用方式共享同一份数据；
+        # ldsc 会就地重命名列 (_merge_sumstats_sumstats)，因此返回浅拷贝
+        raw = cache.get((fh, alleles), lambda: read_sumstats(fh, alleles=alleles, dropna=False))
+        return raw.dropna(how='any') if dropna else raw.copy(deep=False)
+
+    def cached_chr_split_files(chr_arg, not_chr_arg, log, noun, parsefunc, **kwargs):
+        key = (chr_arg, not_chr_arg, noun, parsefunc.__name__, tuple(sorted(kwargs.items())))
+        if key not in reference:
+            reference[key] = read_chr_split_files(chr_arg, not_chr_arg, log, noun, parsefunc, **kwargs)
+        else:
+            # 保持日志内容与 ldsc.py 相同
+            f = not_chr_arg or parse.sub_chr(chr_arg, '[1-22]')
+            log.log('Reading {N} from {F} ... ({p})'.format(N=noun, F=f, p=parsefunc.__name__))
+        value = reference[key]
+        # _read_w_ld 会就地修改列名
+        return value.copy(deep=False) if hasattr(value, 'copy') else value
+
+    # ldsc 的 estimate_rg 通过模块属性调用这两个函数，替换后即可复用已读入的数据
+    parse.sumstats = cached_sumstats
+    sumstats._read_chr_split_files = cached_chr_split_files
+    _WORKER_STATE['cli'] = cli
+
+
+def _ldsc_header(cli, args):
+    """与 ldsc.py 相同的日志开头 (MASTHEAD + 非默认参数)。"""
+    defaults = vars(cli.parser.parse_args(''))
+    opts = vars(args)
+    non_defaults = [x for x in opts if opts[x] != defaults[x]]
+    header = cli.MASTHEAD
+    header += "Call: \n"
+    header += './ldsc.py \\\n'
+    options = ['--' + x.replace('_', '-') + ' ' + str(opts[x]) + ' \\' for x in non_defaults]
+    header += '\n'.join(options).replace('True', '').replace('False', '')
+    return header[0:-1] + '\n'
+
+
+def _process_in_worker(task):
+    """运行一个批次: ldsc.py --rg file1,partner1,...,partnerK。返回每个配对是否成功。"""
+    batch_id, file1, partners, out_prefix, extra_args = task
+    cli = _WORKER_STATE['cli']
+    os.makedirs(os.path.dirname(out_prefix), exist_ok=True)
+    argv = ['--rg', ','.join([file1] + partners), '--out', out_prefix] + extra_args
+    args = cli.parser.parse_args(argv)
+
+    start = time.time()
+    log = FileLogger(out_prefix + '.log')
+    ok = [False] * len(partners)
+    try:
+        log.log(_ldsc_header(cli, args))
+        log.log('Beginning analysis at {T}'.format(T=time.ctime()))
+        rg = cli.sumstats.estimate_rg(args, log)
+        ok = [r is not None for r in rg]
+        error = None
+    except Exception:
+        log.log(traceback.format_exc())
+        error = traceback.format_exc().strip().splitlines()[-1]
+    finally:
+        log.log('Analysis finished at {T}'.format(T=time.ctime()))
+        log.log('Total time elapsed: {T}'.format(T=cli.sec_to_str(round(time.time() - start, 2))))
+        log.close()
+    return batch_id, start, time.time() - start, ok, error
+
+
+# --- 主程序 ---
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="批量计算所有性状两两之间的遗传相关 (ldsc --rg)，复用参考数据和 sumstats。")
+    parser.add_argument('--ldsc-dir', required=True, help="ldsc 代码目录 (包含 ldsc.py 和 ldscore/)。")
+    parser.add_argument('--ref-ld', required=True, help="LD 参考分数目录/前缀，同时用于 --ref-ld-chr 和 --w-ld-chr (例如 eur_w_ld_chr/)。")
+    parser.add_argument('--w-ld', help="单独指定 --w-ld-chr。默认与 --ref-ld 相同。")
+    parser.add_argument('--input-dir', default='./format_ldsc', help="*.sumstats.gz 所在目录。默认为 ./format_ldsc")
+    parser.add_argument('--out-dir', default='./rg', help="输出目录。默认为 ./rg")
+    parser.add_argument('--joblog', help=f"任务日志 (GNU parallel --joblog 格式)。默认为 {{out-dir}}/{JOBLOG_NAME}，与 STEP6.sh 相同。")
+    parser.add_argument('--batch-size', type=int, default=20, help="每次 --rg 中性状2 的数量。默认为 20。")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="并行进程数。默认为 CPU 核心数的一半 (与 STEP6.sh 相同)。")
+    parser.add_argument('--cache-gb', type=float, default=4.0,
+                        help="每个进程 sumstats 缓存的内存上限 (GB)。应至少能容纳 --batch-size + 1 个文件。默认为 4。")
+    parser.add_argument('--ldsc-args', default='', help="附加给 ldsc.py 的其他参数，例如 '--no-intercept'。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if not os.path.isfile(os.path.join(args.ldsc_dir, 'ldsc.py')):
+        print(f"错误: LDSC Python脚本未找到: {os.path.join(args.ldsc_dir, 'ldsc.py')}", file=sys.stderr)
+        sys.exit(1)
+    error = check_ldsc(os.path.abspath(args.ldsc_dir))
+    if error:
+        print(f"错误: {error}", file=sys.stderr)
+        sys.exit(1)
+    files = sorted(glob.glob(os.path.join(args.input_dir, '*' + SUMSTATS_SUFFIX)))
+    if not files:
+        print(f"在 {args.input_dir} 中没有找到 {SUMSTATS_SUFFIX} 文件！", file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    joblog_path = args.joblog or os.path.join(args.out_dir, JOBLOG_NAME)
+    done = read_joblog(joblog_path)
+    batches = plan_batches(files, done, max(1, args.batch_size))
+    total_pairs = len(files) * len(files)
+    pending_pairs = sum(len(b[2]) for b in batches)
+    print(f"找到了 {len(files)} 个文件，共 {total_pairs} 个配对，其中 {total_pairs - pending_pairs} 个已完成 (任务日志: {joblog_path})。")
+    if not batches:
+        print("✅ 所有 rg 分析任务均已完成。")
+        return
+
+    extra_args = ['--ref-ld-chr', args.ref_ld, '--w-ld-chr', args.w_ld or args.ref_ld] + args.ldsc_args.split()
+    tasks = []
+    for batch_id, (group, file1, partners, _) in enumerate(batches):
+        base1 = trait_name(file1)
+        out_prefix = unique_prefix(os.path.join(args.out_dir, base1, f"{base1}_batch{group:04d}"))
+        tasks.append((batch_id, file1, partners, out_prefix, extra_args))
+    workers = max(1, min(args.workers, len(tasks)))
+    print(f"剩余 {pending_pairs} 个配对，合并为 {len(tasks)} 个批次，使用 {workers} 个进程...")
+
+    new_log = not os.path.exists(joblog_path)
+    failed_pairs, errors = 0, []
+    with open(joblog_path, 'a', encoding='utf-8') as joblog, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(os.path.abspath(args.ldsc_dir), int(args.cache_gb * 1024 ** 3))) as executor:
+        if new_log:
+            joblog.write(JOBLOG_HEADER)
+        # 按调度顺序提交，空闲进程按顺序领取任务
+        futures = [executor.submit(_process_in_worker, task) for task in tasks]
+        with tqdm(total=pending_pairs, desc="rg 配对", unit="对") as bar:
+            for future in as_completed(futures):
+                batch_id, start, runtime, ok, error = future.result()
+                _, file1, partners, seqs = batches[batch_id]
+                for partner, seq, success in zip(partners, seqs, ok):
+                    append_joblog(joblog, seq, start, runtime, 0 if success else 1, file1, partner)
+                joblog.flush()
+                failed_pairs += ok.count(False)
+                if error:
+                    errors.append(f"{tasks[batch_id][3]}.log: {error}")
+                bar.update(len(partners))
+
+    print("\n--- 所有 rg 分析任务处理完成 ---")
+    print(f"✅ 成功: {pending_pairs - failed_pairs} 个配对")
+    if failed_pairs:
+        print(f"❌ 失败: {failed_pairs} 个配对 (重新运行将只重试失败的配对)")
+        for error in errors:
+            print(f"   - {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,9 @@
 
 echo "--- 开始批量格式化GWAS数据 ---"
 
-PY_SCRIPT_PATH="/path/to/your/ldsc/munge_sumstats.py"
+# 使用 clean_gwas 仓库中的 ldsc_munge.py (原生 Python 实现，结果与 munge_sumstats.py 一致)，
+# w_hm3.snplist 只加载一次，各工作进程共享，不再为每个文件启动一次 munge_sumstats.py
+PY_SCRIPT_PATH="/path/to/your/clean_gwas/ldsc_munge.py"
 SNP_LIST_PATH="/path/to/your/ldsc/eur_w_ld_chr/w_hm3.snplist"
 RAW_DATA_DIR="./raw"
 OUTPUT_DIR="./format_ldsc"
@@ -29,10 +31,8 @@ fi
 echo "系统总核心数: $TOTAL_CORES"
 echo "将使用 $MAX_JOBS 个核心并行运行..."
 
-LOG_FILE="$OUTPUT_DIR/parallel_jobs.log"
-echo "任务日志将记录在: $LOG_FILE"
-
-find "$RAW_DATA_DIR" -name "*.txt" | parallel --jobs $MAX_JOBS --bar --resume --joblog "$LOG_FILE" \
-    "python $PY_SCRIPT_PATH --sumstats {} --N-col N --merge-alleles $SNP_LIST_PATH --out $OUTPUT_DIR/{/.}"
+# 已存在 {文件名}.sumstats.gz 的输入会被跳过，中断后重新运行即可续传
+python "$PY_SCRIPT_PATH" --data-dir "$RAW_DATA_DIR" --pattern '*.txt' --out-dir "$OUTPUT_DIR" \
+    --merge-alleles "$SNP_LIST_PATH" --workers $MAX_JOBS
 
 echo "--- 所有任务处理完成 ---"
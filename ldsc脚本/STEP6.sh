@@ -27,67 +27,28 @@ echo "系统总核心数: $TOTAL_CORES, 将使用 $MAX_JOBS 个核心并行运
 LOG_FILE="$MAIN_OUTPUT_DIR/parallel_rg_all_pairs_jobs.log"
 echo "任务日志将记录在: $LOG_FILE"
 
-# --- 第二部分：定义核心分析函数 ---
-# 此函数接收两个文件作为输入，并执行rg分析
-run_ldsc_rg_ordered() {
-    local file1="$1"
-    local file2="$2"
-
-    # 从完整路径中提取基础名
-    local base1
-    local base2
-    base1=$(basename "$file1" .sumstats.gz)
-    base2=$(basename "$file2" .sumstats.gz)
-
-    # *** CHANGED LOGIC ***
-    # 直接按接收到的顺序组合文件名，不再进行字母排序
-    local out_name="${base1}_${base2}"
-
-    # 创建独立的输出子目录
-    local output_subdir="${MAIN_OUTPUT_DIR}/${out_name}"
-    mkdir -p "$output_subdir"
-
-    # 构建最终的输出文件前缀
-    local out_prefix="${output_subdir}/${out_name}"
-
-    # 执行LDSC命令
-    python "$LDSC_PY_PATH" \
-        --rg "${file1},${file2}" \
-        --ref-ld-chr "$REF_LD_PATH" \
-        --w-ld-chr "$REF_LD_PATH" \
-        --out "$out_prefix"
-}
-
-# 将函数和变量导出，以便 parallel 子进程可以访问
-export -f run_ldsc_rg_ordered
-export LDSC_PY_PATH REF_LD_PATH MAIN_OUTPUT_DIR
-
-# --- 第三部分：生成任务对并使用 GNU Parallel 执行 ---
-
-# 将所有输入文件读入一个数组
-shopt -s nullglob
-files=("$INPUT_DIR"/*.sumstats.gz)
-shopt -u nullglob
-
-num_files=${#files[@]}
-if [ "$num_files" -lt 1 ]; then
-    echo "在 $INPUT_DIR 中没有找到 .sumstats.gz 文件！"
-    exit 1
-fi
-# *** CHANGED LOGIC ***
-# 计算 N * N 个任务
-echo "找到了 $num_files 个文件，将生成 $((num_files * num_files)) 个分析任务。"
-
-# *** CHANGED LOGIC ***
-# 两个循环都从0开始，以生成所有 N*N 的组合
-{
-    for (( i=0; i<num_files; i++ )); do
-        for (( j=0; j<num_files; j++ )); do
-            # 输出两个文件名，用制表符分隔
-            printf "%s\t%s\n" "${files[i]}" "${files[j]}"
-        done
-    done
-} | parallel --colsep '\t' --jobs $MAX_JOBS --bar --resume --joblog "$LOG_FILE" run_ldsc_rg_ordered {1} {2}
-
+# --- 第二部分：批量运行所有 N*N 个有序配对 ---
+# 使用 clean_gwas 仓库中的 ldsc_rg_batch.py：每个进程只读取一次 LD 参考分数，
+# sumstats 放入按内存限制的 LRU 缓存，配对合并为 --rg t1,t2,...,tK 批量运行 (每批一个日志 ${MAIN_OUTPUT_DIR}/{性状1}/{性状1}_batchNNNN.log)。
+# 仍读取并追加 $LOG_FILE，之前用 GNU parallel 完成的配对会被跳过，中断后重新运行即可续传
+# (重试的批次写入新的 ..._batchNNNN_retryK.log，不会覆盖之前的日志)。
+# 注意: ldsc_rg_batch.py 在 Python 3 下运行并直接导入 ldsc，因此 ldsc 必须是可在 Python 3 下导入的版本
+# (上游 bulik/ldsc 为 Python 2.7 代码)，脚本启动时会检查并给出错误信息。
+BATCH_PY_PATH="/path/to/your/clean_gwas/ldsc_rg_batch.py"
+if [ ! -f "$BATCH_PY_PATH" ]; then echo "错误: Python脚本未找到: $BATCH_PY_PATH"; exit 1; fi
+
+# 每个进程 sumstats 缓存的内存上限 (GB)，应至少能容纳 BATCH_SIZE + 1 个文件
+CACHE_GB=4
+BATCH_SIZE=20
+
+python3 "$BATCH_PY_PATH" \
+    --ldsc-dir "$(dirname "$LDSC_PY_PATH")" \
+    --ref-ld "$REF_LD_PATH" \
+    --input-dir "$INPUT_DIR" \
+    --out-dir "$MAIN_OUTPUT_DIR" \
+    --joblog "$LOG_FILE" \
+    --workers $MAX_JOBS \
+    --batch-size $BATCH_SIZE \
+    --cache-gb $CACHE_GB
 
 echo "--- 所有 rg 分析任务处理完成 ---"
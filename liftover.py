@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+原生 Python 基因组坐标转换 (liftover)，替代逐个文件启动 Rscript + MungeSumstats 的方式。
+
+1. UCSC chain 文件 (例如 hg38ToHg19.over.chain.gz) 只解析一次，编译为目录 <chain>.idx/：
+   每个比对块 (block) 的源坐标区间、目标染色体/起点/链方向，按 (源染色体, 起点) 排序保存为 .npy，
+   之后以 mmap 方式打开，多个工作进程通过页缓存共享。
+2. 每个数据块的 BP 列通过 searchsorted 二分查找所在比对块，向量化换算为目标坐标。
+   无法转换、转换到多个位置 (落在重叠的比对块中) 或转换到 alt/random 等非主要染色体的位点被移除。
+   与 MungeSumstats::liftover 一样只转换坐标，不改变等位基因。
+3. 默认与 38to37.R/37to38.R (MungeSumstats::liftover) 相同，只标准化常见列名 (chr/pos/pval/eaf/...)
+   并转换坐标，只移除无法转换的位点；--drop-na --drop-mhc 沿用 38to37new.R 的额外步骤:
+   删除标准列中的空值、移除 MHC 区域 (hg19: chr6:28,477,797-33,448,354)。
+   文件按块流式读写 (与 format_sumstats.py 相同的读取/输出模块)，峰值内存只与块大小有关。
+
+用法:
+    python liftover.py --from hg38 --to hg19 --chain hg38ToHg19.over.chain.gz /path/to/folder --workers 8
+    python liftover.py --from hg19 --to hg38 --chain hg19ToHg38.over.chain.gz my_gwas.txt
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from build_cache import DEFAULT_MANIFEST_NAME, BuildManifest
+from column_profiles import detect_mapping, read_header
+from sumstats_io import (OUTPUT_COMPRESSIONS, OUTPUT_FORMATS, STANDARD_COLUMNS, SumstatsWriter,
+                         iter_sumstats_chunks, output_path)
+
+INDEX_SUFFIX = '.idx'
+_ARRAY_NAMES = ('src_chrom', 'src_start', 'src_end', 'dst_chrom', 'dst_start', 'dst_strand', 'dst_size')
+
+# MHC 区域 (1-based, 闭区间)，只在 --drop-mhc 时使用；hg19 坐标与 38to37new.R 一致，
+# hg38 坐标为 GRC 给出的 GRCh38 MHC 区域 (38to37new.R 只处理 hg19)
+MHC_REGIONS = {
+    'hg19': ('6', 28477797, 33448354),
+    'hg38': ('6', 28510120, 33480577),
+}
+BUILD_ALIASES = {'hg19': 'hg19', 'hg37': 'hg19', 'grch37': 'hg19', 'hg38': 'hg38', 'grch38': 'hg38'}
+
+# 进程池中每个工作进程共享的只读数据 (chain 索引、转换参数)，由 _init_worker 在进程启动时填充一次
+_WORKER_STATE = {}
+
+
+def _strip_chr(names):
+    """去掉染色体名的 'chr' 前缀，使 '1' 与 'chr1' 可以互相匹配。"""
+    s = pd.Series(np.asarray(names, dtype=object)).astype('string')
+    return s.str.replace(r'^chr', '', regex=True, case=False).fillna('').to_numpy(dtype=object)
+
+
+def _chain_blocks(header, rows):
+    """把一条 chain 的比对行换算为各比对块的源/目标起点 (0-based)。"""
+    # chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+    t_name, t_start = header[2], int(header[5])
+    q_name, q_size, q_strand, q_start = header[7], int(header[8]), header[9], int(header[10])
+    values = [r.split() for r in rows]
+    size = np.array([int(v[0]) for v in values], dtype=np.int64)
+    dt = np.array([int(v[1]) if len(v) > 1 else 0 for v in values], dtype=np.int64)
+    dq = np.array([int(v[2]) if len(v) > 2 else 0 for v in values], dtype=np.int64)
+    t_offsets = np.concatenate(([0], np.cumsum(size + dt)[:-1]))
+    q_offsets = np.concatenate(([0], np.cumsum(size + dq)[:-1]))
+    src_start = t_start + t_offsets
+    return {
+        't_name': t_name, 'q_name': q_name, 'src_start': src_start, 'src_end': src_start + size,
+        'dst_start': q_start + q_offsets, 'dst_strand': -1 if q_strand == '-' else 1, 'dst_size': q_size
+    }
+
+
+def _parse_chain(chain_path):
+    """解析 (可 gzip 压缩的) UCSC chain 文件，返回排好序的比对块数组和染色体名称表。"""
+    opener = gzip.open if chain_path.endswith('.gz') else open
+    chains = []
+    header, rows = None, []
+    with opener(chain_path, 'rt') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('chain'):
+                if header is not None:
+                    chains.append(_chain_blocks(header, rows))
+                header, rows = line.split(), []
+            elif line and header is not None:
+                rows.append(line)
+    if header is not None:
+        chains.append(_chain_blocks(header, rows))
+    if not chains:
+        raise ValueError(f"chain 文件 {chain_path} 中没有任何比对记录")
+
+    src_names = sorted({c['t_name'] for c in chains})
+    dst_names = sorted({c['q_name'] for c in chains})
+    src_code = {name: i for i, name in enumerate(src_names)}
+    dst_code = {name: i for i, name in enumerate(dst_names)}
+
+    arrays = {
+        'src_chrom': np.concatenate([np.full(len(c['src_start']), src_code[c['t_name']], np.int32) for c in chains]),
+        'src_start': np.concatenate([c['src_start'] for c in chains]),
+        'src_end': np.concatenate([c['src_end'] for c in chains]),
+        'dst_chrom': np.concatenate([np.full(len(c['src_start']), dst_code[c['q_name']], np.int32) for c in chains]),
+        'dst_start': np.concatenate([c['dst_start'] for c in chains]),
+        'dst_strand': np.concatenate([np.full(len(c['src_start']), c['dst_strand'], np.int8) for c in chains]),
+        'dst_size': np.concatenate([np.full(len(c['src_start']), c['dst_size'], np.int64) for c in chains]),
+    }
+    order = np.lexsort((arrays['src_start'], arrays['src_chrom']))
+    return {name: arr[order] for name, arr in arrays.items()}, src_names, dst_names
+
+
+class ChainIndex:
+    """按源染色体分段、按起点排序的比对块数组。被 pickle 时只传递路径，子进程重新以 mmap 打开。"""
+
+    def __init__(self, arrays, src_names, dst_names, path=None):
+        for name in _ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.src_names = list(src_names)
+        self.dst_names = list(dst_names)
+        self.path = path
+        # 每个源染色体在数组中的 [起, 止) 范围；"chr1" 与 "1" 视为同一条染色体
+        bounds = np.searchsorted(np.asarray(self.src_chrom), np.arange(len(self.src_names) + 1))
+        self.segments = {}
+        for i, name in enumerate(_strip_chr(self.src_names)):
+            self.segments.setdefault(name, (int(bounds[i]), int(bounds[i + 1])))
+        stripped = _strip_chr(self.dst_names)
+        # alt/random/Un 等非主要染色体上的转换结果不保留
+        self.dst_primary = np.array(['_' not in name for name in stripped], dtype=bool)
+        self.dst_stripped = stripped
+        self._sorted_ends = {}
+
+    def __len__(self):
+        return len(self.src_start)
+
+    def __reduce__(self):
+        if self.path is not None:
+            return (load_chain_index, (self.path,))
+        arrays = {name: np.asarray(getattr(self, name)) for name in _ARRAY_NAMES}
+        return (ChainIndex, (arrays, self.src_names, self.dst_names))
+
+    def _ends(self, chrom):
+        if chrom not in self._sorted_ends:
+            lo, hi = self.segments[chrom]
+            self._sorted_ends[chrom] = np.sort(np.asarray(self.src_end[lo:hi]))
+        return self._sorted_ends[chrom]
+
+    def lift(self, chroms, positions):
+        """
+        转换 1-based 坐标。返回 (目标染色体名 (不含 'chr'), 目标位置, 是否成功)。
+        只有恰好落在一个比对块内、且目标为主要染色体的位点视为转换成功。
+        """
+        chroms = _strip_chr(chroms)
+        pos0 = np.asarray(positions, dtype=np.int64) - 1
+        new_pos = np.full(len(pos0), -1, dtype=np.int64)
+        new_code = np.full(len(pos0), -1, dtype=np.int64)
+
+        for chrom in pd.unique(chroms):
+            if chrom not in self.segments:
+                continue
+            rows = np.flatnonzero(chroms == chrom)
+            lo, hi = self.segments[chrom]
+            starts = np.asarray(self.src_start[lo:hi])
+            ends = np.asarray(self.src_end[lo:hi])
+            p = pos0[rows]
+
+            right = np.searchsorted(starts, p, side='right')
+            idx = np.maximum(right - 1, 0)
+            # 覆盖该位置的比对块数 = 起点 <= p 的块数 - 终点 <= p 的块数
+            covering = right - np.searchsorted(self._ends(chrom), p, side='right')
+            inside = (right > 0) & (p < ends[idx]) & (covering == 1)
+
+            # 极少数情况下唯一覆盖的块不是起点最近的那个 (被更长的前序块包含)，逐个查找
+            for k in np.flatnonzero((covering == 1) & ~inside):
+                hit = np.flatnonzero((starts[:right[k]] <= p[k]) & (ends[:right[k]] > p[k]))
+                if len(hit) == 1:
+                    idx[k] = hit[0]
+                    inside[k] = True
+
+            block = lo + idx[inside]
+            offset = p[inside] - np.asarray(self.src_start[block])
+            q = np.asarray(self.dst_start[block]) + offset
+            q = np.where(np.asarray(self.dst_strand[block]) < 0, np.asarray(self.dst_size[block]) - 1 - q, q)
+            new_pos[rows[inside]] = q + 1
+            new_code[rows[inside]] = np.asarray(self.dst_chrom[block])
+
+        ok = new_code >= 0
+        ok[ok] = self.dst_primary[new_code[ok]]
+        names = np.full(len(pos0), '', dtype=object)
+        names[ok] = self.dst_stripped[new_code[ok]]
+        return names, new_pos, ok
+
+
+def _source_signature(chain_path):
+    st = os.stat(chain_path)
+    return {'source': os.path.abspath(chain_path), 'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+def compile_chain_index(chain_path, out_dir=None):
+    """解析 chain 文件并保存为可 mmap 的索引目录，返回 ChainIndex。"""
+    out_dir = out_dir or chain_path + INDEX_SUFFIX
+    arrays, src_names, dst_names = _parse_chain(chain_path)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in _ARRAY_NAMES:
+        np.save(os.path.join(out_dir, f"{name}.npy"), arrays[name])
+    meta = dict(_source_signature(chain_path), n_blocks=int(len(arrays['src_start'])),
+                src_names=src_names, dst_names=dst_names)
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return ChainIndex(arrays, src_names, dst_names, path=out_dir)
+
+
+def load_chain_index(index_dir):
+    """以只读 mmap 方式打开已编译的 chain 索引目录。"""
+    with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r') for name in _ARRAY_NAMES}
+    return ChainIndex(arrays, meta['src_names'], meta['dst_names'], path=index_dir)
+
+
+def is_index_fresh(chain_path, index_dir):
+    """索引存在且记录的 chain 文件大小/修改时间与当前文件一致时返回 True。"""
+    meta_path = os.path.join(index_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    current = _source_signature(chain_path)
+    return meta.get('size') == current['size'] and meta.get('mtime') == current['mtime']
+
+
+def load_or_compile(chain_path, index_dir=None):
+    """优先打开新鲜的已编译索引；否则先编译一次再打开。"""
+    index_dir = index_dir or chain_path + INDEX_SUFFIX
+    if not is_index_fresh(chain_path, index_dir):
+        print(f"  -> 未找到可用的 chain 索引，正在编译: {index_dir} ...")
+        try:
+            compile_chain_index(chain_path, index_dir)
+        except OSError as e:
+            # chain 文件所在目录不可写时退回到进程内索引 (不保存到磁盘)
+            print(f"  -> 警告: 无法保存索引 ({e})，本次在内存中使用。")
+            return ChainIndex(*_parse_chain(chain_path))
+    return load_chain_index(index_dir)
+
+
+def liftover_chunk(chunk, chain, mhc_region=None, drop_na=False):
+    """
+    对一个已标准化列名的数据块执行: (drop_na 时) 删除标准列空值 -> 坐标转换 -> (给出 mhc_region 时) 移除 MHC 区域。
+    BP 为空的行无法转换，总是被移除。返回 (结果数据块, 各步骤移除的行数 dict)。
+    """
+    counts = {}
+    before = len(chunk)
+    if drop_na:
+        chunk = chunk.dropna(subset=[c for c in STANDARD_COLUMNS if c in chunk.columns])
+    bp = pd.to_numeric(chunk['BP'], errors='coerce')
+    chunk = chunk[bp.notna()]
+    counts['na'] = before - len(chunk)
+
+    source_chr = chunk['CHR'].astype(str)
+    names, new_pos, ok = chain.lift(source_chr.to_numpy(), bp[bp.notna()].to_numpy(dtype=np.int64))
+    counts['unmapped'] = int((~ok).sum())
+    # 输出保持输入的染色体命名风格 (有无 'chr' 前缀)
+    has_prefix = source_chr.str.lower().str.startswith('chr').to_numpy()
+    names = np.where(has_prefix, 'chr' + names.astype(str), names)
+    chunk = chunk[ok].assign(CHR=names[ok], BP=new_pos[ok])
+
+    if mhc_region is not None:
+        mhc_chr, mhc_start, mhc_end = mhc_region
+        in_mhc = (_strip_chr(chunk['CHR']) == mhc_chr) & (chunk['BP'] >= mhc_start).to_numpy() \
+            & (chunk['BP'] <= mhc_end).to_numpy()
+        counts['mhc'] = int(in_mhc.sum())
+        chunk = chunk[~in_mhc]
+    return chunk, counts
+
+
+def liftover_file(input_path, output_filename, chain, mhc_region=None, compress='none', threads=1,
+                  out_format='tsv', chunk_size=500000, drop_na=False):
+    """
+    流式转换单个文件。输出先写入临时文件，完成后再改名，中断不会留下不完整的结果。
+    返回状态信息字符串 (以 成功/警告/错误 开头)。
+    """
+    filename = os.path.basename(input_path)
+    tmp_path = output_filename + '.tmp'
+    try:
+        # 步骤 1: 按常见别名标准化列名 (与 38to37new.R 的 col_map 相同的规则)
+        columns, sep = read_header(input_path)
+        mapping, _ = detect_mapping(columns)
+        missing = [c for c in ('CHR', 'BP') if c not in mapping]
+        if missing:
+            return f"警告: 文件 {filename} 中找不到 {', '.join(missing)} 列，已跳过。"
+        rename_map = {raw: standard for standard, raw in mapping.items() if raw != standard}
+        dtype = {mapping['CHR']: str}
+        if 'SNP' in mapping:
+            dtype[mapping['SNP']] = str
+        if 'P' in mapping:
+            # P 值原样输出：按数值解析会把 1e-400 这样的极小 P 值变为 0
+            dtype[mapping['P']] = str
+
+        totals = {'in': 0, 'na': 0, 'unmapped': 0, 'mhc': 0, 'out': 0}
+        writer = SumstatsWriter(tmp_path, compress=compress, threads=threads, out_format=out_format)
+        write_header = True
+        with open(tmp_path, 'wb') as out_file:
+            for chunk in iter_sumstats_chunks(input_path, chunk_size, sep=sep or '\t', dtype=dtype):
+                totals['in'] += len(chunk)
+                chunk = chunk.rename(columns=rename_map)
+                # 步骤 2-4: (可选) 清理空值、转换坐标、(可选) 移除 MHC
+                lifted, counts = liftover_chunk(chunk, chain, mhc_region, drop_na)
+                for key, value in counts.items():
+                    totals[key] += value
+                if lifted.empty and not write_header:
+                    continue
+                out_file.write(writer.encode(lifted, header=write_header, offset=out_file.tell()))
+                totals['out'] += len(lifted)
+                write_header = False
+            writer.finish(out_file)
+        # 坐标转换后数据通常不再有序，BGZF 输出此时不会生成 tabix 索引
+        writer.close()
+
+        os.replace(tmp_path, output_filename)
+        if os.path.exists(tmp_path + '.tbi'):
+            os.replace(tmp_path + '.tbi', output_filename + '.tbi')
+        return (f"成功处理: {filename} -> {output_filename} "
+                f"(输入 {totals['in']} 行, 空值 {totals['na']}, 无法转换 {totals['unmapped']}, "
+                f"MHC {totals['mhc']}, 输出 {totals['out']} 行)")
+    except Exception as e:
+        for path in (tmp_path, tmp_path + '.tbi'):
+            if os.path.exists(path):
+                os.remove(path)
+        return f"错误: 处理文件 {input_path} 时失败: {e}"
+
+
+def _init_worker(chain, mhc_region, compress, threads, out_format, chunk_size, drop_na):
+    """进程池初始化函数：chain 索引只传递路径，各工作进程自行 mmap 打开。"""
+    _WORKER_STATE.update(chain=chain, mhc_region=mhc_region, compress=compress, threads=threads,
+                         out_format=out_format, chunk_size=chunk_size, drop_na=drop_na)
+
+
+def _process_in_worker(job):
+    """工作进程入口：使用共享状态转换单个文件。"""
+    input_path, output_filename = job
+    return liftover_file(input_path, output_filename, **_WORKER_STATE)
+
+
+def collect_jobs(inputs, out_dir, dir_name, suffix, compress, out_format):
+    """展开输入 (文件或目录) 为 (输入文件, 输出文件) 列表；目录中的结果默认放在其下的 dir_name 子目录。"""
+    jobs = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files = sorted(glob.glob(os.path.join(item, '*.txt')) + glob.glob(os.path.join(item, '*.txt.gz'))
+                           + glob.glob(os.path.join(item, '*.parquet')))
+            target_dir = out_dir or os.path.join(item, dir_name)
+        else:
+            files = [item]
+            target_dir = out_dir or '.'
+        for path in files:
+            base = os.path.basename(path)
+            for ext in ('.gz', '.txt', '.parquet'):
+                if base.endswith(ext):
+                    base = base[:-len(ext)]
+            jobs.append((path, os.path.join(target_dir, output_path(f"{base}{suffix}.txt", compress, out_format))))
+    return jobs
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="使用 UCSC chain 文件批量转换标准格式GWAS数据的基因组坐标。")
+    parser.add_argument('inputs', nargs='+', help="输入文件或文件夹 (文件夹内的 *.txt、*.txt.gz、*.parquet 都会被处理)。")
+    parser.add_argument('--from', dest='from_build', default='hg38', help="输入坐标版本 (hg38/hg19/hg37)。默认为 hg38。")
+    parser.add_argument('--to', dest='to_build', default='hg19', help="目标坐标版本 (hg19/hg37/hg38)。默认为 hg19。")
+    parser.add_argument('--chain', help="UCSC chain 文件路径。默认为当前目录下的 hg38ToHg19.over.chain.gz 或 hg19ToHg38.over.chain.gz。")
+    parser.add_argument('--out-dir', help="输出目录。默认: 文件夹输入写入其下的 h38toh37/h37toh38 子目录，文件输入写入当前目录。")
+    parser.add_argument('--drop-na', action='store_true', help="删除 10 个标准列中任一列为空的行 (与 38to37new.R 相同)。默认只删除 BP 为空、无法转换的行。")
+    parser.add_argument('--drop-mhc', action='store_true', help="转换后移除目标版本的 MHC 区域 (与 38to37new.R 相同)。默认保留。")
+    parser.add_argument('--overwrite', action='store_true', help="忽略构建清单，重新处理所有输入 (默认只处理新增或有变化的输入，支持断点续跑)。")
+    parser.add_argument('--manifest', help=f"构建清单路径。默认为各输出目录共同的上级目录下的 {DEFAULT_MANIFEST_NAME}。")
+    parser.add_argument('--workers', type=int, default=1, help="并行处理文件的进程数。默认为 1。")
+    parser.add_argument('--chunk-size', type=int, default=500000, help="每块读取的行数。默认为 500000。")
+    parser.add_argument('--compress', choices=OUTPUT_COMPRESSIONS, default='none', help="输出压缩方式。默认为 'none'。")
+    parser.add_argument('--threads', type=int, default=1, help="每个文件用于 BGZF 块压缩的线程数。默认为 1。")
+    parser.add_argument('--out-format', choices=OUTPUT_FORMATS, default='tsv', help="输出格式。默认为 'tsv'。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    from_build = BUILD_ALIASES.get(args.from_build.lower())
+    to_build = BUILD_ALIASES.get(args.to_build.lower())
+    if from_build is None or to_build is None or from_build == to_build:
+        print(f"[!] 错误: 不支持的转换方向 {args.from_build} -> {args.to_build}。", file=sys.stderr)
+        sys.exit(1)
+
+    chain_path = args.chain or (f"./{from_build}To{to_build[0].upper()}{to_build[1:]}.over.chain.gz")
+    if not os.path.exists(chain_path):
+        print(f"[!] 错误: chain 文件 '{chain_path}' 不存在 (可从 UCSC 下载，例如 "
+              f"https://hgdownload.soe.ucsc.edu/goldenPath/{from_build}/liftOver/)。", file=sys.stderr)
+        sys.exit(1)
+
+    # 输出命名沿用 38to37.sh / 37to38.sh: XXX_hg37.txt / XXX_hg38.txt，文件夹结果放在 h38toh37 / h37toh38
+    suffix = '_hg37' if to_build == 'hg19' else '_hg38'
+    dir_name = 'h38toh37' if to_build == 'hg19' else 'h37toh38'
+    mhc_region = MHC_REGIONS[to_build] if args.drop_mhc else None
+
+    print(f"--- 坐标转换 ({from_build} -> {to_build}) ---")
+    print(f"正在加载 chain 文件: {chain_path}...")
+    chain = load_or_compile(chain_path)
+    print(f"✅ 成功加载 {len(chain)} 个比对块。")
+
+    jobs = collect_jobs(args.inputs, args.out_dir, dir_name, suffix, args.compress, args.out_format)
+    if not jobs:
+        print("⚠️ 警告: 没有找到任何输入文件。")
+        return
+    # 构建清单记录输入与 chain 文件的哈希和转换参数 (见 build_cache.py)：只处理新增、内容改变或参数改变的输入，
+    # 没有清单记录的已有结果 (升级前生成) 沿用
+    manifest_path = args.manifest or os.path.join(
+        os.path.commonpath([os.path.abspath(os.path.dirname(job[1]) or '.') for job in jobs]), DEFAULT_MANIFEST_NAME)
+    manifest = BuildManifest(manifest_path)
+    manifest.prefetch([job[0] for job in jobs] + [chain_path], threads=max(4, args.workers))
+    params = {'from': from_build, 'to': to_build, 'mhc_region': mhc_region, 'drop_na': args.drop_na,
+              'compress': args.compress, 'out_format': args.out_format}
+    signatures = {}
+    pending = []
+    for input_path, output_filename in jobs:
+        digest, detail = manifest.signature({'input': input_path, 'chain': chain_path}, params)
+        if args.overwrite or not manifest.up_to_date(output_filename, digest, detail):
+            signatures[output_filename] = (output_filename, digest, detail)
+            pending.append((input_path, output_filename))
+    manifest.save()
+    skipped = len(jobs) - len(pending)
+    for _, output_filename in pending:
+        os.makedirs(os.path.dirname(output_filename) or '.', exist_ok=True)
+    print(f"共找到 {len(jobs)} 个文件，其中 {skipped} 个已是最新 (跳过)。")
+
+    results = []
+
+    def record_status(output_filename, status):
+        results.append(status)
+        if status.startswith("成功"):
+            manifest.record(*signatures[output_filename])
+            manifest.save()
+
+    workers = max(1, min(args.workers, len(pending))) if pending else 1
+    if workers == 1:
+        for input_path, output_filename in tqdm(pending, desc="总体进度", unit="个文件"):
+            record_status(output_filename, liftover_file(input_path, output_filename, chain, mhc_region, args.compress,
+                                                         args.threads, args.out_format, args.chunk_size,
+                                                         args.drop_na))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(chain, mhc_region, args.compress, args.threads, args.out_format, args.chunk_size, args.drop_na)
+        ) as executor:
+            futures = {executor.submit(_process_in_worker, job): job for job in pending}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="总体进度", unit="个文件"):
+                try:
+                    status = future.result()
+                except Exception as e:
+                    status = f"错误: 处理文件 {futures[future][0]} 时失败: {e}"
+                record_status(futures[future][1], status)
+
+    print("\n--- 所有任务处理完毕 ---")
+    if skipped:
+        print(f"⏭️ 已是最新 (跳过): {skipped} 个文件")
+    for r in results:
+        if r.startswith("成功"):
+            print(f"   - {r}")
+    print(f"✅ 本次成功: {sum(1 for r in results if r.startswith('成功'))} 个文件")
+    for label, prefix in (("⚠️ 警告 (跳过)", "警告"), ("❌ 错误", "错误")):
+        selected = [r for r in results if r.startswith(prefix)]
+        if selected:
+            print(f"{label}: {len(selected)} 个文件")
+            for r in selected:
+                print(f"   - {r}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+清洗脚本的分阶段计时与指标记录 (--metrics / --profile)。
+
+每个文件处理时创建一个 FileMetrics，按片段记录:
+  - 各阶段耗时 (秒)：inflate (gzip 解压与分块)、parse (CSV 解析)、rename、p_filter、merge、ambiguity、write；
+  - 各过滤步骤的输入/输出行数；
+  - 当前与峰值常驻内存 (RSS, MB)。
+记录以 JSON-lines 追加写入 --metrics 指定的文件 (每个片段一行 type=chunk，每个文件结束时一行 type=file 汇总，
+处理失败的文件汇总中 status 为 error)。
+每条记录用一次 O_APPEND 写入，多个工作进程可以写同一个文件。未指定 --metrics 时只计时、不写出。
+
+--profile DIR 以 cProfile 运行每个文件的处理函数，结果保存为 DIR/{文件名}.prof
+(可用 python -m pstats 或 snakeviz 查看)；需要火焰图时也可直接用 py-spy record -- python 脚本.py ...，
+各阶段都在独立的代码行上，采样结果能对应到上面的阶段名。
+"""
+
+import cProfile
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_mb():
+    """当前进程的常驻内存 (MB)；无法读取 /proc 时返回 None。"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_mb():
+    """进程启动以来的峰值常驻内存 (MB)，Linux 上 ru_maxrss 的单位为 KB。"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MetricsRecorder:
+    """
+    JSON-lines 指标文件。path 为 None 时不写出任何内容。只按路径序列化，可通过 initargs 传给工作进程。
+    文件在第一次写入时打开，用完后调用 close() (或用作上下文管理器) 关闭。
+    """
+
+    def __init__(self, path=None, script=None):
+        self.path = path
+        self.script = script
+        self._fd = None
+
+    def __reduce__(self):
+        return (MetricsRecorder, (self.path, self.script))
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def write(self, record):
+        if self.path is None:
+            return
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(self._fd, (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    def close(self):
+        """关闭指标文件的描述符；之后再写入时会重新打开 (同一个记录器可以按文件多次关闭)。"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def file(self, name):
+        return FileMetrics(self, name)
+
+
+class FileMetrics:
+    """单个文件的指标：用 chunks() 包装片段迭代器，在循环体内用 stage() 计时、rows() 记录过滤前后行数。"""
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.rows_by_step = {}
+        self.rows_in = 0
+        self.rows_out = 0
+        self.chunk_count = 0
+        self._chunk = None
+
+    def _new_chunk(self):
+        self._chunk = {'stages': {}, 'rows': {}, 'rows_in': 0, 'rows_out': 0}
+
+    def _add_time(self, name, seconds):
+        if self._chunk is not None:
+            self._chunk['stages'][name] = self._chunk['stages'].get(name, 0.0) + seconds
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_time(name, time.perf_counter() - start)
+
+    def rows(self, step, rows_in, rows_out):
+        """记录一个过滤步骤的输入/输出行数。"""
+        if self._chunk is not None:
+            self._chunk['rows'][step] = [int(rows_in), int(rows_out)]
+        total = self.rows_by_step.setdefault(step, [0, 0])
+        total[0] += int(rows_in)
+        total[1] += int(rows_out)
+
+    def chunk_rows(self, rows_in=None, rows_out=None):
+        """记录当前片段读入/写出的行数。"""
+        if rows_in is not None:
+            self._chunk['rows_in'] = int(rows_in)
+            self.rows_in += int(rows_in)
+        if rows_out is not None:
+            self._chunk['rows_out'] = int(rows_out)
+            self.rows_out += int(rows_out)
+
+    def _emit_chunk(self):
+        if self._chunk is None:
+            return
+        chunk, self._chunk = self._chunk, None
+        self.recorder.write({
+            'type': 'chunk', 'script': self.recorder.script, 'file': self.name, 'pid': os.getpid(),
+            'chunk': self.chunk_count, 'rows_in': chunk['rows_in'], 'rows_out': chunk['rows_out'],
+            'stages': {k: round(v, 6) for k, v in chunk['stages'].items()}, 'rows': chunk['rows'],
+            'rss_mb': current_rss_mb(), 'peak_rss_mb': peak_rss_mb(),
+        })
+        self.chunk_count += 1
+
+    def chunks(self, iterable, stage='inflate'):
+        """
+        逐个产出片段，并把取下一个片段的时间计入 stage (例如 gzip 解压与分块)。
+        每个片段的记录在循环体结束 (取下一个片段) 时写出。
+        """
+        iterator = iter(iterable)
+        while True:
+            self._emit_chunk()
+            self._new_chunk()
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._chunk = None
+                return
+            finally:
+                self._add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def close(self, error=None):
+        """
+        写出最后一个片段 (如有) 和整个文件的汇总记录。处理失败时也应调用 (在 finally 中)，
+        error 为异常或错误信息，汇总记录的 status 为 'error'，以便区分中途失败的文件。
+        """
+        self._emit_chunk()
+        self.recorder.write({
+            'type': 'file', 'script': self.recorder.script, 'file': self.name, 'pid': os.getpid(),
+            'status': 'error' if error is not None else 'ok', 'error': None if error is None else str(error),
+            'chunks': self.chunk_count, 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+            'seconds': round(time.perf_counter() - self.start, 6),
+            'stages': {k: round(v, 6) for k, v in self.stages.items()}, 'rows': self.rows_by_step,
+            'peak_rss_mb': peak_rss_mb(),
+        })
+
+
+def run_profiled(profile_dir, name, func, *args, **kwargs):
+    """profile_dir 不为 None 时用 cProfile 运行 func，统计结果保存为 profile_dir/{name}.prof。"""
+    if profile_dir is None:
+        return func(*args, **kwargs)
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
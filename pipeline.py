@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+单次读取的多阶段流水线：格式化 -> 质控 -> 坐标转换 -> ldsc munge，按配置文件串联。
+
+原来的流程中每一步都是一个独立的进程 (format_sumstats.py -> 38to37.sh -> format_ldsc.sh)，
+每一步都要完整地读一遍、写一遍整个文件。这里把各步骤写成作用于数据块的阶段 (stage)，
+用串联的生成器依次处理同一次读取得到的每个数据块，只写出最终结果，并统计每个阶段的输入/输出行数。
+
+配置文件为 JSON，例如 (默认的 FinnGen hg38 -> hg19 流程见 pipeline_finngen.json，
+再生成 ldsc .sumstats.gz 的流程见 pipeline_finngen_ldsc.json):
+    {
+      "inputs": ["finngen_R12_*.gz"],
+      "chunk_size": 500000,
+      "stages": [
+        {"stage": "format", "metadata": "finnGen_R12.xlsx"},
+        {"stage": "qc", "merge_alleles": "./w_hm3.snplist"},
+        {"stage": "liftover", "chain": "./hg38ToHg19.over.chain.gz", "from": "hg38", "to": "hg19"}
+      ],
+      "output": {"dir": "./h38toh37", "suffix": "_hg37", "compress": "none", "out_format": "tsv"}
+    }
+
+可用的阶段 (STAGES):
+    format    列名标准化 (mapping 显式指定，否则按 column_profiles 自动识别；aliases 为用户别名表)；
+              N 为列名或固定数值，或由 metadata (finnGen_R12.xlsx) 按文件名中的 phenocode 计算
+              num_cases + num_controls (与 finn_clean.py 相同)
+    qc        P 值有效性过滤 (p_filter)、HapMap3 等位基因匹配 (merge_alleles)、链模糊SNP过滤 (drop_ambiguous)
+    liftover  坐标转换 (与 38to37.sh 相同)；drop_na / drop_mhc 为 true 时另外删除标准列空值、
+              移除目标版本的 MHC 区域 (与 38to37new.R 相同)，见 liftover.py
+    munge     生成 ldsc 的 <name>.sumstats.gz (merge_alleles、maf_min、n_min、z_source)，见 ldsc_munge.py；
+              只能作为最后一个阶段，此时 output 中的 compress/out_format 不起作用
+
+用法:
+    python pipeline.py --config pipeline_finngen.json --workers 8
+    python pipeline.py --config my_flow.json gwas1.txt gwas2.txt.gz --report counts.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+
+import liftover
+from build_cache import DEFAULT_MANIFEST_NAME, BuildManifest
+from column_profiles import detect_mapping, load_user_aliases, read_header
+from hm3_index import load_or_compile, match_reference_index
+from ldsc_munge import MungeStage
+from sumstats_io import OUTPUT_COMPRESSIONS, OUTPUT_FORMATS, STANDARD_COLUMNS, SumstatsWriter, \
+    iter_sumstats_chunks, output_path
+from sumstats_qc import drop_strand_ambiguous
+from sumstats_schema import LP_COLUMN, parse_pvalues, pvalue_arrays, select_columns, valid_pvalue_mask
+
+DEFAULT_CHUNK_SIZE = 500000
+# FinnGen 文件名中的 phenocode，与 finn_clean.py 的 filename.replace('finngen_R12_', '').replace('.gz', '') 一致
+DEFAULT_PHENOCODE_PATTERN = r'^finngen_R12_(.+?)\.gz$'
+
+# 进程池中每个工作进程共享的阶段对象和输出配置，由 _init_worker 在进程启动时填充一次
+_WORKER_STATE = {}
+
+
+class SkipFile(Exception):
+    """阶段在绑定到某个文件时发现无法处理 (例如元数据中没有对应的 phenocode)，该文件被跳过。"""
+
+
+class FormatStage:
+    """列名标准化：输出只包含识别到的标准列，按 STANDARD_COLUMNS 排序。"""
+    name = 'format'
+
+    def __init__(self, options):
+        self.mapping = dict(options.get('mapping') or {})
+        self.aliases = load_user_aliases(options['aliases']) if options.get('aliases') else None
+        self.n = options.get('N')
+        self.n_by_phenocode = None
+        self.phenocode_pattern = options.get('phenocode_pattern', DEFAULT_PHENOCODE_PATTERN)
+        # 影响结果的参考文件，其哈希计入构建签名 (元数据表只按每个文件对应的 N 计入，见 metadata_n)
+        self.build_inputs = {'aliases': options.get('aliases')}
+        if options.get('metadata'):
+            # 元数据表只在主进程读取一次，工作进程只接收 {phenocode: N} 字典
+            metadata = pd.read_excel(options['metadata'], engine='openpyxl').set_index('phenocode')
+            n_total = metadata['num_cases'] + metadata['num_controls']
+            self.n_by_phenocode = {str(k): int(v) for k, v in n_total.items()}
+
+    def metadata_n(self, input_path):
+        """按文件名中的 phenocode 在元数据中查找的 N；未使用元数据表或找不到时为 None。"""
+        if self.n_by_phenocode is None:
+            return None
+        match = re.match(self.phenocode_pattern, os.path.basename(input_path))
+        return self.n_by_phenocode.get(match.group(1)) if match else None
+
+    def bind(self, context):
+        mapping, _ = detect_mapping(context['columns'], self.aliases)
+        mapping.update(self.mapping)
+        n_value = None
+        if self.n_by_phenocode is not None:
+            match = re.match(self.phenocode_pattern, os.path.basename(context['input']))
+            phenocode = match.group(1) if match else None
+            if phenocode not in self.n_by_phenocode:
+                raise SkipFile(f"在元数据中找不到 Phenocode '{phenocode}'")
+            n_value = self.n_by_phenocode[phenocode]
+            context['name'] = phenocode
+            mapping.pop('N', None)
+        elif self.n is not None and str(self.n).isdigit():
+            n_value = int(self.n)
+            mapping.pop('N', None)
+        elif self.n is not None:
+            mapping['N'] = self.n
+
+        missing = [c for c in STANDARD_COLUMNS if c not in mapping and not (c == 'N' and n_value is not None)]
+        missing = [c for c in missing if c not in context['columns']]
+        if missing:
+            raise ValueError(f"无法识别以下标准列: {', '.join(missing)} (可在配置的 mapping 中指定)")
+        for column in STANDARD_COLUMNS:
+            mapping.setdefault(column, column)
+        if n_value is not None:
+            mapping.pop('N')
+
+        rename_map = {raw: standard for standard, raw in mapping.items()}
+        context['usecols'] = list(rename_map)
+        context['dtype'] = {mapping[c]: str for c in ('CHR', 'SNP', 'A1', 'A2', 'P')}
+
+        def transform(chunk):
+            chunk = chunk[list(rename_map)].rename(columns=rename_map)
+            # 下溢为 0 的极小 P 值 (如 1e-400) 另存 -log10 P，写出时还原为原来的文本
+            chunk['P'], chunk[LP_COLUMN] = parse_pvalues(chunk['P'])
+            if n_value is not None:
+                chunk['N'] = n_value
+            return select_columns(chunk, STANDARD_COLUMNS)
+        return transform
+
+
+class QCStage:
+    """P 值有效性过滤 -> (可选) HapMap3 等位基因匹配 -> 链模糊SNP过滤，与 finn_clean_plus.py 的步骤相同。"""
+    name = 'qc'
+
+    def __init__(self, options):
+        self.p_filter = options.get('p_filter', True)
+        self.drop_ambiguous = options.get('drop_ambiguous', True)
+        # 参考索引被传递给工作进程时只携带路径，各进程自行 mmap 打开
+        self.reference_index = load_or_compile(options['merge_alleles']) if options.get('merge_alleles') else None
+        self.build_inputs = {'merge_alleles': options.get('merge_alleles')}
+
+    def bind(self, context):
+        return self.apply
+
+    def apply(self, chunk):
+        if self.p_filter:
+            chunk = chunk[valid_pvalue_mask(*pvalue_arrays(chunk))]
+        if self.reference_index is not None:
+            chunk = match_reference_index(chunk, self.reference_index)
+        if self.drop_ambiguous:
+            chunk = drop_strand_ambiguous(chunk)
+        return chunk
+
+
+class LiftoverStage:
+    """坐标转换：(drop_na) 删除标准列空值 -> 转换坐标 -> (drop_mhc) 移除 MHC，见 liftover.liftover_chunk。"""
+    name = 'liftover'
+
+    def __init__(self, options):
+        from_build = liftover.BUILD_ALIASES.get(str(options.get('from', 'hg38')).lower())
+        to_build = liftover.BUILD_ALIASES.get(str(options.get('to', 'hg19')).lower())
+        if from_build is None or to_build is None or from_build == to_build:
+            raise ValueError(f"不支持的转换方向 {options.get('from')} -> {options.get('to')}")
+        chain_path = options.get('chain') or f"./{from_build}To{to_build[0].upper()}{to_build[1:]}.over.chain.gz"
+        self.chain = liftover.load_or_compile(chain_path)
+        self.build_inputs = {'chain': chain_path}
+        self.mhc_region = liftover.MHC_REGIONS[to_build] if options.get('drop_mhc') else None
+        self.drop_na = bool(options.get('drop_na'))
+
+    def bind(self, context):
+        return self.apply
+
+    def apply(self, chunk):
+        return liftover.liftover_chunk(chunk, self.chain, self.mhc_region, self.drop_na)[0]
+
+
+# 阶段名 -> 阶段类；每个类接收配置中该阶段的选项，bind(context) 返回作用于单个数据块的函数
+STAGES = {
+    'format': FormatStage,
+    'qc': QCStage,
+    'liftover': LiftoverStage,
+    'munge': MungeStage,
+}
+
+
+def load_config(path):
+    """读取 JSON 配置并检查阶段名。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    stages = config.get('stages') or []
+    if not stages:
+        raise ValueError("配置中没有任何阶段 (stages)")
+    unknown = [s.get('stage') for s in stages if s.get('stage') not in STAGES]
+    if unknown:
+        raise ValueError(f"未知的阶段: {', '.join(map(str, unknown))} (可用: {', '.join(STAGES)})")
+    # 自行写出结果的阶段 (munge) 需要看到全部数据，只能放在最后
+    if any(hasattr(STAGES[s['stage']], 'write_output') for s in stages[:-1]):
+        raise ValueError("munge 阶段只能作为最后一个阶段")
+    return config
+
+
+def build_stages(config):
+    """按配置顺序实例化各阶段 (参考文件/chain 索引在这里加载一次)。"""
+    return [STAGES[options['stage']](options) for options in config['stages']]
+
+
+def _stem(path):
+    """去掉 .gz/.bgz/.tsv/.txt/.csv/.parquet 等后缀，作为默认输出名。"""
+    base = os.path.basename(path)
+    while True:
+        stem, ext = os.path.splitext(base)
+        if ext.lower() not in ('.gz', '.bgz', '.tsv', '.txt', '.csv', '.parquet', '.pq', '.h'):
+            return base
+        base = stem
+
+
+def _counted(chunks, transform, stats):
+    """把一个阶段串到数据块生成器上，并累计该阶段的输入/输出行数。"""
+    for chunk in chunks:
+        stats['in'] += len(chunk)
+        chunk = transform(chunk)
+        stats['out'] += len(chunk)
+        yield chunk
+
+
+def _write_standard(chunks, path, output):
+    """把数据块依次写出为标准格式 (TSV/BGZF/Parquet)，返回写出的行数。"""
+    writer = SumstatsWriter(path, compress=output.get('compress', 'none'), threads=output.get('threads', 1),
+                            out_format=output.get('out_format', 'tsv'))
+    written = 0
+    write_header = True
+    with open(path, 'wb') as out_file:
+        for chunk in chunks:
+            if chunk.empty and not write_header:
+                continue
+            out_file.write(writer.encode(chunk, header=write_header, offset=out_file.tell()))
+            written += len(chunk)
+            write_header = False
+        writer.finish(out_file)
+    writer.close()
+    return written
+
+
+def build_signature(manifest, input_path, config, stages, output):
+    """
+    单个输入的构建签名 (见 build_cache.py)：输入文件与各阶段参考文件 (aliases/merge_alleles/chain) 的哈希、
+    阶段配置与输出设置，以及该文件在元数据表中对应的 N —— 元数据表中其他表型的改动不会触发重建。
+    """
+    inputs = {'input': input_path}
+    for i, stage in enumerate(stages):
+        for key, path in getattr(stage, 'build_inputs', {}).items():
+            inputs[f"{i}.{stage.name}.{key}"] = path
+    params = {
+        'stages': [{k: v for k, v in options.items() if k != 'metadata'} for options in config['stages']],
+        'output': {k: v for k, v in output.items() if k != 'threads'},
+        'metadata_n': [stage.metadata_n(input_path) for stage in stages if hasattr(stage, 'metadata_n')],
+    }
+    return manifest.signature(inputs, params)
+
+
+def run_file(input_path, stages, output, chunk_size=DEFAULT_CHUNK_SIZE, overwrite=False, manifest=None,
+             signature=None):
+    """
+    对单个文件执行整条流水线，只写出最终结果 (先写临时文件，完成后再改名)。
+    给出 manifest 和 signature 时，只在输出不存在或签名改变时处理；否则已有输出即跳过。
+    返回 (状态信息, 行数记录)；状态信息以 成功/跳过/警告/错误 开头。
+    """
+    filename = os.path.basename(input_path)
+    record = {'input': input_path, 'output': None, 'read': 0, 'stages': []}
+    tmp_path = None
+    try:
+        columns, sep = read_header(input_path)
+        context = {'input': input_path, 'columns': columns, 'name': _stem(input_path),
+                   'usecols': None, 'dtype': None}
+        try:
+            transforms = [(stage.name, stage.bind(context)) for stage in stages]
+        except SkipFile as e:
+            return f"警告: {e}，跳过文件 {filename}", record
+        if context['dtype'] is None and 'P' in columns:
+            # 没有 format 阶段时 P 也按文本读取，避免 1e-400 这样的极小 P 值在解析时变为 0
+            context['dtype'] = {'P': str}
+
+        # 最后一个阶段可以自行写出结果 (例如 munge 写出 .sumstats.gz)，否则写出标准格式
+        write_output = getattr(stages[-1], 'write_output', None)
+        compress = output.get('compress', 'none')
+        out_format = output.get('out_format', 'tsv')
+        if write_output is not None:
+            base = f"{context['name']}{output.get('suffix', '')}{stages[-1].output_suffix}"
+        else:
+            base = output_path(f"{context['name']}{output.get('suffix', '')}.txt", compress, out_format)
+        output_filename = os.path.join(output.get('dir', '.'), base)
+        record['output'] = output_filename
+        if manifest is not None and not overwrite:
+            state = manifest.status(output_filename, signature)
+            if state in ('current', 'untracked'):
+                # 没有清单记录的已有结果 (升级前生成) 沿用，由主进程记录当前签名
+                record['adopt'] = state == 'untracked'
+                return f"跳过: {filename} 已是最新 {output_filename}", record
+        elif os.path.exists(output_filename) and not overwrite:
+            return f"跳过: {filename} 已有结果 {output_filename}", record
+        os.makedirs(os.path.dirname(output_filename) or '.', exist_ok=True)
+
+        # 只读取一次输入；每个阶段都是串在前一个阶段之后的生成器
+        read_stats = {'in': 0, 'out': 0}
+        chunks = _counted(
+            iter_sumstats_chunks(input_path, chunk_size, sep=sep or '\t', columns=context['usecols'],
+                                 dtype=context['dtype']),
+            lambda chunk: chunk, read_stats
+        )
+        for name, transform in transforms:
+            stats = {'stage': name, 'in': 0, 'out': 0}
+            record['stages'].append(stats)
+            chunks = _counted(chunks, transform, stats)
+
+        tmp_path = output_filename + '.tmp'
+        if write_output is not None:
+            written = write_output(chunks, tmp_path)
+        else:
+            written = _write_standard(chunks, tmp_path, output)
+        record['read'] = read_stats['in']
+
+        if written == 0:
+            for path in (tmp_path, tmp_path + '.tbi'):
+                if os.path.exists(path):
+                    os.remove(path)
+            return f"警告: 经过滤后，文件 {filename} 无剩余数据，已跳过。", record
+        os.replace(tmp_path, output_filename)
+        if os.path.exists(tmp_path + '.tbi'):
+            os.replace(tmp_path + '.tbi', output_filename + '.tbi')
+        steps = ', '.join(f"{s['stage']} {s['in']}->{s['out']}" for s in record['stages'])
+        return f"成功处理: {filename} -> {output_filename} (读取 {record['read']} 行; {steps})", record
+    except Exception as e:
+        if tmp_path is not None:
+            for path in (tmp_path, tmp_path + '.tbi'):
+                if os.path.exists(path):
+                    os.remove(path)
+        return f"错误: 处理文件 {input_path} 时失败: {e}", record
+
+
+def _init_worker(stages, output, chunk_size, overwrite, manifest):
+    """进程池初始化函数：各阶段对象 (含参考/chain 索引的路径) 和构建清单只传递一次。"""
+    _WORKER_STATE.update(stages=stages, output=output, chunk_size=chunk_size, overwrite=overwrite, manifest=manifest)
+
+
+def _process_in_worker(input_path, signature):
+    """工作进程入口：使用共享状态处理单个文件。"""
+    return run_file(input_path, signature=signature, **_WORKER_STATE)
+
+
+def collect_inputs(patterns):
+    """展开输入 (文件、通配符或目录) 为文件列表。"""
+    files = []
+    for item in patterns:
+        if os.path.isdir(item):
+            matched = sorted(glob.glob(os.path.join(item, '*.txt')) + glob.glob(os.path.join(item, '*.txt.gz'))
+                             + glob.glob(os.path.join(item, '*.gz')) + glob.glob(os.path.join(item, '*.parquet')))
+        else:
+            matched = sorted(glob.glob(item)) or [item]
+        files.extend(f for f in matched if f not in files and not f.endswith('.tbi'))
+    return files
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="按配置文件串联 格式化/质控/坐标转换 等阶段，只读写一次文件。")
+    parser.add_argument('inputs', nargs='*', help="输入文件、通配符或文件夹。默认使用配置中的 inputs。")
+    parser.add_argument('--config', required=True, help="流水线配置文件 (JSON)，例如 pipeline_finngen.json。")
+    parser.add_argument('--workers', type=int, default=1, help="并行处理文件的进程数。默认为 1。")
+    parser.add_argument('--chunk-size', type=int, help=f"每块读取的行数。默认使用配置中的 chunk_size 或 {DEFAULT_CHUNK_SIZE}。")
+    parser.add_argument('--compress', choices=OUTPUT_COMPRESSIONS, help="覆盖配置中的输出压缩方式。")
+    parser.add_argument('--out-format', choices=OUTPUT_FORMATS, help="覆盖配置中的输出格式。")
+    parser.add_argument('--overwrite', action='store_true', help="忽略构建清单，重新处理所有输入 (默认只处理新增或有变化的输入)。")
+    parser.add_argument('--manifest', help=f"构建清单路径。默认为输出目录下的 {DEFAULT_MANIFEST_NAME}。")
+    parser.add_argument('--report', help="把每个文件各阶段的行数写入该 JSON 文件。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        print(f"[!] 错误: 无法读取配置文件 '{args.config}': {e}", file=sys.stderr)
+        sys.exit(1)
+
+    output = dict(config.get('output') or {})
+    if args.compress:
+        output['compress'] = args.compress
+    if args.out_format:
+        output['out_format'] = args.out_format
+    chunk_size = args.chunk_size or config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+
+    files = collect_inputs(args.inputs or config.get('inputs') or [])
+    if not files:
+        print("⚠️ 警告: 没有找到任何输入文件。")
+        return
+    print(f"--- 流水线: {' -> '.join(s['stage'] for s in config['stages'])} ---")
+    print("正在加载各阶段的参考数据...")
+    try:
+        stages = build_stages(config)
+    except Exception as e:
+        print(f"❌ 严重错误: 无法初始化流水线。错误信息: {e}")
+        sys.exit(1)
+    print(f"共找到 {len(files)} 个文件待处理。")
+
+    # 构建清单记录每个输出的输入/参考文件哈希、元数据中的 N 和流水线配置，只重建发生变化的输出
+    manifest = BuildManifest(args.manifest or os.path.join(output.get('dir', '.'), DEFAULT_MANIFEST_NAME))
+    manifest.prefetch(files, threads=max(4, args.workers))
+    signatures = {f: build_signature(manifest, f, config, stages, output) for f in files}
+    manifest.save()
+
+    outcomes = []
+
+    def record_outcome(input_path, outcome):
+        outcomes.append(outcome)
+        status, record = outcome
+        if status.startswith('成功') or record.get('adopt'):
+            manifest.record(record['output'], *signatures[input_path])
+            manifest.save()
+
+    workers = max(1, min(args.workers, len(files)))
+    if workers == 1:
+        for input_path in tqdm(files, desc="总体进度", unit="个文件"):
+            record_outcome(input_path, run_file(input_path, stages, output, chunk_size, args.overwrite, manifest,
+                                                signatures[input_path][0]))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(stages, output, chunk_size, args.overwrite, manifest)
+        ) as executor:
+            futures = {executor.submit(_process_in_worker, f, signatures[f][0]): f for f in files}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="总体进度", unit="个文件"):
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = (f"错误: 处理文件 {futures[future]} 时失败: {e}", {'input': futures[future]})
+                record_outcome(futures[future], outcome)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump([record for _, record in outcomes], f, ensure_ascii=False, indent=2)
+
+    results = [status for status, _ in outcomes]
+    print("\n--- 所有任务处理完毕 ---")
+    print(f"✅ 成功: {sum(1 for r in results if r.startswith('成功'))} 个文件")
+    for r in results:
+        if r.startswith('成功'):
+            print(f"   - {r}")
+    skipped = [r for r in results if r.startswith('跳过')]
+    if skipped:
+        print(f"⏭️ 已是最新 (跳过): {len(skipped)} 个文件")
+    for label, prefix in (("⚠️ 警告 (跳过)", "警告"), ("❌ 错误 (处理失败)", "错误")):
+        selected = [r for r in results if r.startswith(prefix)]
+        if selected:
+            print(f"{label}: {len(selected)} 个文件")
+            for r in selected:
+                print(f"   - {r}")
+    if any(r.startswith('错误') for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+标准格式摘要统计数据 (CHR, BP, SNP, A1, A2, P, BETA, SE, FRQ, N) 的输入与输出。
+
+SumstatsWriter 把每个处理好的片段编码为要写入输出文件的字节：
+    tsv + none     制表符分隔的纯文本 (与之前的 to_csv 输出完全一致)
+    tsv + bgzf     BGZF 压缩文本 (线程池并行压缩)，并同时生成 tabix 索引 (.tbi)
+    parquet        列式存储，列带类型 (CHR/等位基因为字典编码，BP 为 int32，统计量为 float32/float64)，
+                   每个行组 (row group) 只包含一个染色体，下游可按 CHR 跳过行组、只读需要的列
+编码与实际写文件分开，方便与 checkpoint.py 的检查点配合 (检查点负责写入与校验)。
+
+iter_sumstats_chunks() / ParquetChunkReader 负责读取，文本与 Parquet 输入使用同一套接口。
+Parquet 读写需要可选依赖 pyarrow (pip install pyarrow)。
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from bgzf import BGZF_EOF, BgzfCompressor, TabixIndexer, index_bgzf_file, line_bounds, virtual_offsets
+from sumstats_schema import collapse_lp, expand_snp
+
+OUTPUT_COMPRESSIONS = ('none', 'bgzf')
+OUTPUT_FORMATS = ('tsv', 'parquet')
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+
+STANDARD_COLUMNS = ['CHR', 'BP', 'SNP', 'A1', 'A2', 'P', 'BETA', 'SE', 'FRQ', 'N']
+
+
+def _require_pyarrow():
+    """按需导入 pyarrow；未安装时给出明确的安装提示。"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet 读写需要 pyarrow，请先安装: pip install pyarrow") from e
+    return pa, pq
+
+
+def is_parquet(path):
+    """根据扩展名或文件头魔数判断是否为 Parquet 文件。"""
+    if str(path).lower().endswith(PARQUET_SUFFIXES):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            return f.read(4) == b'PAR1'
+    except OSError:
+        return False
+
+
+def output_path(base, compress='none', out_format='tsv'):
+    """根据输出格式返回文件名，例如 COPD.txt -> COPD.txt.gz 或 COPD.parquet。"""
+    if out_format == 'parquet':
+        return os.path.splitext(base)[0] + '.parquet' if base.endswith('.txt') else base
+    return base + '.gz' if compress == 'bgzf' and not base.endswith('.gz') else base
+
+
+def _parquet_field(pa, name, dtype):
+    """标准列使用固定的紧凑类型；其它列按 pandas 类型推断为 float64 或字符串。"""
+    dict_string = pa.dictionary(pa.int32(), pa.string())
+    fixed = {
+        'CHR': dict_string, 'A1': dict_string, 'A2': dict_string,
+        'BP': pa.int32(), 'SNP': pa.string(), 'P': pa.float64(),
+        'BETA': pa.float32(), 'SE': pa.float32(), 'FRQ': pa.float32(), 'N': pa.float64()
+    }
+    if name in fixed:
+        return pa.field(name, fixed[name])
+    if pd.api.types.is_numeric_dtype(dtype):
+        return pa.field(name, pa.float64())
+    return pa.field(name, pa.string())
+
+
+def _to_arrow(pa, df, schema):
+    """按 schema 把片段转换为 Arrow 表；无法解析的数值变为空值。"""
+    arrays = []
+    for field in schema:
+        col = df[field.name]
+        if pa.types.is_dictionary(field.type):
+            arr = pa.array(col.astype('string'), type=pa.string(), from_pandas=True).dictionary_encode()
+            arr = arr.cast(field.type)
+        elif pa.types.is_integer(field.type):
+            arr = pa.array(pd.to_numeric(col, errors='coerce').astype('Int64'), from_pandas=True).cast(field.type)
+        elif pa.types.is_floating(field.type):
+            arr = pa.array(pd.to_numeric(col, errors='coerce').to_numpy(dtype=np.float64), from_pandas=True)
+            arr = arr.cast(field.type)
+        else:
+            arr = pa.array(col.astype('string'), type=pa.string(), from_pandas=True)
+        arrays.append(arr)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class _ByteSink:
+    """供 pyarrow 写入的最小文件对象：收集写出的字节，由 SumstatsWriter 取走后再写入真正的文件。"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class SumstatsWriter:
+    """
+    标准格式片段的编码器。resumed=True 表示输出文件是续传得到的，
+    此时 tabix 索引在 close() 时通过扫描完整文件重新生成。
+    Parquet 文件的元数据写在文件末尾，中断后无法续写，因此 resumable 为 False。
+    """
+
+    def __init__(self, path, compress='none', threads=1, resumed=False, out_format='tsv'):
+        if compress not in OUTPUT_COMPRESSIONS:
+            raise ValueError(f"不支持的压缩方式: {compress}")
+        if out_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {out_format}")
+        self.path = path
+        self.out_format = out_format
+        self.compress = compress if out_format == 'tsv' else 'none'
+        self.resumed = resumed
+        self.compressor = BgzfCompressor(threads) if self.compress == 'bgzf' else None
+        self.indexer = None
+        self._parquet = None
+        self._schema = None
+        self._sink = None
+
+    @property
+    def resumable(self):
+        return self.out_format == 'tsv'
+
+    def encode(self, df, header, offset):
+        """把片段编码为输出字节。offset 是这些字节将被写入的文件位置 (用于计算索引偏移)。"""
+        # 紧凑格式的片段 (见 sumstats_schema.py) 先还原 SNP 字符串列
+        df = expand_snp(df)
+        if self.out_format == 'parquet':
+            return self._encode_parquet(df)
+
+        # 下溢的 P 值 (LP 列有值的行) 按 LP 写为 1e-400 形式的文本
+        df = collapse_lp(df)
+        text = df.to_csv(sep='\t', index=False, na_rep='NA', header=header).encode('utf-8')
+        if self.compressor is None:
+            return text
+
+        data, block_sizes = self.compressor.compress(text)
+        if not self.resumed and 'CHR' in df.columns and 'BP' in df.columns:
+            if self.indexer is None:
+                self.indexer = TabixIndexer(col_seq=df.columns.get_loc('CHR') + 1,
+                                            col_beg=df.columns.get_loc('BP') + 1)
+            starts, ends = line_bounds(text, skip_lines=1 if header else 0)
+            self.indexer.add(df['CHR'].to_numpy(), df['BP'].to_numpy(),
+                             virtual_offsets(offset, block_sizes, starts),
+                             virtual_offsets(offset, block_sizes, ends))
+        return data
+
+    def _encode_parquet(self, df):
+        """按染色体切分片段，每个染色体写成一个独立的行组。"""
+        pa, pq = _require_pyarrow()
+        if self._parquet is None:
+            self._schema = pa.schema([_parquet_field(pa, name, df[name].dtype) for name in df.columns])
+            self._sink = _ByteSink()
+            self._parquet = pq.ParquetWriter(self._sink, self._schema, compression='zstd')
+        schema = self._schema
+
+        if 'CHR' in df.columns and len(df):
+            chrom = df['CHR'].astype('string').fillna('NA')
+            for _, group in df.groupby(chrom.to_numpy(), sort=False):
+                self._parquet.write_table(_to_arrow(pa, group, schema), row_group_size=len(group))
+        elif len(df):
+            self._parquet.write_table(_to_arrow(pa, df, schema), row_group_size=len(df))
+        return self._sink.drain()
+
+    def finish(self, out_file):
+        """所有片段写完后调用：BGZF 输出追加结束块，Parquet 输出写入文件尾部的元数据。"""
+        if self.compressor is not None:
+            out_file.write(BGZF_EOF)
+        if self._parquet is not None:
+            self._parquet.close()
+            out_file.write(self._sink.drain())
+
+    def close(self):
+        """释放线程池；BGZF 输出写出 tabix 索引。返回是否生成了索引。"""
+        if self.compressor is None:
+            return False
+        self.compressor.close()
+        tbi_path = self.path + '.tbi'
+        if os.path.exists(tbi_path):
+            os.remove(tbi_path)
+        if self.resumed:
+            return index_bgzf_file(self.path)
+        return self.indexer is not None and self.indexer.write(tbi_path)
+
+
+def _restore_pandas_types(df):
+    """
+    Parquet 中含空值的整数列 (BP) 会被读成浮点数，N 以 float64 存储；
+    若非空值全部为整数则还原为 (可空) 整数，保证写回文本时与原格式一致。
+    """
+    for col in ('BP', 'N'):
+        if col in df.columns and pd.api.types.is_float_dtype(df[col]):
+            values = df[col]
+            if (values.dropna() % 1 == 0).all():
+                df[col] = values.astype(np.int64) if values.notna().all() else values.astype('Int64')
+    return df
+
+
+class ParquetChunkReader:
+    """
+    分块读取 Parquet 文件，接口与 pd.read_csv(iterator=True) 相同 (get_chunk / 迭代)。
+    columns 只读取指定的列；chromosomes 给定时利用行组统计信息跳过其它染色体的行组。
+    """
+
+    def __init__(self, path, columns=None, chromosomes=None, chunk_size=500000):
+        _, pq = _require_pyarrow()
+        self.file = pq.ParquetFile(path)
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.columns_available = self.file.schema_arrow.names
+        row_groups = range(self.file.num_row_groups)
+        if chromosomes is not None:
+            row_groups = [i for i in row_groups if self._row_group_may_contain(i, {str(c) for c in chromosomes})]
+        self.row_groups = list(row_groups)
+        self.chromosomes = None if chromosomes is None else {str(c) for c in chromosomes}
+        self._batches = None
+        self._pending = None
+
+    def _row_group_may_contain(self, i, chromosomes):
+        if 'CHR' not in self.columns_available:
+            return True
+        meta = self.file.metadata.row_group(i).column(self.columns_available.index('CHR'))
+        stats = meta.statistics
+        if stats is None or not stats.has_min_max or stats.min != stats.max:
+            return True
+        value = stats.min.decode() if isinstance(stats.min, bytes) else str(stats.min)
+        return value in chromosomes
+
+    def _iter_frames(self):
+        if not self.row_groups:
+            return
+        columns = self.columns
+        filter_chr = self.chromosomes is not None and 'CHR' in self.columns_available
+        # 按染色体过滤时即使未请求 CHR 列也需要读取它，过滤后再去掉
+        if filter_chr and columns is not None and 'CHR' not in columns:
+            columns = list(columns) + ['CHR']
+        for batch in self.file.iter_batches(batch_size=self.chunk_size, row_groups=self.row_groups,
+                                            columns=columns):
+            df = _restore_pandas_types(batch.to_pandas())
+            if filter_chr:
+                df = df[df['CHR'].astype(str).isin(self.chromosomes)]
+                if columns is not self.columns:
+                    df = df.drop(columns='CHR')
+            yield df
+
+    def get_chunk(self, size=None):
+        """返回下一个最多 size 行的数据块；读完时抛出 StopIteration。"""
+        size = size or self.chunk_size
+        if self._batches is None:
+            self._batches = self._iter_frames()
+        parts = []
+        rows = 0
+        if self._pending is not None:
+            parts.append(self._pending)
+            rows += len(self._pending)
+            self._pending = None
+        while rows < size:
+            try:
+                df = next(self._batches)
+            except StopIteration:
+                break
+            parts.append(df)
+            rows += len(df)
+        if not parts:
+            raise StopIteration
+        chunk = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+        if len(chunk) > size:
+            self._pending = chunk.iloc[size:].reset_index(drop=True)
+            chunk = chunk.iloc[:size]
+        return chunk
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get_chunk()
+            except StopIteration:
+                return
+
+
+def iter_sumstats_chunks(path, chunk_size=500000, sep='\t', columns=None, dtype=None, chromosomes=None):
+    """
+    逐块读取摘要统计文件：Parquet 文件按列/染色体裁剪读取，其它文件按分隔文本读取
+    (.gz 等压缩由 pandas 自动识别)。
+    """
+    if is_parquet(path):
+        yield from ParquetChunkReader(path, columns=columns, chromosomes=chromosomes, chunk_size=chunk_size)
+        return
+    engine = 'c' if sep != r'\s+' else 'python'
+    with pd.read_csv(path, sep=sep, engine=engine, usecols=columns, dtype=dtype, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            if chromosomes is not None and 'CHR' in chunk.columns:
+                chunk = chunk[chunk['CHR'].astype(str).isin({str(c) for c in chromosomes})]
+            yield chunk
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# 向量化的等位基因质控函数，供 finn_clean_plus.py 等入口脚本复用。
+#
+# 思路: 不再对每一行构造 Python set，而是把 A1/A2 (不区分大小写) 编码成整数，
+# 再把一对等位基因编码成与顺序无关的规范键 (canonical key)，之后只需比较整数数组。
+#   单碱基: A=1, C=2, G=3, T=4，规范键 = min*5 + max (取值 6..24)
+#   其它 (indel、多碱基、缺失值): 规范键 = -1，比较时走少量行的字符串回退路径
+
+import numpy as np
+import pandas as pd
+
+# 大小写均映射到同一碱基，Categorical 编码比 str.upper() 后再比较快得多
+_ALLELE_CATEGORIES = ['A', 'C', 'G', 'T', 'a', 'c', 'g', 't']
+# 链模糊的等位基因对: A/T 与 C/G
+AMBIGUOUS_PAIR_KEYS = (1 * 5 + 4, 2 * 5 + 3)
+
+
+def allele_codes(alleles):
+    """将等位基因列编码为 int8 数组：A/C/G/T (不区分大小写) 为 1..4，其余为 0。"""
+    if isinstance(getattr(alleles, 'dtype', None), pd.CategoricalDtype):
+        # 紧凑片段 (见 sumstats_schema.py) 中的等位基因已是 category：只编码类别，再按类别码取值
+        codes = np.asarray(alleles.cat.codes if hasattr(alleles, 'cat') else alleles.codes)
+        category_codes = np.append(allele_codes(np.asarray(alleles.dtype.categories, dtype=object)), np.int8(0))
+        return category_codes[codes]
+    codes = pd.Categorical(np.asarray(alleles, dtype=object), categories=_ALLELE_CATEGORIES).codes
+    return np.where(codes >= 0, codes % 4 + 1, 0).astype(np.int8)
+
+
+def allele_pair_keys(a1, a2):
+    """返回与顺序无关的等位基因对规范键 (int8)：单碱基对为 6..24，其它为 -1。"""
+    c1 = allele_codes(a1)
+    c2 = allele_codes(a2)
+    lo = np.minimum(c1, c2)
+    hi = np.maximum(c1, c2)
+    return np.where(lo > 0, lo * 5 + hi, -1).astype(np.int8)
+
+
+def strand_ambiguous_mask(a1, a2):
+    """返回布尔数组：True 表示该行为链模糊SNP (A/T 或 C/G)。"""
+    return np.isin(allele_pair_keys(a1, a2), AMBIGUOUS_PAIR_KEYS)
+
+
+def _string_pair_equal(a1, a2, b1, b2):
+    """字符串回退路径：仅用于 indel 等非单碱基行，按无序集合比较 (大小写不敏感)。"""
+    out = np.zeros(len(a1), dtype=bool)
+    for i, (x1, x2, y1, y2) in enumerate(zip(a1, a2, b1, b2)):
+        if pd.isna(x1) or pd.isna(x2) or pd.isna(y1) or pd.isna(y2):
+            continue
+        out[i] = {str(x1).upper(), str(x2).upper()} == {str(y1).upper(), str(y2).upper()}
+    return out
+
+
+def allele_match_mask(a1, a2, ref_a1, ref_a2):
+    """返回布尔数组：True 表示 {A1, A2} 与参考的 {A1, A2} 一致 (忽略顺序与大小写)。"""
+    keys = allele_pair_keys(a1, a2)
+    ref_keys = allele_pair_keys(ref_a1, ref_a2)
+    mask = (keys == ref_keys) & (keys >= 0)
+
+    # 只有两侧都是单碱基时整数键才可比较；其余行 (通常极少) 用字符串逐行确认
+    fallback = (keys < 0) | (ref_keys < 0)
+    if fallback.any():
+        idx = np.flatnonzero(fallback)
+        mask[idx] = _string_pair_equal(
+            np.asarray(a1, dtype=object)[idx], np.asarray(a2, dtype=object)[idx],
+            np.asarray(ref_a1, dtype=object)[idx], np.asarray(ref_a2, dtype=object)[idx]
+        )
+    return mask
+
+
+def match_reference_alleles(gwas_chunk, merge_alleles_df):
+    """
+    按 SNP 与参考表 (SNP, A1, A2) 内连接，只保留等位基因与参考一致的行。
+    返回的数据框列与输入一致 (参考列已删除)。
+    """
+    merged_chunk = pd.merge(gwas_chunk, merge_alleles_df, on='SNP', how='inner', suffixes=('', '_ref'))
+    if merged_chunk.empty:
+        return gwas_chunk.iloc[0:0]
+    mask = allele_match_mask(merged_chunk['A1'], merged_chunk['A2'], merged_chunk['A1_ref'], merged_chunk['A2_ref'])
+    return merged_chunk[mask].drop(columns=['A1_ref', 'A2_ref'])
+
+
+def drop_strand_ambiguous(gwas_chunk):
+    """删除链模糊SNP (A/T、C/G)。"""
+    if gwas_chunk.empty:
+        return gwas_chunk
+    return gwas_chunk[~strand_ambiguous_mask(gwas_chunk['A1'], gwas_chunk['A2'])]
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+标准格式片段 (CHR, BP, SNP, A1, A2, P, BETA, SE, FRQ, N) 的紧凑内存类型，在解析每个片段时立即应用:
+    CHR          category
+    BP           uint32 (含空值时为可空 UInt32)
+    A1 / A2      category
+    P            float64 (无法解析的值变为空值)
+    LP           float64，-log10 P；只在 P 低于 float64 的最小正规数 (例如 1e-400 解析为 0) 的行有值，其余为空值
+    BETA/SE/FRQ  float64 (正确舍入，写出的文本与输入的数值一致；float32 会截断超过 7 位有效数字的输入)
+    N            uint32 (含空值或非整数时保持 float64)
+    SNP          'rs123' 形式的 ID 存为整数列 SNP_RSID (uint32，0 表示该行不是 rsID)；
+                 其它 ID (多个 rsID、chr:pos 形式、缺失值等) 保留在字符串列 SNP_OTHER 中 (rsID 行为空值)。
+500k 行的 FinnGen 片段 (9 列) 在 pandas 2 的 object 字符串列下约 170 MB，紧凑类型约 25 MB
+(pandas 3 的 Arrow 字符串列约 45 MB)，多进程并行时按进程数成倍节省。
+写出前由 expand_snp() 还原为 SNP 字符串列 (SumstatsWriter 会自动调用)；hm3_index.match_reference_index
+直接使用 SNP_RSID 查找，不再解析字符串。
+
+数值列由 parse_floats() 解析：先转为定长字节数组，按字符检查后交给 numpy 一次性转换 (与 float() 相同，
+正确舍入)，比 pd.to_numeric 逐个处理字符串对象快。parse_pvalues() 另外对下溢的 P 值按原始文本计算 LP，
+P 值过滤 (valid_pvalue_mask) 与 ldsc 的 Z 值据此保留最显著的位点；写出文本时 P 列由 LP 还原 (collapse_lp)。
+
+--max-mem 给出内存预算时，chunk_size_for_budget() 按文件开头的样本估算每行的峰值内存
+(原始文本 + 解析后的字符串列)，换算为每个片段的行数，代替固定的 500000 行。
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+import pandas as pd
+
+RSID_COLUMN = 'SNP_RSID'
+SNP_OTHER_COLUMN = 'SNP_OTHER'
+LP_COLUMN = 'LP'
+FLOAT_COLUMNS = ('BETA', 'SE', 'FRQ')
+CATEGORY_COLUMNS = ('CHR', 'A1', 'A2')
+_UINT32_MAX = np.iinfo(np.uint32).max
+# 比它小的 P 值 (包括下溢为 0 的值) 无法用 float64 精确表示，需要另存 LP
+MIN_NORMAL = np.finfo(np.float64).tiny
+# 数值文本中允许出现的字节 (定长字节数组以 NUL 补齐)；其它字符 (NA、nan、文字) 直接视为无法解析
+_NUMBER_BYTES = np.zeros(256, dtype=bool)
+_NUMBER_BYTES[list(b'0123456789.eE+- \x00')] = True
+_NUMBER_PATTERN = r'^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?$'
+
+MIN_CHUNK_ROWS = 10000
+MAX_CHUNK_ROWS = 5000000
+SAMPLE_ROWS = 20000
+# 片段的峰值内存约为解析后字符串列的若干倍 (pandas 解析缓冲区、过滤与重命名时的副本)
+PEAK_FACTOR = 3.0
+
+
+def parse_memory(text):
+    """把 '4G'、'4GiB'、'512M'、'800B' (字节)、'800' (默认单位 MB) 等写法转换为字节数。"""
+    match = re.fullmatch(r'\s*([0-9.]+)\s*(?:([KMGT])i?B?|(B))?\s*', str(text), flags=re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无法识别的内存大小: {text} (例如 4G、512M)")
+    # 单独的 B 表示字节 (' KMGT' 中的下标 0)；没有单位时默认为 MB
+    unit = ' ' if match.group(3) else (match.group(2) or 'M').upper()
+    return int(float(match.group(1)) * 1024 ** ' KMGT'.index(unit))
+
+
+def split_rsids(snp):
+    """
+    把 SNP 列拆分为 (rsID 整数数组 uint32, 其它 ID 的数组，rsID 行为空值)。
+    只有能原样还原的 'rs' + 十进制数字 (无前导零、不超过 uint32) 才存为整数。
+    保持输入列的字符串类型 (pandas 的 Arrow 字符串列上正则匹配与切片都是向量化的)。
+    """
+    s = snp if isinstance(snp, pd.Series) else pd.Series(np.asarray(snp, dtype=object), dtype=object)
+    is_rs = np.array(s.str.fullmatch(r'rs[1-9][0-9]{0,9}', na=False), dtype=bool)
+    rsid = np.zeros(len(s), dtype=np.uint32)
+    if is_rs.any():
+        numbers = s[is_rs].str.slice(2).astype(np.int64).to_numpy()
+        fits = numbers <= _UINT32_MAX
+        idx = np.flatnonzero(is_rs)
+        rsid[idx[fits]] = numbers[fits]
+        is_rs[idx[~fits]] = False
+    return rsid, s.where(~is_rs).array
+
+
+def expand_snp(df):
+    """把 SNP_RSID / SNP_OTHER 还原为原位置上的 SNP 字符串列；不是紧凑格式的片段原样返回。"""
+    if RSID_COLUMN not in df.columns:
+        return df
+    rsid = df[RSID_COLUMN].to_numpy()
+    snp = df[SNP_OTHER_COLUMN].to_numpy(dtype=object, copy=True)
+    has_rs = rsid > 0
+    if has_rs.any():
+        snp[has_rs] = np.char.add('rs', rsid[has_rs].astype(str)).astype(object)
+    position = df.columns.get_loc(RSID_COLUMN)
+    df = df.drop(columns=[RSID_COLUMN, SNP_OTHER_COLUMN])
+    df.insert(position, 'SNP', snp)
+    return df
+
+
+def _float_or_nan(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _parse_arrow_floats(array):
+    """Arrow 字符串列 (pandas 3 的默认字符串类型) 直接在 Arrow 缓冲区上匹配并转换，不生成 Python 字符串对象。"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    text = pc.utf8_trim_whitespace(pa.array(array))
+    numeric = pc.if_else(pc.match_substring_regex(text, _NUMBER_PATTERN), text, pa.scalar(None, text.type))
+    return pc.cast(numeric, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def parse_floats(values):
+    """
+    把字符串列向量化解析为 float64 数组，无法解析的值 (NA、空字符串、文字等) 为 NaN；数值列直接转换。
+    结果与逐个调用 float() 相同 (正确舍入)。float32 列 (例如 Parquet 输入中的 BETA/SE/FRQ) 按其最短的十进制表示
+    转换，0.0001 仍为 0.0001，而不是 0.00009999999747378752。
+    """
+    dtype = getattr(values, 'dtype', None)
+    if dtype == np.float32:
+        return np.asarray(values, dtype=np.float32).astype(str).astype(np.float64)
+    if dtype is not None and pd.api.types.is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+        return pd.Series(values).to_numpy(dtype=np.float64, na_value=np.nan)
+    if isinstance(values, pd.Series) and hasattr(values.array, '__arrow_array__') \
+            and pd.api.types.is_string_dtype(dtype):
+        return _parse_arrow_floats(values.array)
+    objects = values.to_numpy(dtype=object) if isinstance(values, pd.Series) else np.asarray(values, dtype=object)
+    try:
+        text = objects.astype('S')
+    except UnicodeEncodeError:
+        return pd.to_numeric(pd.Series(objects), errors='coerce').to_numpy(dtype=np.float64)
+    out = np.full(len(text), np.nan)
+    if len(text) == 0 or text.itemsize == 0:
+        return out
+    chars = text.view(np.uint8).reshape(len(text), text.itemsize)
+    candidate = _NUMBER_BYTES[chars].all(axis=1) & (chars[:, 0] != 0)
+    try:
+        out[candidate] = text[candidate].astype(np.float64)
+    except ValueError:
+        # 只由合法字符组成却不是数值 (例如 '1e'、'-')：逐个解析
+        out[candidate] = [_float_or_nan(t) for t in text[candidate]]
+    return out
+
+
+def parse_pvalues(values):
+    """
+    解析 P 值列，返回 (P, LP) 两个 float64 数组。LP = -log10 P 只在 P 低于 MIN_NORMAL 的行有值
+    (按原始文本用 Decimal 计算，1e-400 得到 400.0)，其余为 NaN。数值列无法恢复下溢前的值，LP 全为 NaN。
+    """
+    p = parse_floats(values)
+    lp = np.full(len(p), np.nan)
+    tiny = np.flatnonzero((p >= 0) & (p < MIN_NORMAL))
+    if len(tiny) and not pd.api.types.is_numeric_dtype(getattr(values, 'dtype', None)):
+        texts = pd.Series(values).iloc[tiny].to_numpy(dtype=object)
+        for i, text in zip(tiny, texts):
+            try:
+                value = Decimal(str(text).strip())
+            except InvalidOperation:
+                continue
+            if value > 0:
+                lp[i] = float(-value.log10())
+    return p, lp
+
+
+def pvalues_from_lp(lp_values):
+    """由 -log10 P 列 (例如 GWAS-VCF 的 LP) 计算 (P, LP)：P = 10^-LP，LP 只保留 P 下溢的行。"""
+    lp = parse_floats(lp_values)
+    p = np.power(10.0, -lp)
+    return p, np.where(p < MIN_NORMAL, lp, np.nan)
+
+
+def pvalue_arrays(df):
+    """返回片段的 (P, LP) 数组：P 为文本时解析，已有 LP 列时合并其中的值。"""
+    p, lp = parse_pvalues(df['P'])
+    if LP_COLUMN in df.columns:
+        known = parse_floats(df[LP_COLUMN])
+        lp = np.where(np.isnan(lp), known, lp)
+    return p, lp
+
+
+def valid_pvalue_mask(p, lp=None):
+    """P 在 (0, 1] 内为 True；P 下溢为 0 但 LP 有值 (极显著) 的行也视为有效。"""
+    mask = (p > 0) & (p <= 1)
+    if lp is not None:
+        mask |= lp > 0
+    return mask
+
+
+def format_lp(lp):
+    """把 LP 还原为科学计数法的 P 值文本，例如 400 -> '1e-400'，399.6275... -> '2.358e-400'。"""
+    exponent = np.floor(-lp)
+    mantissa = np.round(np.power(10.0, -lp - exponent), 9)
+    carry = mantissa >= 10
+    mantissa[carry] /= 10
+    exponent[carry] += 1
+    return [f"{m:.10g}e{int(e):03d}" for m, e in zip(mantissa, exponent)]
+
+
+def collapse_lp(df):
+    """写出文本前调用：LP 有值的行把 P 写为由 LP 还原的文本，并删除 LP 列；没有 LP 列时原样返回。"""
+    if LP_COLUMN not in df.columns:
+        return df
+    lp = df[LP_COLUMN].to_numpy(dtype=np.float64, na_value=np.nan)
+    df = df.drop(columns=LP_COLUMN)
+    tiny = np.flatnonzero(~np.isnan(lp))
+    if len(tiny):
+        p = df['P'].to_numpy(dtype=object, copy=True)
+        p[tiny] = format_lp(lp[tiny])
+        df = df.assign(P=p)
+    return df
+
+
+def _to_uint32(values):
+    """整数值列转换为 uint32 (含空值时为可空 UInt32)；含非整数或超出范围时保持 float64。"""
+    array = parse_floats(values)
+    valid = ~np.isnan(array)
+    if not (np.all(array[valid] % 1 == 0) and np.all((array[valid] >= 0) & (array[valid] <= _UINT32_MAX))):
+        return pd.Series(array, index=values.index)
+    if valid.all():
+        return pd.Series(array.astype(np.uint32), index=values.index)
+    return pd.Series(array, index=values.index).astype('UInt32')
+
+
+def compact_chunk(df):
+    """按紧凑类型转换片段中存在的标准列；无法解析的数值变为空值。返回新的数据框。"""
+    df = df.copy(deep=False)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    if 'BP' in df.columns:
+        df['BP'] = _to_uint32(df['BP'])
+    if 'N' in df.columns:
+        df['N'] = _to_uint32(df['N'])
+    if 'P' in df.columns:
+        p, lp = pvalue_arrays(df)
+        df['P'] = p
+        if LP_COLUMN in df.columns:
+            df[LP_COLUMN] = lp
+        else:
+            df.insert(df.columns.get_loc('P') + 1, LP_COLUMN, lp)
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_floats(df[col])
+    if 'SNP' in df.columns:
+        rsid, other = split_rsids(df['SNP'])
+        position = df.columns.get_loc('SNP')
+        df = df.drop(columns='SNP')
+        df.insert(position, SNP_OTHER_COLUMN, other)
+        df.insert(position, RSID_COLUMN, rsid)
+    return df
+
+
+def parse_dtypes(columns):
+    """
+    read_csv 的 dtype 参数：columns 为 {原始列名: 标准列名}。染色体与等位基因在解析时直接读为 category，
+    SNP 与 P 读为字符串 (由 compact_chunk 转换)，其余数值列交给 pandas 推断后再压缩。
+    """
+    dtype = {}
+    for raw, standard in columns.items():
+        if standard in CATEGORY_COLUMNS:
+            dtype[raw] = 'category'
+        elif standard in ('SNP', 'P'):
+            dtype[raw] = str
+    return dtype
+
+
+def estimate_row_bytes(path, sep='\t', nrows=SAMPLE_ROWS):
+    """读取文件开头 nrows 行 (全部作为字符串)，估算每行的峰值内存 (字节)。"""
+    # sumstats_io 在写出时导入本模块 (expand_snp)，这里延迟导入以避免循环导入
+    from sumstats_io import ParquetChunkReader, is_parquet
+    if is_parquet(path):
+        sample = ParquetChunkReader(path, chunk_size=nrows).get_chunk(nrows)
+        text_bytes = 0
+    else:
+        engine = 'c' if sep != r'\s+' else 'python'
+        sample = pd.read_csv(path, sep=sep, engine=engine, nrows=nrows, dtype=str)
+        text_bytes = int(sample.fillna('').apply(lambda col: col.str.len()).to_numpy().sum()) + sample.size
+    rows = max(1, len(sample))
+    parsed_bytes = int(sample.memory_usage(deep=True, index=False).sum())
+    return (text_bytes + parsed_bytes * PEAK_FACTOR) / rows
+
+
+def chunk_size_for_budget(max_mem, path, sep='\t', workers=1):
+    """按内存预算 (字节，所有工作进程合计) 计算 path 每个片段的行数，限制在 [MIN_CHUNK_ROWS, MAX_CHUNK_ROWS]。"""
+    rows = int(max_mem / max(1, workers) / estimate_row_bytes(path, sep=sep))
+    return max(MIN_CHUNK_ROWS, min(MAX_CHUNK_ROWS, rows))
+
+
+def select_columns(df, columns):
+    """
+    返回 df[columns 中实际存在的列]；紧凑片段中的 SNP 对应 SNP_RSID 与 SNP_OTHER 两列，
+    P 之后保留 LP 列 (写出文本时合并回 P)。
+    """
+    selected = []
+    for col in columns:
+        if col == 'SNP' and RSID_COLUMN in df.columns:
+            selected += [RSID_COLUMN, SNP_OTHER_COLUMN]
+        elif col in df.columns:
+            selected.append(col)
+            if col == 'P' and LP_COLUMN in df.columns and LP_COLUMN not in columns:
+                selected.append(LP_COLUMN)
+    return df[selected]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+ldsc_munge.py 的固定样例测试：Z 值换算、等位基因互换/互补链比对、N 过滤和按参考顺序输出，
+以及 pipeline.py 的 munge 阶段与 ldsc_munge.py 输出一致。
+
+运行:
+    python -m pytest -q tests
+"""
+
+import gzip
+import io
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ldsc_munge
+import pipeline
+from ldsc_munge import MungeStage, finalize_munge, lp_to_z, munge_chunk, munge_file, p_to_z
+
+# 参考列表故意不按 rsID 排序，输出必须保持这个顺序
+SNPLIST = """\
+SNP\tA1\tA2
+rs30\tA\tG
+rs10\tC\tT
+rs60\tC\tA
+rs20\tA\tC
+rs45\tA\tG
+rs40\tG\tT
+rs65\tA\tT
+rs50\tA\tG
+rs35\tA\tG
+"""
+
+# rs10 重复 (保留第一行)；rs20 A1/A2 互换；rs30 为互补链；rs40 的 P 下溢，由 -log10 P 计算 Z；
+# rs45 的 N 低于 N 的 90% 分位数 / 1.5；rs50 等位基因与参考不一致；rs35 MAF 过低；
+# rs65 链模糊；rs80 不在参考中；rs60 在输入中缺失
+SUMSTATS = """\
+CHR\tBP\tSNP\tA1\tA2\tP\tBETA\tSE\tFRQ\tN
+1\t100\trs10\tC\tT\t0.05\t0.1\t0.05\t0.3\t1000
+1\t150\trs10\tC\tT\t0.5\t0.3\t0.05\t0.3\t1000
+1\t200\trs20\tC\tA\t1e-8\t-0.2\t0.05\t0.4\t1000
+1\t300\trs30\tT\tC\t1\t0\t0.05\t0.5\t1000
+1\t400\trs40\tG\tT\t1e-400\t0.5\t0.05\t0.2\t1000
+1\t500\trs45\tA\tG\t0.2\t0.1\t0.05\t0.2\t100
+1\t600\trs50\tA\tC\t0.5\t0.05\t0.05\t0.2\t1000
+1\t700\trs35\tA\tG\t0.01\t0.1\t0.05\t0.005\t1000
+1\t800\trs65\tA\tT\t0.01\t0.1\t0.05\t0.3\t1000
+1\t900\trs80\tA\tG\t0.01\t0.1\t0.05\t0.3\t1000
+"""
+
+EXPECTED = """\
+SNP\tA1\tA2\tZ\tN
+rs30\tT\tC\t0.000\t1000.000
+rs10\tC\tT\t1.960\t1000.000
+rs60\t\t\t\t
+rs20\tC\tA\t-5.731\t1000.000
+rs45\t\t\t\t
+rs40\tG\tT\t42.826\t1000.000
+rs65\t\t\t\t
+rs50\t\t\t\t
+rs35\t\t\t\t
+"""
+
+
+@pytest.fixture
+def fixture_files(tmp_path):
+    (tmp_path / 'w_hm3.snplist').write_text(SNPLIST)
+    (tmp_path / 'trait.txt').write_text(SUMSTATS)
+    return tmp_path
+
+
+@pytest.fixture(params=['numpy', 'scipy'])
+def ndtri_backend(request, monkeypatch):
+    """分别用 numpy 实现和 scipy.special.ndtri (如已安装) 计算分位数。"""
+    if request.param == 'numpy':
+        monkeypatch.setattr(ldsc_munge, '_scipy_ndtri', None)
+    elif ldsc_munge._scipy_ndtri is None:
+        pytest.skip("未安装 scipy")
+    return request.param
+
+
+def test_p_to_z_golden_values(ndtri_backend):
+    p = [1, 0.5, 0.05, 1e-5, 5e-8, 1e-8, 1e-100]
+    expected = [0.0, 0.6744897501960817, 1.959963984540054, 4.417173413469022, 5.451310437845481,
+                5.730728868236289, 21.305940069351525]
+    z = p_to_z(p)
+    np.testing.assert_allclose(z, expected, rtol=1e-12, atol=0)
+    # P = 1 得到 0.0 而不是 -0.0 (否则输出为 '-0.000')
+    assert not np.signbit(z[0])
+
+
+def test_p_to_z_matches_normal_quantile(ndtri_backend):
+    p = np.logspace(-290, 0, 200)
+    expected = [-NormalDist().inv_cdf(x / 2) for x in p]
+    np.testing.assert_allclose(p_to_z(p), expected, rtol=1e-12)
+
+
+def test_lp_to_z_golden_values():
+    # 参考值由 Φ(-z) 的 Mills 比连分式二分求解 log(P/2) = log Φ(-z) 得到
+    np.testing.assert_allclose(lp_to_z([400, 1000]), [42.82640649117117, 67.79590817078778], rtol=1e-12)
+
+
+def test_lp_to_z_continuous_with_p_to_z():
+    # 在 P 仍可表示的范围内两种算法一致 (远小于输出的 3 位小数)
+    lp = np.array([30.0, 100.0, 250.0])
+    np.testing.assert_allclose(lp_to_z(lp), p_to_z(10.0 ** -lp), atol=1e-6)
+
+
+def test_munge_file_golden_output(fixture_files):
+    stage = MungeStage({'merge_alleles': str(fixture_files / 'w_hm3.snplist')})
+    status = munge_file(str(fixture_files / 'trait.txt'), str(fixture_files / 'trait'), stage, chunk_size=3)
+    assert status.startswith('成功'), status
+    assert '(4 个SNP)' in status
+    with gzip.open(fixture_files / 'trait.sumstats.gz', 'rt') as f:
+        assert f.read() == EXPECTED
+
+
+def test_pipeline_munge_stage_matches_ldsc_munge(fixture_files):
+    stage = MungeStage({'merge_alleles': str(fixture_files / 'w_hm3.snplist')})
+    status, record = pipeline.run_file(str(fixture_files / 'trait.txt'), [stage],
+                                       {'dir': str(fixture_files / 'pipe')}, chunk_size=4)
+    assert status.startswith('成功'), status
+    assert record['stages'] == [{'stage': 'munge', 'in': 10, 'out': 7}]
+    with gzip.open(fixture_files / 'pipe' / 'trait.sumstats.gz', 'rt') as f:
+        assert f.read() == EXPECTED
+
+
+def test_n_filter_without_reference():
+    chunk = pd.read_csv(io.StringIO(SUMSTATS), sep='\t', dtype={'P': str})
+    frames = [munge_chunk(chunk)]
+    dat = finalize_munge(frames)
+    # 没有参考列表时只按 MAF、P 和等位基因过滤；N 的 90% 分位数为 1000，阈值 1000 / 1.5：rs45 (N = 100) 被移除
+    assert 'rs45' not in set(dat['SNP'])
+    assert dat['SNP'].tolist() == ['rs10', 'rs20', 'rs30', 'rs40', 'rs50', 'rs80']
+    # 显式给出 n_min 时不再按分位数计算
+    assert 'rs45' in set(finalize_munge(frames, n_min=50)['SNP'])
+
+
+def test_median_beta_check():
+    chunk = pd.read_csv(io.StringIO(SUMSTATS), sep='\t', dtype={'P': str}).assign(BETA=1.0)
+    with pytest.raises(ValueError, match='中位数'):
+        finalize_munge([munge_chunk(chunk)])
+    assert len(finalize_munge([munge_chunk(chunk)], ignore_median=True)) == 6
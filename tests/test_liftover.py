@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+liftover.py 的 chain 换算测试：用一个手写的小 chain 文件核对比对块内/间隙中的坐标、负链换算、
+多重比对与非主要染色体的移除，以及 liftover_chunk 的空值/MHC 过滤。
+
+运行:
+    python -m pytest -q tests
+"""
+
+import gzip
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from liftover import ChainIndex, _parse_chain, compile_chain_index, liftover_chunk, load_or_compile
+
+# chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id，坐标均为 0-based 半开区间
+CHAIN = """\
+chain 1000 chr1 1000 + 100 190 chr1 2000 + 500 600 1
+50\t10\t20
+30
+
+chain 1000 chr2 1000 + 0 100 chr3 1000 - 100 200 2
+100
+
+chain 1000 chr4 1000 + 0 100 chr4 1000 + 0 100 3
+100
+
+chain 1000 chr4 1000 + 50 150 chr4 1000 + 500 600 4
+100
+
+chain 1000 chr5 1000 + 0 100 chr5_KI270791v1_alt 1000 + 0 100 5
+100
+
+chain 1000 chr7 1000 + 200 400 chr7 2000 + 1000 1200 6
+200
+
+chain 1000 chr7 1000 + 250 260 chr7 9000 + 5000 5010 7
+10
+"""
+
+# (源染色体, 源位置 (1-based), 期望的目标染色体, 期望的目标位置)；目标为 None 表示无法转换
+CASES = [
+    ('1', 101, '1', 501),      # 第一个比对块的起点
+    ('1', 150, '1', 550),      # 第一个比对块的终点
+    ('1', 151, None, None),    # 块间的间隙 (源 10 bp)
+    ('1', 161, '1', 571),      # 第二个比对块：目标偏移包含 20 bp 的间隙
+    ('1', 190, '1', 600),
+    ('1', 191, None, None),    # chain 之后
+    ('1', 100, None, None),    # chain 之前
+    ('chr2', 1, '3', 900),     # 负链：目标位置 = qSize - q
+    ('2', 100, '3', 801),
+    ('4', 30, '4', 30),
+    ('4', 60, None, None),     # 落在两个 chain 的重叠区域 (多重比对)
+    ('4', 120, '4', 570),
+    ('5', 10, None, None),     # 目标为 alt 染色体
+    ('7', 301, '7', 1101),     # 唯一覆盖的块被更长的前序块包含
+    ('7', 256, None, None),    # 嵌套的两个块都覆盖
+    ('9', 10, None, None),     # chain 中没有的染色体
+]
+
+
+@pytest.fixture
+def chain_path(tmp_path):
+    path = tmp_path / 'test.over.chain.gz'
+    with gzip.open(path, 'wt') as f:
+        f.write(CHAIN)
+    return str(path)
+
+
+@pytest.fixture
+def chain(chain_path):
+    return compile_chain_index(chain_path)
+
+
+def _lift(chain):
+    chroms = [c for c, _, _, _ in CASES]
+    positions = [p for _, p, _, _ in CASES]
+    return chain.lift(chroms, positions)
+
+
+def test_lift_cases(chain):
+    names, new_pos, ok = _lift(chain)
+    expected_ok = [dst is not None for _, _, dst, _ in CASES]
+    assert ok.tolist() == expected_ok
+    assert names[ok].tolist() == [dst for _, _, dst, _ in CASES if dst is not None]
+    assert new_pos[ok].tolist() == [pos for _, _, _, pos in CASES if pos is not None]
+    assert (names[~ok] == '').all()
+
+
+def test_index_roundtrip(chain_path, chain):
+    expected = _lift(chain)
+    # 重新打开 (mmap) 的索引、pickle 传给工作进程的索引和不落盘的索引结果相同
+    for other in (load_or_compile(chain_path), pickle.loads(pickle.dumps(chain)),
+                  pickle.loads(pickle.dumps(ChainIndex(*_parse_chain(chain_path))))):
+        for a, b in zip(expected, _lift(other)):
+            np.testing.assert_array_equal(a, b)
+    assert len(chain) == 8
+
+
+def test_liftover_chunk_filters(chain):
+    chunk = pd.DataFrame({
+        'CHR': ['chr1', '1', '2', '1', '4', '1'],
+        'BP': [101, 161, 1, np.nan, 60, 190],
+        'SNP': ['rs1', 'rs2', 'rs3', 'rs4', 'rs5', 'rs6'],
+        'A1': ['A', 'C', 'G', 'T', 'A', 'C'],
+        'A2': ['G', 'T', 'A', 'C', 'G', 'T'],
+        'P': [0.1, 0.2, 0.3, 0.4, 0.5, np.nan],
+    })
+    out, counts = liftover_chunk(chunk, chain)
+    # BP 为空的行总是被移除；输出保持输入的 'chr' 前缀风格，等位基因不变
+    assert counts == {'na': 1, 'unmapped': 1}
+    assert out['SNP'].tolist() == ['rs1', 'rs2', 'rs3', 'rs6']
+    assert out['CHR'].tolist() == ['chr1', '1', '3', '1']
+    assert out['BP'].tolist() == [501, 571, 900, 600]
+    assert out['A1'].tolist() == ['A', 'C', 'G', 'C']
+
+    out, counts = liftover_chunk(chunk, chain, mhc_region=('3', 850, 950), drop_na=True)
+    assert counts == {'na': 2, 'unmapped': 1, 'mhc': 1}
+    assert out['SNP'].tolist() == ['rs1', 'rs2']
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+把 IEU OpenGWAS 的 GWAS-VCF 文件 (*.vcf.gz) 流式转换为标准格式 (CHR, BP, SNP, A1, A2, P, BETA, SE, FRQ, N)。
+
+与原来 vcf2gwas.sh 中的 VariantAnnotation::readVcf + MungeSumstats:::vcf2df 不同，这里不把整个 VCF 读入内存：
+先跳过 '##' 元信息行，再按块读取数据行 (只读取 CHROM/POS/ID/REF/ALT/FORMAT/样本 这几列)，
+按 FORMAT 拆分样本列取出 ES/SE/LP/AF，向量化计算 P = 10^-LP 后立即写出，峰值内存只与块大小有关。
+LP 超过约 307 时 10^-LP 在 float64 中下溢为 0，这些行另外保留 LP 列，写出时 P 列由 LP 还原为 1e-400 形式的文本
+(见 sumstats_schema.py)，不会被下游的 P > 0 过滤删除。
+列的对应关系与原 R 脚本一致: A1 = ALT, A2 = REF, BETA = ES, FRQ = AF, N 为命令行给出的总样本量。
+
+用法:
+    python vcf2gwas.py aaa.vcf.gz 389394 bbb.vcf.gz 387483 --workers 2
+"""
+
+import argparse
+import gzip
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from sumstats_io import OUTPUT_COMPRESSIONS, OUTPUT_FORMATS, STANDARD_COLUMNS, SumstatsWriter, output_path
+from sumstats_schema import LP_COLUMN, parse_floats, pvalues_from_lp
+
+CHUNK_SIZE = 500000
+# 需要从 FORMAT/样本列中取出的字段
+FORMAT_FIELDS = ('ES', 'SE', 'LP', 'AF')
+# VCF 固定列中需要读取的列: CHROM POS ID REF ALT ... FORMAT 样本
+_VCF_COLUMNS = [0, 1, 2, 3, 4, 8, 9]
+_VCF_NAMES = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'FORMAT', 'SAMPLE']
+
+
+def _open_text(path):
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def count_meta_lines(vcf_path):
+    """统计文件开头 '##' 元信息行的数量，并确认下一行是 '#CHROM' 表头。"""
+    n = 0
+    with _open_text(vcf_path) as f:
+        for line in f:
+            if line.startswith('##'):
+                n += 1
+                continue
+            if not line.startswith('#CHROM'):
+                raise ValueError("不是有效的 VCF 文件 (未找到 #CHROM 表头行)")
+            if len(line.rstrip('\n').split('\t')) < 10:
+                raise ValueError("VCF 文件中没有样本列，无法读取 ES/SE/LP/AF")
+            return n
+    raise ValueError("不是有效的 VCF 文件 (未找到 #CHROM 表头行)")
+
+
+def extract_format_fields(format_col, sample_col, fields=FORMAT_FIELDS):
+    """
+    按 FORMAT 列拆分样本列，返回包含 fields 各列的 DataFrame (字符串，缺失为 NA)。
+    同一块中 FORMAT 通常完全相同，因此按不同的 FORMAT 取值分组，每组只做一次向量化拆分。
+    """
+    result = pd.DataFrame(index=sample_col.index, columns=list(fields), dtype=object)
+    for fmt, rows in format_col.groupby(format_col, sort=False).groups.items():
+        keys = fmt.split(':')
+        wanted = [(field, keys.index(field)) for field in fields if field in keys]
+        if not wanted:
+            continue
+        parts = sample_col.loc[rows].str.split(':', expand=True)
+        for field, position in wanted:
+            if position < parts.shape[1]:
+                result.loc[rows, field] = parts[position]
+    return result.replace('.', np.nan)
+
+
+def vcf_chunk_to_sumstats(chunk, n_value):
+    """把一块 VCF 数据行转换为标准格式的 DataFrame。"""
+    fields = extract_format_fields(chunk['FORMAT'], chunk['SAMPLE'])
+    p, lp = pvalues_from_lp(fields['LP'])
+    df = pd.DataFrame({
+        'CHR': chunk['CHROM'].to_numpy(),
+        'BP': chunk['POS'].to_numpy(),
+        'SNP': chunk['ID'].replace('.', np.nan).to_numpy(),
+        'A1': chunk['ALT'].to_numpy(),
+        'A2': chunk['REF'].to_numpy(),
+        # P = 10^-LP (LP 为 -log10 P)，下溢的行保留 LP
+        'P': p,
+        LP_COLUMN: lp,
+        'BETA': parse_floats(fields['ES']),
+        'SE': parse_floats(fields['SE']),
+        'FRQ': parse_floats(fields['AF']),
+        'N': n_value,
+    })
+    return df[STANDARD_COLUMNS[:6] + [LP_COLUMN] + STANDARD_COLUMNS[6:]]
+
+
+def convert_vcf(vcf_path, n_value, output_filename, compress='none', threads=1, out_format='tsv',
+                chunk_size=CHUNK_SIZE):
+    """
+    流式转换单个 VCF 文件。输出先写入临时文件，完成后再改名。
+    返回状态信息字符串 (以 成功/错误 开头)。
+    """
+    tmp_path = output_filename + '.tmp'
+    try:
+        n_meta = count_meta_lines(vcf_path)
+        reader = pd.read_csv(
+            vcf_path, sep='\t', skiprows=n_meta, header=0, usecols=_VCF_COLUMNS,
+            dtype=str, chunksize=chunk_size, na_filter=False
+        )
+        writer = SumstatsWriter(tmp_path, compress=compress, threads=threads, out_format=out_format)
+        rows = 0
+        with open(tmp_path, 'wb') as out_file:
+            for chunk in reader:
+                chunk.columns = _VCF_NAMES
+                chunk['POS'] = pd.to_numeric(chunk['POS'], errors='coerce').astype('Int64')
+                df = vcf_chunk_to_sumstats(chunk, n_value)
+                out_file.write(writer.encode(df, header=rows == 0, offset=out_file.tell()))
+                rows += len(df)
+            writer.finish(out_file)
+        writer.close()
+
+        os.replace(tmp_path, output_filename)
+        if os.path.exists(tmp_path + '.tbi'):
+            os.replace(tmp_path + '.tbi', output_filename + '.tbi')
+        return f"成功处理: {vcf_path} -> {output_filename} ({rows} 行)"
+    except Exception as e:
+        for path in (tmp_path, tmp_path + '.tbi'):
+            if os.path.exists(path):
+                os.remove(path)
+        return f"错误: 处理文件 {vcf_path} 时失败: {e}"
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="将 IEU OpenGWAS 的 VCF 文件流式转换为标准GWAS格式。")
+    parser.add_argument('pairs', nargs='+', metavar='VCF N',
+                        help="成对给出的 VCF 文件路径和总样本量，例如: aaa.vcf.gz 389394 bbb.vcf.gz 387483")
+    parser.add_argument('--workers', type=int, default=1, help="并行处理文件的进程数。默认为 1。")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f"每块读取的行数。默认为 {CHUNK_SIZE}。")
+    parser.add_argument('--compress', choices=OUTPUT_COMPRESSIONS, default='none',
+                        help="输出压缩方式。'bgzf' 输出 XXX.txt.gz 并生成 tabix 索引。默认为 'none'。")
+    parser.add_argument('--threads', type=int, default=1, help="每个文件用于 BGZF 块压缩的线程数。默认为 1。")
+    parser.add_argument('--out-format', choices=OUTPUT_FORMATS, default='tsv', help="输出格式。默认为 'tsv'。")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if len(args.pairs) % 2 != 0:
+        print("[!] 错误: 参数必须成对出现: <vcf文件> <N样本数> ...", file=sys.stderr)
+        sys.exit(1)
+
+    jobs = []
+    results = []
+    for vcf_path, n_sample in zip(args.pairs[::2], args.pairs[1::2]):
+        if not os.path.isfile(vcf_path):
+            results.append(f"错误: 文件 '{vcf_path}' 不存在，已跳过。")
+            continue
+        if not n_sample.isdigit():
+            results.append(f"错误: '{vcf_path}' 的样本数 '{n_sample}' 不是整数，已跳过。")
+            continue
+        # 输出命名与原脚本一致: aaa.vcf.gz -> aaa.txt (写到当前目录)
+        base = os.path.basename(vcf_path)
+        for ext in ('.gz', '.bgz', '.vcf'):
+            if base.endswith(ext):
+                base = base[:-len(ext)]
+        output_filename = output_path(f"{base}.txt", args.compress, args.out_format)
+        print(f"正在处理: {vcf_path}，样本数: {n_sample}，输出文件: {output_filename}")
+        jobs.append((vcf_path, int(n_sample), output_filename, args.compress, args.threads, args.out_format,
+                     args.chunk_size))
+
+    workers = max(1, min(args.workers, len(jobs))) if jobs else 1
+    if workers == 1:
+        for job in jobs:
+            results.append(convert_vcf(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(convert_vcf, *job): job[0] for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(f"错误: 处理文件 {futures[future]} 时失败: {e}")
+
+    print("---")
+    for r in results:
+        print(("✅ " if r.startswith("成功") else "❌ ") + r)
+    print("所有文件处理完毕。")
+    if any(r.startswith("错误") for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()